@@ -1,22 +1,122 @@
 from __future__ import annotations
-import base64
-import os, uuid, json
-from typing import List, Optional, Dict, Any
-from fastapi import FastAPI, Query, UploadFile, File, Form, Depends, HTTPException
+import asyncio, base64, copy
+import hashlib, hmac, os, sys, threading, uuid, json
+from typing import Any, Callable, Dict, List, Optional
+from fastapi import FastAPI, Query, UploadFile, File, Form, Depends, Header, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.routing import APIRoute
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from layers.app_common.python.shared.config import settings
-from layers.app_common.python.shared.dynamo import ensure_conversation, list_products_by_owner, put_message
-from layers.app_common.python.shared.s3 import put_object, presign_get
-from layers.app_common.python.agents.dream_interpret import interpret_dream
-from layers.app_common.python.agents.design_generate import generate_assets
-from layers.app_common.python.agents.listing_publish import create_product_and_listing
+
+# El layer se importa igual que en Lambda (`shared.*`, `agents.*`): así la API y los
+# agentes comparten una sola copia de cada módulo (tablas, traza activa, etc.).
+_LAYER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "layers", "app_common", "python")
+if _LAYER not in sys.path:
+    sys.path.insert(0, _LAYER)
+
+from shared import (
+    tracing, usage, admission, deadline, feed, ddbjson, counters, search, export, idempotency, discovery, profiling,
+)
+from shared.admission import AdmissionRejected
+from shared.idempotency import IdempotencyConflict
+from shared.config import settings
+from shared.dynamo import (
+    list_products_by_owner, get_usage_items, get_feed_version, get_product, get_products, get_listing,
+    get_conversation,
+)
+from shared.pipeline import StepFailed
+from shared.s3 import put_object, presign_get
+from agents.create_flow import presign_media, run_create
+from agents.listing_publish import edit_listing
+from agents.refine_flow import run_refine
+from agents import batch, book_write
+
+class _ProfiledRoute(APIRoute):
+    """Los endpoints síncronos corren en el pool de FastAPI: ese hilo se suma al perfilado de la request."""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        # después de que FastAPI analizó la firma: sólo cambia qué se llama en el pool
+        if not asyncio.iscoroutinefunction(self.dependant.call):
+            self.dependant.call = profiling.attach(self.dependant.call)
 
 app = FastAPI(title="KaiKashi DreamForge API", version="1.0.0")
+app.router.route_class = _ProfiledRoute
+
+@app.middleware("http")
+async def server_timing(request: Request, call_next):
+    token = tracing.start(request.url.path)
+    if token is None:
+        return await call_next(request)
+    try:
+        response = await call_next(request)
+    finally:
+        trace = tracing.finish(token)
+    header = tracing.server_timing(trace)
+    if header:
+        response.headers["Server-Timing"] = header
+    return response
+
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    """`X-Profile: 1` + X-Admin-Token (o PROFILE_SAMPLE_RATE): perfil al bucket de assets, clave en `X-Profile-Key`."""
+    session = profiling.start(request.url.path, flag=request.headers.get("x-profile"),
+                              admin_token=request.headers.get("x-admin-token"))
+    if session is None:
+        return await call_next(request)
+    try:
+        response = await call_next(request)
+    except BaseException:
+        session.stop()
+        threading.Thread(target=session.save, daemon=True).start()
+        raise
+    body = response.body_iterator
+
+    async def _profiled_body():
+        # el cuerpo (p.ej. NDJSON de los lotes) se genera al enviarlo: el perfil cierra al terminar
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            session.stop()
+            threading.Thread(target=session.save, daemon=True).start()
+
+    response.body_iterator = _profiled_body()
+    response.headers["X-Profile-Key"] = session.prefix
+    return response
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected(_request: Request, exc: AdmissionRejected):
+    return JSONResponse(
+        status_code=429,
+        content={"error": "too_many_requests", "reason": exc.reason, "retry_after": exc.retry_after},
+        headers={"Retry-After": str(int(exc.retry_after + 0.999))},
+    )
+
+@app.exception_handler(IdempotencyConflict)
+async def idempotency_conflict(_request: Request, exc: IdempotencyConflict):
+    if exc.reason == "key_reused":
+        return JSONResponse(status_code=422, content={
+            "error": "idempotency_key_reused",
+            "detail": "Idempotency-Key ya usada con otro contenido",
+        })
+    return JSONResponse(
+        status_code=409,
+        content={"error": "request_in_progress", "retry_after": exc.retry_after},
+        headers={"Retry-After": str(int(exc.retry_after + 0.999))},
+    )
 
 # --------- Auth 
 def get_user_id(auth_bypass: bool = getattr(settings, "auth_bypass", True)) -> str:
     return "user_dev_001" if auth_bypass else "user_unknown"
 
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """`/admin/*` y diagnósticos: cabecera X-Admin-Token = ADMIN_TOKEN. Sin token configurado, cerrado (también con AUTH_BYPASS)."""
+    if not settings.admin_token:
+        raise HTTPException(status_code=403, detail="ADMIN_TOKEN no configurado")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, settings.admin_token):
+        raise HTTPException(status_code=403, detail="admin requerido")
+
 def _enc(d: Optional[Dict[str, Any]]) -> Optional[str]:
     if not d:
         return None
@@ -30,6 +130,9 @@ def _dec(s: Optional[str]) -> Optional[Dict[str, Any]]:
     except Exception:
         return None
 
+def _json(body: Any, headers: Optional[Dict[str, str]] = None) -> Response:
+    return Response(content=ddbjson.dumps_bytes(body), media_type="application/json", headers=headers)
+
 def _infer_type(key: str) -> str:
     k = (key or "").lower()
     if k.endswith((".png", ".jpg", ".jpeg", ".svg", ".webp")):
@@ -57,16 +160,11 @@ def ping():
         "stage": getattr(settings, "stage", "dev"),
     }
 
-@app.get("/products")
-def products_feed(
-    owner: Optional[str] = Query(None, description="Por defecto: usuario actual"),
-    limit: int = Query(20, ge=1, le=100),
-    page_token: Optional[str] = Query(None, description="Cursor base64"),
-    status: Optional[str] = Query(None, description="Filtra por status del producto (ej: draft)"),
-    user_id: str = Depends(get_user_id),
-):
+@app.get("/admission", dependencies=[Depends(require_admin)])
+def admission_stats():
+    return {"text": admission.text.stats(), "image": admission.image.stats()}
 
-    owner_id = owner or user_id
+def _render_products_page(owner_id: str, limit: int, page_token: Optional[str], status: Optional[str]) -> Dict[str, Any]:
     cursor = _dec(page_token)
     items, last_key = list_products_by_owner(
         owner_id=owner_id, limit=limit, cursor=cursor, status=status, require_media=True
@@ -89,6 +187,7 @@ def products_feed(
             "status": p.get("status","draft"),
             "owner_id": p.get("owner_id"),
             "media": media,
+            "listing": p.get("listing"),
         })
 
     return {
@@ -98,6 +197,160 @@ def products_feed(
         "applied_filters": {"owner": owner_id, "status": status, "limit": limit},
     }
 
+@app.get("/products")
+def products_feed(
+    request: Request,
+    owner: Optional[str] = Query(None, description="Por defecto: usuario actual"),
+    limit: int = Query(20, ge=1, le=100),
+    page_token: Optional[str] = Query(None, description="Cursor base64"),
+    status: Optional[str] = Query(None, description="Filtra por status del producto (ej: draft)"),
+    user_id: str = Depends(get_user_id),
+):
+
+    owner_id = owner or user_id
+    with feed.prefetcher.serving():
+        try:
+            version: Optional[int] = get_feed_version(owner_id)
+        except Exception:
+            version = None
+
+        if version is None:
+            return _json(_render_products_page(owner_id, limit, page_token, status))
+
+        epoch = feed.presign_epoch()
+        etag = feed.etag_for(owner_id, version, status=status, cursor=page_token, limit=limit, view="api", epoch=epoch)
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if feed.etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        key = feed.page_key(owner_id, version, status=status, cursor=page_token, limit=limit, view="api", epoch=epoch)
+        page = feed.page_cache.get(key)
+        if page is None:
+            page = feed.prefetcher.take(key)
+            if page is None:
+                page = _render_products_page(owner_id, limit, page_token, status)
+            feed.page_cache.set(key, page)
+
+        # scroll infinito: dejar lista la página siguiente
+        nxt = page.get("next_page_token")
+        if nxt:
+            nkey = feed.page_key(owner_id, version, status=status, cursor=nxt, limit=limit, view="api", epoch=epoch)
+            feed.prefetcher.schedule(nkey, lambda: _render_products_page(owner_id, limit, nxt, status))
+        return _json(page, headers)
+
+@app.get("/products/prefetch", dependencies=[Depends(require_admin)])
+def products_prefetch_stats():
+    return {"prefetch": feed.prefetcher.stats(), "page_cache": feed.page_cache.stats()}
+
+def _media_for(keys: List[str]) -> List[Dict[str, Any]]:
+    media = []
+    for mk in keys or []:
+        try:
+            url = presign_get(settings.s3_bucket_assets, mk)
+        except Exception:
+            url = None
+        media.append({"key": mk, "url": url, "type": _infer_type(mk)})
+    return media
+
+@app.get("/products/search")
+def products_search(
+    q: str = Query("", description="Palabras de título/tags/estilo (todas deben aparecer)"),
+    tags: Optional[str] = Query(None, description="Tags exactos separados por coma"),
+    product_type: Optional[str] = Query(None, alias="type", description="product_type (poster, tshirt, book…)"),
+    limit: int = Query(20, ge=1, le=100),
+):
+    """Índice invertido: intersección de posting lists, ordenado por relevancia y recencia."""
+    tag_list = [t for t in (tags or "").split(",") if t.strip()]
+    if not search.query_tokens(q, tag_list, product_type or ""):
+        raise HTTPException(status_code=400, detail="Indica q, tags o type")
+    hits = search.search(q, tag_list, product_type or "", limit=limit)
+    products = get_products([h["product_id"] for h in hits])
+    out: List[Dict[str, Any]] = []
+    for h in hits:
+        p = products.get(h["product_id"])
+        if not p:
+            continue
+        out.append({
+            "product_id": p["product_id"],
+            "title": p.get("title", ""),
+            "description": p.get("description", ""),
+            "status": p.get("status", "draft"),
+            "owner_id": p.get("owner_id"),
+            "tags": p.get("tags") or [],
+            "product_type": p.get("product_type") or "",
+            "media": _media_for(p.get("media_keys") or []),
+            "listing": p.get("listing"),
+            "score": h["score"],
+        })
+    return _json({"items": out, "count": len(out),
+                  "applied_filters": {"q": q, "tags": tag_list, "type": product_type, "limit": limit}})
+
+@app.get("/products/{product_id}")
+def product_detail(product_id: str):
+    """Product + listing por clave (cache read-through; sin Scan)."""
+    p = get_product(product_id)
+    if not p:
+        raise HTTPException(status_code=404, detail="Producto no encontrado")
+    media = _media_for(p.get("media_keys") or [])
+    summary = p.pop("listing", None) or {}
+    listing = get_listing(summary["listing_id"]) if summary.get("listing_id") else None
+    return _json({"product": {**p, "media": media}, "listing": listing or (summary or None)})
+
+class ListingPatch(BaseModel):
+    price_cents: Optional[int] = None
+    status: Optional[str] = None
+
+@app.patch("/listings/{listing_id}")
+def patch_listing(listing_id: str, req: ListingPatch, user_id: str = Depends(get_user_id)):
+    """Precio/status de una listing propia; el resumen del product, el ETag del feed y el feed público se actualizan."""
+    try:
+        listing = edit_listing(user_id, listing_id, req.model_dump(exclude_none=True))
+    except LookupError:
+        raise HTTPException(status_code=404, detail="listing not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _json(listing)
+
+def _render_discovery_page(limit: int, page_token: Optional[str]) -> Dict[str, Any]:
+    cards, nxt = discovery.page(limit, _dec(page_token))
+    out: List[Dict[str, Any]] = []
+    for c in cards:
+        preview = _media_for([c["preview_key"]])[0] if c.get("preview_key") else None
+        out.append({
+            "product_id": c["product_id"],
+            "owner_id": c.get("owner_id"),
+            "title": c.get("title", ""),
+            "product_type": c.get("product_type", ""),
+            "preview": preview,
+            "price_cents": c.get("price_cents"),
+            "currency": c.get("currency"),
+            "published_at": c.get("published_at"),
+        })
+    return {"items": out, "count": len(out), "has_more": nxt is not None, "next_page_token": _enc(nxt)}
+
+@app.get("/feed")
+def discovery_feed(
+    limit: int = Query(20, ge=1, le=100),
+    page_token: Optional[str] = Query(None, description="Cursor base64"),
+):
+    """Lo último publicado (todos los usuarios): un Query por página a la tabla materializada."""
+    key = (limit, page_token or "")
+    page = discovery.pages.get(key)
+    if page is None:
+        page = _render_discovery_page(limit, page_token)
+        discovery.pages.set(key, page)
+    return _json(page, {"Cache-Control": f"public, max-age={int(settings.discovery_cache_ttl_s)}"})
+
+_CREATE_STEP_ERRORS = {
+    "upload": "Error subiendo archivo",
+    "conversation": "Error creando conversación",
+    "user_message": "Error creando conversación",
+    "brief": "Error interpretando idea",
+    "brief_message": "Error interpretando idea",
+    "assets": "Error generando assets",
+    "media": "Error generando assets",
+    "design_message": "Error generando assets",
+}
+
 @app.post("/create")
 async def create_from_idea(
     q: str = Form(..., description="Idea/Sueño del usuario en texto"),
@@ -109,110 +362,216 @@ async def create_from_idea(
         None, description="Título opcional para la conversación"
     ),
     user_id: str = Depends(get_user_id),
+    idempotency_key: Optional[str] = Header(None, description="Reintentos con la misma key reciben la misma respuesta"),
 ):
-   
-    uploaded_key: Optional[str] = None
+    if idempotency_key is not None and not idempotency.valid_key(idempotency_key):
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key inválida (1-{idempotency.MAX_KEY_LEN} caracteres)")
+
+    upload_fn: Optional[Callable[[], str]] = None
     uploaded_ct: Optional[str] = None
+    content = b""
     if file:
         uploaded_ct = file.content_type or "application/octet-stream"
         safe_name = file.filename or "upload.bin"
         key = f"uploads/{user_id}/{uuid.uuid4().hex}_{safe_name}"
         content = await file.read()
-        try:
+
+        def _upload() -> str:
             put_object(settings.s3_bucket_uploads, key, content, uploaded_ct)
-            uploaded_key = key
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error subiendo archivo: {e}")
+            return key
+        upload_fn = _upload
+
+    def execute() -> Dict[str, Any]:
+        return _create(q, user_id, price_cents, conversation_title, upload_fn, uploaded_ct)
 
+    fp = idempotency.fingerprint(q, price_cents, conversation_title,
+                                 file.filename if file else None, hashlib.sha256(content).hexdigest())
+    # el plazo viaja en el contexto (run_in_threadpool lo copia) hasta interpret/assets y
+    # acota también la espera de un duplicado a la ejecución en vuelo (bloqueante: fuera del loop)
+    with deadline.scope(settings.api_request_budget_s):
+        body, replayed = await run_in_threadpool(profiling.attach(idempotency.run),
+                                                 user_id, idempotency_key, fp, execute)
+    if not replayed:
+        return body
+    # las URLs prefirmadas de la respuesta guardada pueden haber vencido; si se coalesció en
+    # proceso, `body` es el mismo dict que devuelve el líder: se re-firma sobre una copia
+    body = copy.deepcopy(body)
+    design = body.get("design")
+    if isinstance(design, dict) and design.get("media"):
+        design["media"] = presign_media([m["key"] for m in design["media"]])
+        body["preview_url"] = _preview_url(design["media"])
+    return JSONResponse(body, headers={"Idempotent-Replayed": "true"})
+
+def _preview_url(media: List[Dict[str, Any]]) -> Optional[str]:
+    for pref in ("image", "video", "pdf"):
+        pick = next((m for m in media if m["type"] == pref and m["url"]), None)
+        if pick:
+            return pick["url"]
+    return None
+
+def _create(q: str, user_id: str, price_cents: int, conversation_title: Optional[str],
+            upload, uploaded_ct: Optional[str]) -> Dict[str, Any]:
     conversation_id = f"conv_{uuid.uuid4().hex[:12]}"
-    try:
-        ensure_conversation(
-            conversation_id=conversation_id,
-            user_id=user_id,
-            model_id=settings.bedrock_text_model_id,
-            title=conversation_title or (q[:64] + ("…" if len(q) > 64 else "")),
-        )
-        put_message(
-            conversation_id,
-            role="user",
-            content=q,
-            media_keys=[uploaded_key] if uploaded_key else None,
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error creando conversación: {e}")
+    with usage.scope(user_id=user_id, conversation_id=conversation_id) as use:
+        try:
+            out = run_create(
+                q, user_id,
+                conversation_id=conversation_id,
+                price_cents=price_cents,
+                title=conversation_title,
+                upload=upload,
+                # libros: los capítulos se escriben después, sin bloquear la respuesta
+                book="background" if settings.book_background else None,
+            )
+        except StepFailed as e:
+            msg = _CREATE_STEP_ERRORS.get(e.step, "Error creando producto/listing")
+            raise HTTPException(status_code=500, detail=f"{msg}: {e.error}")
 
-    try:
-        brief = interpret_dream(q)
-        put_message(conversation_id, role="assistant", content=json.dumps(brief, ensure_ascii=False))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error interpretando idea: {e}")
+        if out["clarify"]:
+            # nada que generar: se devuelve la pregunta del brief
+            return {
+                "conversation_id": out["conversation_id"],
+                "uploaded": {"key": out["uploaded_key"], "content_type": uploaded_ct},
+                "brief": out["brief"],
+                "clarify": True,
+                "message": out["brief"].get("notes", ""),
+                "timeline": out["timeline"],
+                "usage": use.totals(),
+            }
 
-    try:
-        design = generate_assets(
-            design_prompt=brief.get("design_prompt", q),
-            brief=brief,
-            user_id=user_id,
-        )
-
-        all_keys: List[str] = []
-        for k in ["image_key","pdf_key","docx_key","rtf_key","text_key","video_key","model3d_key"]:
-            v = design.get(k)
-            if v:
-                all_keys.append(v)
-        if design.get("media_keys"):
-            for v in design["media_keys"]:
-                if v not in all_keys:
-                    all_keys.append(v)
-
-        media: List[Dict[str, Any]] = []
-        for mk in all_keys:
-            try:
-                url = presign_get(settings.s3_bucket_assets, mk)
-            except Exception:
-                url = None
-            media.append({"key": mk, "url": url, "type": _infer_type(mk)})
+        media = out["media"]
+        return {
+            "conversation_id": conversation_id,
+            "uploaded": {"key": out["uploaded_key"], "content_type": uploaded_ct},
+            "brief": out["brief"],
+            "design": {**out["design"], "media": media},
+            "ids": out["ids"],
+            "price_cents": price_cents,
+            "currency": "USD",
+            "preview_url": _preview_url(media),
+            "timeline": out["timeline"],
+            "usage": use.totals(),
+        }
 
-        put_message(
-            conversation_id,
-            role="assistant",
-            content=json.dumps({"design": {**design, "media": media}}, ensure_ascii=False),
-            media_keys=all_keys or None,
-        )
+class RefineRequest(BaseModel):
+    q: str
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error generando assets: {e}")
+@app.post("/conversations/{conversation_id}/refine")
+async def refine_conversation(conversation_id: str, req: RefineRequest, user_id: str = Depends(get_user_id)):
+    """Otro turno sobre el producto de la conversación ("igual pero más oscuro")."""
+    if not req.q.strip():
+        raise HTTPException(status_code=400, detail="missing q")
+    with deadline.scope(settings.api_request_budget_s), \
+            usage.scope(user_id=user_id, conversation_id=conversation_id) as use:
+        try:
+            out = await run_in_threadpool(
+                profiling.attach(run_refine), conversation_id, user_id, req.q.strip(),
+                book="background" if settings.book_background else None,
+            )
+        except LookupError:
+            raise HTTPException(status_code=404, detail="conversation not found")
+        except ValueError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+    return {**out, "user_id": user_id, "usage": use.totals()}
 
-    try:
-        ids = create_product_and_listing(
-            user_id=user_id,
-            package=design["package"],
-            media_keys=all_keys, 
-            price_cents=price_cents,
-        )
-        put_message(conversation_id, role="assistant", content=json.dumps({"ids": ids}, ensure_ascii=False))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error creando producto/listing: {e}")
+@app.get("/conversations/{conversation_id}/book")
+def book_progress(conversation_id: str, user_id: str = Depends(get_user_id)):
+    """Progreso del libro que se escribe en segundo plano tras /create."""
+    conv = get_conversation(conversation_id, ("user_id", "meta"))
+    if not conv or conv.get("user_id") != user_id:
+        raise HTTPException(status_code=404, detail="conversation not found")
+    snap = book_write.get(conversation_id) or (conv.get("meta") or {}).get("book")
+    if not snap:
+        raise HTTPException(status_code=404, detail="la conversación no tiene libro")
+    return snap
+
+class BatchRequest(BaseModel):
+    ideas: List[str]
+    concurrency: Optional[int] = None
+
+def _ndjson(lines) -> StreamingResponse:
+    return StreamingResponse((ddbjson.dumps(x) + "\n" for x in lines), media_type="application/x-ndjson")
+
+def _check_batch(req: BatchRequest):
+    if not req.ideas:
+        raise HTTPException(status_code=400, detail="ideas vacío")
+    if len(req.ideas) > settings.batch_max_items:
+        raise HTTPException(status_code=413, detail=f"máximo {settings.batch_max_items} ideas por lote")
+
+@app.post("/interpret/batch")
+def interpret_batch(req: BatchRequest, user_id: str = Depends(get_user_id)):
+    """Una línea NDJSON por idea (en orden de término) y una final con el resumen."""
+    _check_batch(req)
+    batch.charge(user_id, req.ideas, (admission.text,))
+    return _ndjson(batch.run_batch(req.ideas, lambda q: batch.interpret_item(q, user_id), req.concurrency))
+
+@app.post("/design/batch")
+def design_batch(req: BatchRequest, user_id: str = Depends(get_user_id)):
+    """Brief + assets por idea, en NDJSON; no crea product/listing."""
+    _check_batch(req)
+    batch.charge(user_id, req.ideas, (admission.text, admission.image))
+    return _ndjson(batch.run_batch(req.ideas, lambda q: batch.design_item(q, user_id), req.concurrency))
+
+class ExportRequest(BaseModel):
+    run_id: Optional[str] = None        # mismo run_id = reanudar
+    tables: Optional[List[str]] = None
+    segments: Optional[int] = None
+    workers: Optional[int] = None
+    max_rcu: Optional[float] = None
+    format: Optional[str] = None
 
-    preview_url: Optional[str] = None
+@app.post("/admin/export", status_code=202, dependencies=[Depends(require_admin)])
+def start_export(req: ExportRequest):
+    """Lanza (o reanuda) un export de tablas al bucket de assets, bajo `EXPORT_PREFIX/<run_id>/`."""
     try:
-        pref_order = ["image", "video", "pdf"]
-        pick = None
-        for pref in pref_order:
-            pick = next((m for m in media if m["type"] == pref and m["url"]), None)
-            if pick:
-                break
-        if pick:
-            preview_url = pick["url"]
-    except Exception:
-        preview_url = None
+        job = export.start_job(req.run_id, tables=req.tables, segments=req.segments, workers=req.workers,
+                               max_rcu=req.max_rcu, fmt=req.format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return job.snapshot()
 
-    return {
-        "conversation_id": conversation_id,
-        "uploaded": {"key": uploaded_key, "content_type": uploaded_ct},
-        "brief": brief,
-        "design": {**design, "media": media},
-        "ids": ids,
-        "price_cents": price_cents,
-        "currency": "USD",
-        "preview_url": preview_url,
-    }
+@app.get("/admin/export/{run_id}", dependencies=[Depends(require_admin)])
+def export_status(run_id: str):
+    job = export.get_job(run_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Export no encontrado en este proceso")
+    return job.snapshot()
+
+@app.delete("/admin/export/{run_id}", dependencies=[Depends(require_admin)])
+def stop_export(run_id: str):
+    """Detiene el export; lo escrito queda y se reanuda con POST y el mismo run_id."""
+    job = export.get_job(run_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Export no encontrado en este proceso")
+    job.stop()
+    return job.snapshot()
+
+@app.post("/admin/feed/compact", dependencies=[Depends(require_admin)])
+def compact_feed(
+    dry_run: bool = Query(False, description="Sólo lista los buckets que se borrarían"),
+    retention_days: Optional[int] = Query(None, ge=0, description="Por defecto DISCOVERY_RETENTION_DAYS"),
+):
+    """Lo mismo que el Lambda programado `feed_compact`: borra los buckets viejos del feed público."""
+    return discovery.compact(retention_days=retention_days, dry_run=dry_run)
+
+@app.get("/stats", dependencies=[Depends(require_admin)])
+def stats():
+    """Contadores del proceso (caminos de interpret/create, etc.)."""
+    return counters.snapshot_all()
+
+@app.get("/usage")
+def usage_report(
+    conversation_id: Optional[str] = Query(None, description="Uso de una conversación; por defecto, del usuario"),
+    user_id: str = Depends(get_user_id),
+):
+    if conversation_id:
+        conv = get_conversation(conversation_id, ("user_id",))
+        if not conv or conv.get("user_id") != user_id:
+            raise HTTPException(status_code=404, detail="conversation not found")
+    usage.flush()
+    scope_id = f"conv#{conversation_id}" if conversation_id else f"user#{user_id}"
+    try:
+        items = get_usage_items(scope_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error leyendo uso: {e}")
+    return {"scope": scope_id, **usage.summarize(items)}
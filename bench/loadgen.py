@@ -0,0 +1,360 @@
+"""
+Generador de carga end-to-end contra sustitutos locales (moto + Bedrock falso).
+
+Ejecuta `api/main.py` (ASGI en un único event loop, como uvicorn con 1 worker) o
+los handlers Lambda (pool de hilos) y reporta throughput, p50/p95/p99 por
+endpoint y por etapa, y tasa de errores (los 429 de la admisión aparte).
+
+Las creaciones se reparten entre los `user_load_*` (en la API, identidad por request
+vía `dependency_overrides`). La admisión está apagada salvo `--admission on`: así se
+mide el sistema y no la cuota.
+
+Ejemplos:
+    python bench/loadgen.py --target api --mix create=1,products=4 --concurrency 16 --requests 400
+    python bench/loadgen.py --target lambda --mix create=1,listing=3 --concurrency 32 --duration 60 \\
+        --first-token lognormal:median=900,sigma=0.5 --chunk-interval const:20 --chunks 40 \\
+        --image-latency lognormal:median=4000,sigma=0.3 --throttle-rate 0.05 --aws-latency uniform:5,15
+"""
+from __future__ import annotations
+import argparse, asyncio, contextlib, contextvars, functools, importlib, io, json, os, random, sys, threading, time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from stubs import ROOT, BedrockStubConfig, LatencySpec, install_local_aws, load_module  # noqa: E402
+
+IDEAS = [
+    "Hazme un póster de la selva con un jaguar y la luna",
+    "Create a retro poster of a cosmic fox over a neon grid",
+    "crear libro educativo sobre la Guerra Fría",
+    "una camiseta con un colibrí geométrico",
+    "a sticker pack of origami dragons",
+    "hola",
+]
+
+_endpoint: contextvars.ContextVar[str] = contextvars.ContextVar("loadgen_endpoint", default="*")
+
+class Recorder:
+    """Acumula latencias (ms) por endpoint y por (endpoint, etapa). Thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.rejected: Dict[str, int] = defaultdict(int)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.stages: Dict[Tuple[str, str], List[float]] = defaultdict(list)
+
+    def request(self, endpoint: str, ms: float, status: int):
+        with self._lock:
+            self.requests[endpoint].append(ms)
+            self.statuses[endpoint][status] += 1
+            if status == 429:
+                self.rejected[endpoint] += 1
+            elif status >= 400:
+                self.errors[endpoint] += 1
+
+    def stage(self, name: str, ms: float):
+        with self._lock:
+            self.stages[(_endpoint.get(), name)].append(ms)
+
+def _pct(xs: List[float], p: float) -> float:
+    if not xs:
+        return 0.0
+    s = sorted(xs)
+    k = max(0, min(len(s) - 1, int(round(p / 100.0 * len(s) + 0.5)) - 1))
+    return s[k]
+
+def _instrument(rec: Recorder, module: Any, names: Dict[str, str]):
+    for attr, stage in names.items():
+        fn = getattr(module, attr, None)
+        if fn is None or getattr(fn, "_loadgen_wrapped", False):
+            continue
+
+        def make(fn=fn, stage=stage):
+            @functools.wraps(fn)
+            def wrapper(*a, **kw):
+                t0 = time.perf_counter()
+                try:
+                    return fn(*a, **kw)
+                finally:
+                    rec.stage(stage, (time.perf_counter() - t0) * 1000)
+            wrapper._loadgen_wrapped = True  # type: ignore[attr-defined]
+            return wrapper
+        setattr(module, attr, make())
+
+_STAGES = {
+    "interpret_dream": "interpret_dream",
+    "generate_assets": "generate_assets",
+    "create_product_and_listing": "publish",
+    "ensure_conversation": "ddb.ensure_conversation",
+    "put_message": "ddb.put_message",
+    "list_products_by_owner": "ddb.list_products",
+    "presign_get": "s3.presign",
+    "put_object": "s3.put_object",
+    "put_product": "ddb.put_product",
+    "put_listing": "ddb.put_listing",
+    "publish_product_listing": "ddb.publish",
+    "batch_get": "ddb.batch_get",
+    "set_product_media": "ddb.product_media",
+    "get_active_listings_by_product": "ddb.listing_lookup",
+}
+
+def _instrument_loaded(rec: Recorder):
+    for name, mod in list(sys.modules.items()):
+        if mod is None:
+            continue
+        if name.endswith(("agents.design_generate", "agents.listing_publish", "agents.dream_interpret",
+                          "agents.create_flow")) \
+                or name in ("api.main",) or name.startswith("loadgen_lambda_"):
+            _instrument(rec, mod, _STAGES)
+
+def _parse_mix(s: str) -> List[Tuple[str, float]]:
+    out = []
+    for part in s.split(","):
+        k, _, w = part.partition("=")
+        out.append((k.strip(), float(w or 1)))
+    return out
+
+def _pick(mix: List[Tuple[str, float]], rng: random.Random) -> str:
+    total = sum(w for _, w in mix)
+    x = rng.random() * total
+    for k, w in mix:
+        x -= w
+        if x <= 0:
+            return k
+    return mix[-1][0]
+
+def _seed_products(n: int, users: List[str]):
+    from agents.listing_publish import create_product_and_listing
+    for i in range(n):
+        uid = users[i % len(users)]
+        create_product_and_listing(
+            user_id=uid,
+            package={"suggested_title": f"Seed {i}", "suggested_description": "seed"},
+            media_keys=[f"assets/{uid}/generated/seed_{i}.png"],
+        )
+
+class _Budget:
+    def __init__(self, requests: Optional[int], duration: Optional[float]):
+        self.left = requests
+        self.deadline = time.perf_counter() + duration if duration else None
+        self._lock = threading.Lock()
+
+    def take(self) -> bool:
+        if self.deadline and time.perf_counter() >= self.deadline:
+            return False
+        with self._lock:
+            if self.left is None:
+                return True
+            if self.left <= 0:
+                return False
+            self.left -= 1
+            return True
+
+# ---------- objetivo: FastAPI
+
+async def _run_api(args, rec: Recorder, users: List[str]) -> float:
+    import httpx
+    from fastapi import Header
+    main = sys.modules.get("api.main") or __import__("api.main", fromlist=["app"])
+
+    # Con AUTH_BYPASS todas las requests serían user_dev_001 (y agotarían su cuota):
+    # cada request declara su usuario de carga en X-Load-User.
+    def load_user(x_load_user: Optional[str] = Header(None)) -> str:
+        return x_load_user or "user_dev_001"
+    main.app.dependency_overrides[main.get_user_id] = load_user
+    mix = _parse_mix(args.mix)
+    budget = _Budget(args.requests, args.duration)
+    transport = httpx.ASGITransport(app=main.app)
+
+    async def worker(wid: int):
+        rng = random.Random((args.seed or 0) * 1000 + wid)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadgen", timeout=None) as client:
+            while budget.take():
+                ep = _pick(mix, rng)
+                token = _endpoint.set(ep)
+                t0 = time.perf_counter()
+                try:
+                    if ep == "create":
+                        r = await client.post("/create", data={"q": rng.choice(IDEAS), "price_cents": "1500"},
+                                              headers={"X-Load-User": rng.choice(users)})
+                    elif ep == "products":
+                        r = await client.get("/products", params={"owner": rng.choice(users), "limit": args.page_size})
+                    else:
+                        raise SystemExit(f"endpoint API desconocido: {ep}")
+                    status = r.status_code
+                except Exception:
+                    status = 599
+                finally:
+                    _endpoint.reset(token)
+                rec.request(ep, (time.perf_counter() - t0) * 1000, status)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(args.concurrency)))
+    return time.perf_counter() - t0
+
+# ---------- objetivo: Lambdas
+
+def _run_lambda(args, rec: Recorder, users: List[str]) -> float:
+    handlers = {
+        "create": load_module("loadgen_lambda_create", os.path.join(ROOT, "lambdas", "create", "index.py")),
+        "listing": load_module("loadgen_lambda_listing", os.path.join(ROOT, "lambdas", "listing", "index.py")),
+        "interpret": load_module("loadgen_lambda_interpret", os.path.join(ROOT, "lambdas", "interpret", "index.py")),
+        "design": load_module("loadgen_lambda_design", os.path.join(ROOT, "lambdas", "design", "index.py")),
+    }
+    _instrument_loaded(rec)
+    mix = _parse_mix(args.mix)
+    budget = _Budget(args.requests, args.duration)
+
+    def event_for(ep: str, rng: random.Random) -> Dict[str, Any]:
+        if ep == "listing":
+            return {"queryStringParameters": {"owner": rng.choice(users), "limit": str(args.page_size)}}
+        return {"body": json.dumps({"q": rng.choice(IDEAS), "user_id": rng.choice(users), "price_cents": 1500})}
+
+    def worker(wid: int):
+        rng = random.Random((args.seed or 0) * 1000 + wid)
+        while budget.take():
+            ep = _pick(mix, rng)
+            if ep not in handlers:
+                raise SystemExit(f"handler Lambda desconocido: {ep}")
+            ctx = contextvars.copy_context()
+            t0 = time.perf_counter()
+
+            def call():
+                _endpoint.set(ep)
+                return handlers[ep].handler(event_for(ep, rng), None)
+            try:
+                status = int(ctx.run(call).get("statusCode", 200))
+            except Exception:
+                status = 599
+            rec.request(ep, (time.perf_counter() - t0) * 1000, status)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as ex:
+        list(ex.map(worker, range(args.concurrency)))
+    return time.perf_counter() - t0
+
+# ---------- reporte
+
+def _summary(rec: Recorder, elapsed: float, local) -> Dict[str, Any]:
+    eps = {}
+    total = 0
+    for ep, xs in sorted(rec.requests.items()):
+        total += len(xs)
+        eps[ep] = {
+            "count": len(xs),
+            "errors": rec.errors.get(ep, 0),
+            "error_rate": rec.errors.get(ep, 0) / len(xs) if xs else 0.0,
+            "rejected_429": rec.rejected.get(ep, 0),
+            "rejected_rate": rec.rejected.get(ep, 0) / len(xs) if xs else 0.0,
+            "throughput_rps": len(xs) / elapsed if elapsed else 0.0,
+            "p50_ms": _pct(xs, 50), "p95_ms": _pct(xs, 95), "p99_ms": _pct(xs, 99),
+            "max_ms": max(xs) if xs else 0.0,
+            "statuses": dict(rec.statuses[ep]),
+        }
+    stages = {}
+    for (ep, st), xs in sorted(rec.stages.items()):
+        stages.setdefault(ep, {})[st] = {
+            "count": len(xs), "p50_ms": _pct(xs, 50), "p95_ms": _pct(xs, 95), "p99_ms": _pct(xs, 99),
+        }
+    return {
+        "elapsed_s": elapsed,
+        "total_requests": total,
+        "throughput_rps": total / elapsed if elapsed else 0.0,
+        "endpoints": eps,
+        "stages": stages,
+        "bedrock_calls": dict(local.bedrock.calls),
+        "llm_json": _llm_json_counters(),
+    }
+
+def _llm_json_counters() -> Dict[str, int]:
+    from shared import counters   # importado después de install_local_aws
+    return counters.group("llm_json").snapshot()
+
+def _print(summary: Dict[str, Any]):
+    print(f"\n{summary['total_requests']} requests en {summary['elapsed_s']:.1f}s  "
+          f"({summary['throughput_rps']:.2f} req/s)  bedrock={summary['bedrock_calls']}")
+    if summary.get("llm_json"):
+        print(f"llm_json={summary['llm_json']}")
+    print(f"\n{'endpoint':12s} {'n':>6s} {'err%':>6s} {'429%':>6s} {'rps':>8s} {'p50':>9s} {'p95':>9s} {'p99':>9s}")
+    for ep, r in summary["endpoints"].items():
+        print(f"{ep:12s} {r['count']:6d} {r['error_rate']*100:6.1f} {r['rejected_rate']*100:6.1f} {r['throughput_rps']:8.2f} "
+              f"{r['p50_ms']:9.1f} {r['p95_ms']:9.1f} {r['p99_ms']:9.1f}")
+    for ep, sts in summary["stages"].items():
+        label = ep if ep != "*" else "* (hilos sin endpoint)"
+        print(f"\n[{label}] {'etapa':28s} {'n':>6s} {'p50':>9s} {'p95':>9s} {'p99':>9s}")
+        for st, r in sorted(sts.items(), key=lambda kv: -kv[1]["p50_ms"]):
+            print(f"     {st:28s} {r['count']:6d} {r['p50_ms']:9.1f} {r['p95_ms']:9.1f} {r['p99_ms']:9.1f}")
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Load generator con AWS/Bedrock locales")
+    ap.add_argument("--target", choices=["api", "lambda"], default="api")
+    ap.add_argument("--mix", default=None, help="Pesos por endpoint, ej. create=1,products=4")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--requests", type=int, default=None, help="Total de requests (por defecto 100 si no hay --duration)")
+    ap.add_argument("--duration", type=float, default=None, help="Segundos de carga")
+    ap.add_argument("--users", type=int, default=10)
+    ap.add_argument("--seed-products", type=int, default=200)
+    ap.add_argument("--page-size", type=int, default=20)
+    ap.add_argument("--first-token", default="lognormal:median=600,sigma=0.4", help="Latencia hasta el primer chunk (ms)")
+    ap.add_argument("--chunk-interval", default="const:15", help="Latencia entre chunks (ms)")
+    ap.add_argument("--chunks", type=int, default=30)
+    ap.add_argument("--image-latency", default="lognormal:median=3000,sigma=0.3", help="Latencia de invoke_model (ms)")
+    ap.add_argument("--throttle-rate", type=float, default=0.0, help="Probabilidad de ThrottlingException por llamada")
+    ap.add_argument("--malformed-rate", type=float, default=0.0,
+                    help="Probabilidad de JSON defectuoso del modelo (cerca, coma final, cortado)")
+    ap.add_argument("--product-mix", default="poster=1", help="Tipos que devuelve el modelo falso, ej. poster=6,book=1")
+    ap.add_argument("--aws-latency", default="off", help="Latencia extra por llamada S3/DynamoDB (ms)")
+    ap.add_argument("--admission", choices=["on", "off"], default="off",
+                    help="Admisión (cuota por usuario, cola justa, bucket global) durante la carga")
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--json", help="Escribe el resumen en este archivo")
+    args = ap.parse_args(argv)
+
+    if args.requests is None and args.duration is None:
+        args.requests = 100
+    if args.mix is None:
+        args.mix = "create=1,products=4" if args.target == "api" else "create=1,listing=4"
+
+    cfg = BedrockStubConfig(
+        first_token=LatencySpec.parse(args.first_token),
+        chunk_interval=LatencySpec.parse(args.chunk_interval),
+        chunks=args.chunks,
+        image_latency=LatencySpec.parse(args.image_latency),
+        throttle_rate=args.throttle_rate,
+        malformed_rate=args.malformed_rate,
+        product_mix={k: w for k, w in _parse_mix(args.product_mix)},
+        seed=args.seed,
+    )
+    local = install_local_aws(cfg, aws_latency=LatencySpec.parse(args.aws_latency))
+    from shared.config import settings   # importado después de install_local_aws
+    object.__setattr__(settings, "admission_enabled", args.admission == "on")
+    rec = Recorder()
+    local.bedrock.on_call = rec.stage
+    try:
+        users = [f"user_load_{i:03d}" for i in range(args.users)]
+        if args.target == "api":
+            users = ["user_dev_001"] + users
+            # sólo por el efecto de importarlo: crea clientes/tablas/agentes sobre los stubs
+            importlib.import_module("api.main")
+        _seed_products(args.seed_products, users)
+        # El callback por defecto de strands imprime el stream del modelo; aquí sólo estorba.
+        with contextlib.redirect_stdout(io.StringIO()):
+            if args.target == "api":
+                _instrument_loaded(rec)
+                elapsed = asyncio.run(_run_api(args, rec, users))
+            else:
+                elapsed = _run_lambda(args, rec, users)
+        summary = _summary(rec, elapsed, local)
+        _print(summary)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(summary, f, indent=2)
+    finally:
+        local.stop()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,303 @@
+"""
+Microbenchmarks de los caminos calientes en Python puro (sin AWS ni Bedrock).
+
+Uso:
+    python bench/microbench.py run [--save bench/baselines/local.json] [--only postprocess,detect_lang]
+    python bench/microbench.py compare bench/baselines/base.json bench/baselines/new.json [--threshold 0.10]
+
+`run` mide cada caso (mediana de N rondas tras un calentamiento) y opcionalmente
+guarda el resultado como baseline JSON. `compare` marca como regresión todo caso
+cuya mediana empeore más que `threshold` (10% por defecto) y sale con código 1.
+"""
+from __future__ import annotations
+import argparse, json, os, platform, statistics, sys, time, datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAYER = os.path.join(ROOT, "layers", "app_common", "python")
+for p in (ROOT, LAYER):
+    if p not in sys.path:
+        sys.path.insert(0, p)
+
+# Offline: presign y clientes boto3 sólo necesitan región y credenciales falsas.
+os.environ.setdefault("AWS_REGION", "us-west-2")
+os.environ.setdefault("AWS_DEFAULT_REGION", os.environ["AWS_REGION"])
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+
+DEFAULT_BASELINE_DIR = os.path.join(ROOT, "bench", "baselines")
+
+_CASES: Dict[str, Dict[str, Any]] = {}
+
+def case(name: str, *, rounds: int = 200, inner: int = 1):
+    """Registra un caso. `setup` devuelve el callable a medir."""
+    def deco(setup: Callable[[], Callable[[], Any]]):
+        _CASES[name] = {"setup": setup, "rounds": rounds, "inner": inner}
+        return setup
+    return deco
+
+def _load_module(name: str, path: str):
+    import importlib.util
+    spec = importlib.util.spec_from_file_location(name, path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+# ---------- datos de ejemplo
+
+_RAW_BRIEF = {
+    "intent": "Póster vaporwave de un zorro cósmico",
+    "style": "vaporwave; neon, retro, synth , dreamy",
+    "product_type": "Poster",
+    "tags": ["Vaporwave", "Zorro", "Cosmos", "", "Neon", "Retro", "Synth", "Space", "Fox", "Extra"],
+    "design_prompt": "Un zorro cósmico flotando sobre una rejilla neón al atardecer, paleta magenta y cian, "
+                     "composición centrada, estilo ilustración digital retro de los 80.",
+    "notes": "Público joven. Evitar marcas. Apto para impresión CMYK. Sin texto.",
+}
+
+_TEXTS = [
+    "hola",
+    "Hazme un póster de la selva con un jaguar y la luna",
+    "Create a retro children's book cover with origami dragons and the sea",
+    "crear libro educativo sobre la Guerra Fría con mapas y línea de tiempo",
+    "a 3d printable chess set with cats",
+]
+
+_BOOK_BRIEF = {
+    "intent": "crear libro educativo sobre la Guerra Fría",
+    "style": "histórico, educativo, documental, ilustrado",
+    "product_type": "book",
+    "tags": ["guerra fria", "historia", "siglo xx", "niños"],
+    "design_prompt": "Portada de libro histórico con elementos de época.",
+    "notes": "Dirigido a estudiantes.",
+}
+
+def _feed_page(n: int = 100) -> Dict[str, Any]:
+    items = []
+    for i in range(n):
+        items.append({
+            "product": {
+                "product_id": f"prd_{i:012d}",
+                "owner_id": "user_dev_001",
+                "title": f"Producto {i}",
+                "description": "Generado automáticamente a partir de tu idea.",
+                "status": "draft",
+                "media_keys": [f"assets/user_dev_001/generated/poster_{i}.png", f"assets/user_dev_001/generated/poster_{i}.gif"],
+                "media": [
+                    {"key": f"assets/user_dev_001/generated/poster_{i}.png", "url": "https://example/x", "type": "image"},
+                    {"key": f"assets/user_dev_001/generated/poster_{i}.gif", "url": "https://example/y", "type": "video"},
+                ],
+            },
+            "listing": {
+                "listing_id": f"lst_{i:012d}",
+                "product_id": f"prd_{i:012d}",
+                "price_cents": Decimal(1500 + i),
+                "currency": "USD",
+                "status": "active",
+                "metadata": {"stage": "dev", "ratio": Decimal("0.25")},
+            },
+        })
+    return {"items": items, "count": Decimal(n), "has_more": True}
+
+# ---------- casos
+
+@case("interpret.postprocess", rounds=2000, inner=10)
+def _c_postprocess():
+    from agents.dream_interpret import _postprocess
+    return lambda: _postprocess(dict(_RAW_BRIEF), "ES")
+
+@case("interpret.detect_lang", rounds=2000, inner=10)
+def _c_detect_lang():
+    from agents.dream_interpret import _detect_lang
+    def run():
+        for t in _TEXTS:
+            _detect_lang(t)
+    return run
+
+@case("interpret.local_clarify", rounds=2000, inner=10)
+def _c_local_clarify():
+    from agents.dream_interpret import local_clarify
+    def run():
+        for t in _TEXTS:
+            local_clarify(t)
+    return run
+
+@case("interpret.norm_product_type", rounds=2000, inner=10)
+def _c_norm_pt():
+    from agents.dream_interpret import _norm_product_type
+    pairs = [("Poster", ""), ("polera", ""), ("", "un libro infantil"), ("xyz", "gif animado"), ("", "")]
+    def run():
+        for pt, it in pairs:
+            _norm_product_type(pt, it)
+    return run
+
+@case("design.decide_kinds", rounds=2000, inner=10)
+def _c_decide_kinds():
+    from agents.design_generate import _decide_kinds
+    briefs = [{"product_type": pt, "intent": it} for pt, it in
+              [("poster", ""), ("book", ""), ("", "libro"), ("video", ""), ("3d_model", ""), ("other", "algo")]]
+    def run():
+        for b in briefs:
+            _decide_kinds(b)
+    return run
+
+@case("design.book_docx", rounds=20)
+def _c_docx():
+    from agents.design_generate import _build_book_docx_bytes
+    return lambda: _build_book_docx_bytes(_BOOK_BRIEF, _BOOK_BRIEF["design_prompt"])
+
+@case("design.book_txt", rounds=2000, inner=10)
+def _c_txt():
+    from agents.design_generate import _build_book_txt_bytes
+    return lambda: _build_book_txt_bytes(_BOOK_BRIEF, _BOOK_BRIEF["design_prompt"])
+
+@case("design.gif", rounds=5)
+def _c_gif():
+    from agents.design_generate import _build_gif_bytes
+    return _build_gif_bytes
+
+@case("s3.presign_get", rounds=500, inner=10)
+def _c_presign():
+    from shared.s3 import presign_get
+    return lambda: presign_get("kkt-assets-dev", "assets/user_dev_001/generated/poster_x.png")
+
+@case("api.cursor_codec", rounds=2000, inner=10)
+def _c_cursor():
+    main = _load_module("bench_api_main", os.path.join(ROOT, "api", "main.py"))
+    key = {"product_id": "prd_0123456789ab", "owner_id": "user_dev_001"}
+    return lambda: main._dec(main._enc(key))
+
+def _feed_page_wire(n: int = 100) -> List[Dict[str, Any]]:
+    """Página de Scan tal como llega del cliente de bajo nivel (AttributeValue), con media y listing."""
+    from boto3.dynamodb.types import TypeSerializer
+    ser = TypeSerializer()
+    rows = []
+    for it in _feed_page(n)["items"]:
+        p = {k: v for k, v in it["product"].items() if k != "media"}
+        p["media_keys"] = p["media_keys"] + [f"{k}.webp" for k in p["media_keys"]]
+        rows.append({k: ser.serialize(v) for k, v in {**p, "listing": it["listing"]}.items()})
+    return rows
+
+def _to_jsonable(x):
+    # camino previo del Lambda de listing (se conserva aquí como referencia)
+    if isinstance(x, list):  return [_to_jsonable(v) for v in x]
+    if isinstance(x, dict):  return {k: _to_jsonable(v) for k, v in x.items()}
+    if isinstance(x, Decimal):
+        return int(x) if x == x.to_integral_value() else float(x)
+    return x
+
+@case("listing.page_resource", rounds=200)
+def _c_page_resource():
+    from boto3.dynamodb.types import TypeDeserializer
+    des = TypeDeserializer()
+    rows = _feed_page_wire(100)
+    def run():
+        items = [{k: des.deserialize(v) for k, v in r.items()} for r in rows]
+        return json.dumps(_to_jsonable({"items": items}), ensure_ascii=False)
+    return run
+
+@case("listing.page_wire", rounds=200)
+def _c_page_wire():
+    from shared import ddbjson
+    rows = _feed_page_wire(100)
+    return lambda: ddbjson.dumps({"items": ddbjson.decode_items(rows)})
+
+# ---------- runner
+
+def _measure(fn: Callable[[], Any], rounds: int, inner: int) -> Dict[str, float]:
+    for _ in range(min(rounds, 5)):
+        fn()
+    samples: List[float] = []
+    for _ in range(rounds):
+        t0 = time.perf_counter_ns()
+        for _ in range(inner):
+            fn()
+        samples.append((time.perf_counter_ns() - t0) / inner / 1000.0)
+    return {
+        "rounds": rounds,
+        "min_us": min(samples),
+        "median_us": statistics.median(samples),
+        "mean_us": statistics.fmean(samples),
+        "stdev_us": statistics.pstdev(samples),
+        "ops_per_s": 1e6 / statistics.median(samples) if statistics.median(samples) else 0.0,
+    }
+
+def run(only: Optional[List[str]] = None, scale: float = 1.0) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    for name, spec in _CASES.items():
+        if only and not any(name == o or name.startswith(o + ".") or name.endswith("." + o) for o in only):
+            continue
+        fn = spec["setup"]()
+        rounds = max(3, int(spec["rounds"] * scale))
+        results[name] = _measure(fn, rounds, spec["inner"])
+        r = results[name]
+        print(f"{name:28s} median={r['median_us']:>12.2f}us  min={r['min_us']:>12.2f}us  ops/s={r['ops_per_s']:>12.1f}")
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "created_at": datetime.datetime.utcnow().isoformat() + "Z",
+        },
+        "results": results,
+    }
+
+def compare(base: Dict[str, Any], new: Dict[str, Any], threshold: float = 0.10) -> List[str]:
+    regressions: List[str] = []
+    b, n = base.get("results", {}), new.get("results", {})
+    for name in sorted(set(b) | set(n)):
+        if name not in b or name not in n:
+            print(f"{name:28s} {'(solo en ' + ('nuevo' if name in n else 'base') + ')':>30s}")
+            continue
+        old_m, new_m = b[name]["median_us"], n[name]["median_us"]
+        delta = (new_m - old_m) / old_m if old_m else 0.0
+        flag = ""
+        if delta > threshold:
+            flag = "  REGRESIÓN"
+            regressions.append(name)
+        elif delta < -threshold:
+            flag = "  mejora"
+        print(f"{name:28s} {old_m:>12.2f}us -> {new_m:>12.2f}us  {delta:+7.1%}{flag}")
+    return regressions
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Microbenchmarks de KaiKashi DreamForge")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    r = sub.add_parser("run", help="Ejecuta los casos")
+    r.add_argument("--save", help="Ruta del baseline JSON a escribir")
+    r.add_argument("--only", help="Lista separada por comas de casos (o prefijos)")
+    r.add_argument("--scale", type=float, default=1.0, help="Multiplicador de rondas")
+    r.add_argument("--list", action="store_true", help="Lista los casos y sale")
+
+    c = sub.add_parser("compare", help="Compara dos baselines")
+    c.add_argument("base")
+    c.add_argument("new")
+    c.add_argument("--threshold", type=float, default=0.10, help="Regresión relativa tolerada (0.10 = 10%%)")
+
+    args = ap.parse_args(argv)
+    if args.cmd == "run":
+        if args.list:
+            print("\n".join(_CASES))
+            return 0
+        only = [o.strip() for o in args.only.split(",")] if args.only else None
+        out = run(only, args.scale)
+        if args.save:
+            os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+            with open(args.save, "w", encoding="utf-8") as f:
+                json.dump(out, f, indent=2)
+            print(f"baseline guardado en {args.save}")
+        return 0
+
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+    regs = compare(base, new, args.threshold)
+    if regs:
+        print(f"{len(regs)} regresión(es) > {args.threshold:.0%}: {', '.join(regs)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,344 @@
+"""
+Sustitutos locales de AWS para benchmarks y pruebas de carga.
+
+- S3 y DynamoDB: moto (`mock_aws`) con los mismos buckets/tablas que crea el CDK.
+- Bedrock Runtime: `FakeBedrockRuntime`, con latencia configurable (primer token,
+  intervalo entre chunks, invoke_model), tasa de throttling y respuestas JSON
+  compatibles con `interpret_dream`.
+
+`install_local_aws()` debe llamarse ANTES de importar `shared.*`, `agents.*`,
+`api.main` o los Lambdas, porque éstos crean clientes/tablas al importarse.
+"""
+from __future__ import annotations
+import base64, io, json, math, os, random, sys, threading, time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAYER = os.path.join(ROOT, "layers", "app_common", "python")
+for p in (ROOT, LAYER):
+    if p not in sys.path:
+        sys.path.insert(0, p)
+
+@dataclass
+class LatencySpec:
+    """
+    Distribución de latencia en milisegundos. Formatos aceptados:
+      off | const:50 | uniform:20,80 | normal:mean=100,sd=20 | lognormal:median=800,sigma=0.5
+    """
+    kind: str = "off"
+    params: Dict[str, float] = field(default_factory=dict)
+
+    @classmethod
+    def parse(cls, spec: Optional[str]) -> "LatencySpec":
+        spec = (spec or "off").strip()
+        if spec in ("off", "0", "none", ""):
+            return cls("off", {})
+        kind, _, rest = spec.partition(":")
+        kind = kind.strip().lower()
+        vals = [v.strip() for v in rest.split(",") if v.strip()]
+        if kind == "const":
+            return cls("const", {"ms": float(vals[0])})
+        if kind == "uniform":
+            return cls("uniform", {"a": float(vals[0]), "b": float(vals[1])})
+        if kind in ("normal", "lognormal"):
+            params = {}
+            for v in vals:
+                k, _, x = v.partition("=")
+                params[k.strip()] = float(x)
+            return cls(kind, params)
+        raise ValueError(f"latencia no reconocida: {spec!r}")
+
+    def sample_ms(self, rng: random.Random) -> float:
+        p = self.params
+        if self.kind == "const":
+            return p["ms"]
+        if self.kind == "uniform":
+            return rng.uniform(p["a"], p["b"])
+        if self.kind == "normal":
+            return max(0.0, rng.gauss(p.get("mean", 0.0), p.get("sd", 0.0)))
+        if self.kind == "lognormal":
+            return rng.lognormvariate(math.log(max(p.get("median", 1.0), 1e-3)), p.get("sigma", 0.0))
+        return 0.0
+
+    def sleep(self, rng: random.Random) -> float:
+        ms = self.sample_ms(rng)
+        if ms > 0:
+            time.sleep(ms / 1000.0)
+        return ms
+
+@dataclass
+class BedrockStubConfig:
+    first_token: LatencySpec = field(default_factory=lambda: LatencySpec.parse("lognormal:median=600,sigma=0.4"))
+    chunk_interval: LatencySpec = field(default_factory=lambda: LatencySpec.parse("const:15"))
+    chunks: int = 30
+    image_latency: LatencySpec = field(default_factory=lambda: LatencySpec.parse("lognormal:median=3000,sigma=0.3"))
+    throttle_rate: float = 0.0
+    malformed_rate: float = 0.0   # respuestas JSON con defectos (cerca, coma final, cortadas)
+    product_mix: Dict[str, float] = field(default_factory=lambda: {"poster": 1.0})
+    seed: Optional[int] = None
+
+def _tiny_png() -> bytes:
+    # PNG 1x1 válido (evita depender de PIL para el stub)
+    return base64.b64decode(
+        "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
+    )
+
+class _Meta:
+    def __init__(self, region_name: str):
+        self.region_name = region_name
+
+class FakeBedrockRuntime:
+    """Implementa `converse`, `converse_stream` e `invoke_model` en memoria."""
+
+    def __init__(self, cfg: BedrockStubConfig, region_name: str = "us-west-2"):
+        self.cfg = cfg
+        self.meta = _Meta(region_name)
+        self._rng = random.Random(cfg.seed)
+        self._lock = threading.Lock()
+        self.calls: Dict[str, int] = {"converse": 0, "converse_stream": 0, "invoke_model": 0, "throttled": 0, "malformed": 0}
+        self.on_call: Optional[Callable[[str, float], None]] = None
+
+    # --- helpers
+    def _rand(self) -> random.Random:
+        with self._lock:
+            return random.Random(self._rng.random())
+
+    def _count(self, op: str):
+        with self._lock:
+            self.calls[op] += 1
+
+    def _maybe_throttle(self, rng: random.Random, op: str):
+        if self.cfg.throttle_rate and rng.random() < self.cfg.throttle_rate:
+            from botocore.exceptions import ClientError
+            self._count("throttled")
+            raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Too many requests (stub)"}}, op)
+
+    def _pick_product_type(self, rng: random.Random) -> str:
+        mix = self.cfg.product_mix or {"poster": 1.0}
+        total = sum(mix.values())
+        x = rng.random() * total
+        for pt, w in mix.items():
+            x -= w
+            if x <= 0:
+                return pt
+        return next(iter(mix))
+
+    @staticmethod
+    def _user_text(request: Dict[str, Any]) -> str:
+        for m in reversed(request.get("messages") or []):
+            if m.get("role") == "user":
+                for c in m.get("content") or []:
+                    if "text" in c:
+                        return c["text"]
+        return ""
+
+    def _brief_text(self, request: Dict[str, Any], rng: random.Random) -> str:
+        text = self._user_text(request).split("\n\nSchema aproximado:")[0]
+        words = text.split()
+        if len(words) <= 1 and text.lower().strip(" !.?¿¡") in ("hola", "hi", "hello", "buenas", ""):
+            brief = {"intent": "clarify", "style": "", "product_type": "", "tags": [], "design_prompt": "",
+                     "notes": "¿Qué te gustaría crear? Ej.: 'un póster vaporwave de un zorro cósmico'."}
+        else:
+            pt = self._pick_product_type(rng)
+            brief = {
+                "intent": " ".join(words[:8]) or "idea",
+                "style": "vibrante, moderno, limpio, ilustrado",
+                "product_type": pt,
+                "tags": [w.lower().strip(".,") for w in words[:6]] or ["creative"],
+                "design_prompt": (text + " ") * 3,
+                "notes": "Apto para impresión. Sin marcas.",
+            }
+        text = json.dumps(brief, ensure_ascii=False)
+        if self.cfg.malformed_rate and rng.random() < self.cfg.malformed_rate:
+            text = self._malform(text, rng)
+        return text
+
+    def _malform(self, text: str, rng: random.Random) -> str:
+        self._count("malformed")
+        kind = rng.choice(("fence", "trailing_comma", "truncated"))
+        if kind == "fence":
+            return "Aquí tienes el brief:\n```json\n" + text + "\n```"
+        if kind == "trailing_comma":
+            return text[:-1] + ",}"
+        return text[:int(len(text) * rng.uniform(0.5, 0.95))]
+
+    @staticmethod
+    def _usage(request: Dict[str, Any], text: str) -> Dict[str, int]:
+        inp = len(json.dumps(request.get("system") or "")) // 4 + len(FakeBedrockRuntime._user_text(request)) // 4
+        out = max(1, len(text) // 4)
+        return {"inputTokens": inp, "outputTokens": out, "totalTokens": inp + out}
+
+    # --- API bedrock-runtime
+    def converse(self, **request) -> Dict[str, Any]:
+        rng = self._rand()
+        self._count("converse")
+        t0 = time.perf_counter()
+        self._maybe_throttle(rng, "Converse")
+        self.cfg.first_token.sleep(rng)
+        for _ in range(self.cfg.chunks):
+            self.cfg.chunk_interval.sleep(rng)
+        text = self._brief_text(request, rng)
+        ms = (time.perf_counter() - t0) * 1000
+        if self.on_call:
+            self.on_call("bedrock.converse", ms)
+        return {
+            "output": {"message": {"role": "assistant", "content": [{"text": text}]}},
+            "stopReason": "end_turn",
+            "usage": self._usage(request, text),
+            "metrics": {"latencyMs": int(ms)},
+        }
+
+    def converse_stream(self, **request) -> Dict[str, Any]:
+        rng = self._rand()
+        self._count("converse_stream")
+        self._maybe_throttle(rng, "ConverseStream")
+        text = self._brief_text(request, rng)
+        return {"stream": self._stream(request, text, rng)}
+
+    def _stream(self, request: Dict[str, Any], text: str, rng: random.Random) -> Iterator[Dict[str, Any]]:
+        t0 = time.perf_counter()
+        self.cfg.first_token.sleep(rng)
+        yield {"messageStart": {"role": "assistant"}}
+        n = max(1, self.cfg.chunks)
+        step = max(1, math.ceil(len(text) / n))
+        for i in range(0, len(text), step):
+            if i:
+                self.cfg.chunk_interval.sleep(rng)
+            yield {"contentBlockDelta": {"delta": {"text": text[i:i + step]}, "contentBlockIndex": 0}}
+        yield {"contentBlockStop": {"contentBlockIndex": 0}}
+        yield {"messageStop": {"stopReason": "end_turn"}}
+        ms = (time.perf_counter() - t0) * 1000
+        yield {"metadata": {"usage": self._usage(request, text), "metrics": {"latencyMs": int(ms)}}}
+        if self.on_call:
+            self.on_call("bedrock.converse_stream", ms)
+
+    def invoke_model(self, modelId: str, body: Any = None, **_kw) -> Dict[str, Any]:
+        rng = self._rand()
+        self._count("invoke_model")
+        t0 = time.perf_counter()
+        self._maybe_throttle(rng, "InvokeModel")
+        self.cfg.image_latency.sleep(rng)
+        img = base64.b64encode(_tiny_png()).decode()
+        mid = (modelId or "").lower()
+        if "stable-diffusion" in mid:
+            payload = {"artifacts": [{"base64": img}]}
+        else:
+            payload = {"images": [img]}
+        if self.on_call:
+            self.on_call("bedrock.invoke_model", (time.perf_counter() - t0) * 1000)
+        return {"body": io.BytesIO(json.dumps(payload).encode()), "contentType": "application/json"}
+
+# Espejo de infra/cdk/stacks.py (claves de tablas).
+TABLES: Dict[str, Dict[str, Any]] = {
+    "DDB_TABLE_PRODUCTS":      {"name": "kkt_products_dev",      "pk": "product_id"},
+    "DDB_TABLE_LISTINGS":      {"name": "kkt_listings_dev",      "pk": "listing_id"},
+    "DDB_TABLE_USERS":         {"name": "kkt_users_dev",         "pk": "user_id"},
+    "DDB_TABLE_JOBS":          {"name": "kkt_jobs_dev",          "pk": "job_id"},
+    "DDB_TABLE_CONVERSATIONS": {"name": "kkt_conversations_dev", "pk": "conversation_id"},
+    "DDB_TABLE_MESSAGES":      {"name": "kkt_messages_dev",      "pk": "conversation_id", "sk": "created_at"},
+    "DDB_TABLE_USAGE":         {"name": "kkt_usage_dev",         "pk": "scope_id", "sk": "period"},
+    "DDB_TABLE_RATE_LIMITS":   {"name": "kkt_rate_limits_dev",   "pk": "bucket_id"},
+    "DDB_TABLE_SEARCH":        {"name": "kkt_search_dev",        "pk": "token", "sk": "product_id"},
+    "DDB_TABLE_IDEMPOTENCY":   {"name": "kkt_idempotency_dev",   "pk": "idem_key"},
+    "DDB_TABLE_PUBLIC_FEED":   {"name": "kkt_public_feed_dev",   "pk": "bucket", "sk": "sk"},
+}
+
+BUCKETS: Dict[str, str] = {
+    "S3_BUCKET_UPLOADS": "kkt-uploads-dev",
+    "S3_BUCKET_ASSETS": "kkt-assets-dev",
+    "S3_BUCKET_PUBLIC": "kkt-public-dev",
+}
+
+@dataclass
+class LocalAws:
+    mock: Any
+    bedrock: FakeBedrockRuntime
+    aws_latency: LatencySpec
+
+    def stop(self):
+        self.mock.stop()
+
+def install_local_aws(
+    bedrock: Optional[BedrockStubConfig] = None,
+    *,
+    aws_latency: Optional[LatencySpec] = None,
+    region: str = "us-west-2",
+) -> LocalAws:
+    """
+    Arranca moto, crea buckets/tablas y enruta `bedrock-runtime` al stub.
+    `aws_latency` añade una espera por llamada S3/DynamoDB (simula red).
+    """
+    import boto3
+    from moto import mock_aws
+
+    os.environ.setdefault("AWS_REGION", region)
+    os.environ["AWS_DEFAULT_REGION"] = os.environ["AWS_REGION"]
+    os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+    os.environ.pop("AWS_PROFILE", None)
+    for env, spec in TABLES.items():
+        os.environ.setdefault(env, spec["name"])
+    for env, name in BUCKETS.items():
+        os.environ.setdefault(env, name)
+    os.environ.setdefault("BEDROCK_IMAGE_MODEL_ID", "amazon.titan-image-generator-v2:0")
+
+    mock = mock_aws()
+    mock.start()
+
+    fake = FakeBedrockRuntime(bedrock or BedrockStubConfig(), region_name=os.environ["AWS_REGION"])
+    latency = aws_latency or LatencySpec()
+    lat_rng = random.Random()
+    lat_lock = threading.Lock()
+
+    def _net_delay(**_kw):
+        with lat_lock:
+            r = random.Random(lat_rng.random())
+        latency.sleep(r)
+
+    orig_client = boto3.session.Session.client
+    orig_resource = boto3.session.Session.resource
+
+    def client(self, *args, **kwargs):
+        service = kwargs.get("service_name") or (args[0] if args else None)
+        if service == "bedrock-runtime":
+            return fake
+        c = orig_client(self, *args, **kwargs)
+        if latency.kind != "off":
+            c.meta.events.register("before-call", _net_delay)
+        return c
+
+    def resource(self, *args, **kwargs):
+        r = orig_resource(self, *args, **kwargs)
+        if latency.kind != "off":
+            r.meta.client.meta.events.register("before-call", _net_delay)
+        return r
+
+    boto3.session.Session.client = client
+    boto3.session.Session.resource = resource
+
+    region_name = os.environ["AWS_REGION"]
+    s3 = orig_client(boto3.session.Session(), "s3", region_name=region_name)
+    for env in BUCKETS:
+        kw = {} if region_name == "us-east-1" else {"CreateBucketConfiguration": {"LocationConstraint": region_name}}
+        s3.create_bucket(Bucket=os.environ[env], **kw)
+    ddb = orig_client(boto3.session.Session(), "dynamodb", region_name=region_name)
+    for env, spec in TABLES.items():
+        keys = [{"AttributeName": spec["pk"], "KeyType": "HASH"}]
+        attrs = [{"AttributeName": spec["pk"], "AttributeType": "S"}]
+        if spec.get("sk"):
+            keys.append({"AttributeName": spec["sk"], "KeyType": "RANGE"})
+            attrs.append({"AttributeName": spec["sk"], "AttributeType": "S"})
+        ddb.create_table(TableName=os.environ[env], KeySchema=keys, AttributeDefinitions=attrs,
+                         BillingMode="PAY_PER_REQUEST")
+
+    return LocalAws(mock=mock, bedrock=fake, aws_latency=latency)
+
+def load_module(name: str, path: str):
+    """Importa un archivo por ruta (los Lambdas se llaman todos `index.py`)."""
+    import importlib.util
+    spec = importlib.util.spec_from_file_location(name, path)
+    mod = importlib.util.module_from_spec(spec)
+    sys.modules[name] = mod
+    spec.loader.exec_module(mod)
+    return mod
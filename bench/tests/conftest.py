@@ -0,0 +1,33 @@
+"""
+Pruebas unitarias offline: mismos sustitutos que los benchmarks (`bench/stubs.py`).
+`install_local_aws()` va antes de cualquier import de `shared.*`/`agents.*`, que crean
+clientes y tablas al importarse; así nada sale a AWS.
+
+    pip install -r requirements.txt -r bench/requirements.txt
+    python -m pytest -q bench/tests
+"""
+from __future__ import annotations
+import os, sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from stubs import install_local_aws  # noqa: E402  (también pone el layer en sys.path)
+
+_local = install_local_aws()
+
+def pytest_unconfigure(config):
+    _local.stop()
+
+@pytest.fixture
+def override():
+    """`override(campo=valor)` sobre `settings` (dataclass congelada); se restaura al terminar."""
+    from shared.config import settings
+    saved = {}
+
+    def _set(**fields):
+        for k, v in fields.items():
+            saved.setdefault(k, getattr(settings, k))
+            object.__setattr__(settings, k, v)
+    yield _set
+    for k, v in saved.items():
+        object.__setattr__(settings, k, v)
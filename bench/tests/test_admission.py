@@ -0,0 +1,162 @@
+from __future__ import annotations
+import threading, time
+import pytest
+from shared import admission
+from shared.admission import AdmissionController, AdmissionRejected, FairLimiter, MemoryBuckets
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = _Clock()
+    monkeypatch.setattr(admission.time, "monotonic", c)
+    return c
+
+def test_bucket_allows_burst_then_reports_wait(clock):
+    b = MemoryBuckets()
+    assert [b.try_take("k", 1, rate=1.0, burst=3)[0] for _ in range(3)] == [True, True, True]
+    ok, wait = b.try_take("k", 1, rate=1.0, burst=3)
+    assert not ok and wait == pytest.approx(1.0)
+
+def test_bucket_refills_at_rate_up_to_burst(clock):
+    b = MemoryBuckets()
+    for _ in range(2):
+        b.try_take("k", 1, rate=2.0, burst=2)
+    clock.now += 0.5                       # +1 token
+    assert b.try_take("k", 1, rate=2.0, burst=2)[0]
+    assert not b.try_take("k", 1, rate=2.0, burst=2)[0]
+    clock.now += 60                        # no pasa de burst
+    assert [b.try_take("k", 1, rate=2.0, burst=2)[0] for _ in range(3)] == [True, True, False]
+
+def test_bucket_keys_are_independent(clock):
+    b = MemoryBuckets()
+    assert b.try_take("a", 1, rate=1.0, burst=1)[0]
+    assert not b.try_take("a", 1, rate=1.0, burst=1)[0]
+    assert b.try_take("b", 1, rate=1.0, burst=1)[0]
+
+def test_drain_empties_bucket(clock):
+    b = MemoryBuckets()
+    b.drain("g")
+    ok, wait = b.try_take("g", 1, rate=4.0, burst=4)
+    assert not ok and wait == pytest.approx(0.25)
+
+def _enqueue(limiter, user, order):
+    """Lanza un hilo que espera slot y vuelve cuando ya está en la cola."""
+    queued = limiter.snapshot()["queued"]
+
+    def run():
+        assert limiter.acquire(user, timeout=5)
+        order.append(user)
+        limiter.release()
+    t = threading.Thread(target=run)
+    t.start()
+    deadline = time.monotonic() + 2
+    while limiter.snapshot()["queued"] <= queued and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return t
+
+def test_fair_limiter_round_robin_between_users():
+    lim = FairLimiter(1)
+    assert lim.acquire("holder", timeout=0)
+    order, threads = [], []
+    for user in ("a", "a", "a", "b"):
+        threads.append(_enqueue(lim, user, order))
+    lim.release()
+    for t in threads:
+        t.join(5)
+    # "b" llegó último pero entra en la segunda vuelta, no detrás de los tres de "a"
+    assert order == ["a", "b", "a", "a"]
+    assert lim.snapshot() == {"active": 0, "limit": 1, "queued": 0, "queued_users": 0}
+
+def test_fair_limiter_timeout_leaves_queue_clean():
+    lim = FairLimiter(1)
+    assert lim.acquire("x", timeout=0)
+    assert not lim.acquire("y", timeout=0.05)
+    assert lim.snapshot()["queued"] == 0
+    lim.release()
+    assert lim.acquire("y", timeout=0)
+
+def test_controller_rejects_user_over_quota(override):
+    override(admission_enabled=True)
+    ctl = AdmissionController("text", concurrency=2, global_rpm=6000, user_rpm=60, user_burst=2,
+                              max_wait_s=1, backend=MemoryBuckets())
+    for _ in range(2):
+        with ctl.admit("u1"):
+            pass
+    with pytest.raises(AdmissionRejected) as e:
+        with ctl.admit("u1"):
+            pass
+    assert e.value.reason == "user_rate" and e.value.retry_after >= 1.0
+    with ctl.admit("u2"):
+        pass
+    with admission.batch_mode(), ctl.admit("u1"):   # lotes: sin cuota por usuario
+        pass
+    assert ctl.stats()["rejected_user_rate"] == 1
+
+def test_controller_rejects_when_global_rate_exceeds_wait(override):
+    override(admission_enabled=True)
+    ctl = AdmissionController("image", concurrency=1, global_rpm=1, user_rpm=6000, user_burst=100,
+                              max_wait_s=0.1, backend=MemoryBuckets())
+    with ctl.admit("u"):
+        pass
+    with pytest.raises(AdmissionRejected) as e:
+        with ctl.admit("u"):
+            pass
+    assert e.value.reason == "global_rate"
+    assert ctl.limiter.snapshot()["active"] == 0     # el slot se devolvió
+
+def test_bucket_refund_returns_tokens_up_to_burst(clock):
+    b = MemoryBuckets()
+    assert b.try_take("k", 1, rate=0.01, burst=1)[0]
+    assert not b.try_take("k", 1, rate=0.01, burst=1)[0]
+    b.refund("k", 1, rate=0.01, burst=1)
+    b.refund("k", 1, rate=0.01, burst=1)
+    assert [b.try_take("k", 1, rate=0.01, burst=1)[0] for _ in range(2)] == [True, False]
+
+def test_dynamo_bucket_refund():
+    b = admission.DynamoBuckets()
+    key = f"test#refund#{time.time()}"
+    assert b.try_take(key, 1, rate=0.001, burst=1)[0]
+    assert not b.try_take(key, 1, rate=0.001, burst=1)[0]
+    b.refund(key, 1, rate=0.001, burst=1)
+    assert b.try_take(key, 1, rate=0.001, burst=1)[0]
+
+def test_queue_timeout_refunds_user_token(override):
+    override(admission_enabled=True)
+    ctl = AdmissionController("text", concurrency=1, global_rpm=6000, user_rpm=0.6, user_burst=1,
+                              max_wait_s=0.05, backend=MemoryBuckets())
+    with ctl.admit("otro"):
+        with pytest.raises(AdmissionRejected) as e:
+            with ctl.admit("u1"):
+                pass
+    assert e.value.reason == "queue_timeout"
+    with ctl.admit("u1"):        # el token rechazado en la cola no se perdió
+        pass
+    assert ctl.stats()["rejected_user_rate"] == 0
+
+def test_batch_charge_takes_unique_ideas_and_may_go_into_debt(override, clock):
+    from agents import batch
+    override(admission_enabled=True)
+    text = AdmissionController("text", concurrency=2, global_rpm=6000, user_rpm=60, user_burst=3,
+                               max_wait_s=1, backend=MemoryBuckets())
+    image = AdmissionController("image", concurrency=2, global_rpm=6000, user_rpm=60, user_burst=3,
+                                max_wait_s=1, backend=MemoryBuckets())
+    ideas = ["a", "b", " A ", "c", "d", "e"]            # 5 únicas > burst 3: cabe, queda en -2
+    batch.charge("u1", ideas, (text,))
+    assert text.stats()["charged_batch"] == 5
+    with pytest.raises(AdmissionRejected) as e:
+        batch.charge("u1", ["x"], (text,))
+    assert e.value.reason == "user_rate" and e.value.retry_after == pytest.approx(3.0)
+    clock.now += 3                                        # repone hasta 1 token
+    with text.admit("u1"):
+        pass
+    # si el segundo tipo rechaza, el primero se devuelve
+    image.backend.try_take("user#image#u2", 3, image.user_rate, image.user_burst)
+    with pytest.raises(AdmissionRejected):
+        batch.charge("u2", ["x", "y"], (text, image))
+    assert [text.backend.try_take("user#text#u2", 1, 1.0, 3)[0] for _ in range(4)] == [True, True, True, False]
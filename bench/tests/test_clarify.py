@@ -0,0 +1,24 @@
+from __future__ import annotations
+import uuid
+from agents import create_flow, dream_interpret
+from shared import counters
+
+def _create(monkeypatch, ask):
+    monkeypatch.setattr(dream_interpret._agent, "ask", ask)
+    before = counters.group("create").snapshot()
+    out = create_flow.run_create("póster de un jaguar bajo la luna", "u_clarify",
+                                 conversation_id=f"conv_{uuid.uuid4().hex[:8]}")
+    after = counters.group("create").snapshot()
+    return out, {k: after.get(k, 0) - before.get(k, 0) for k in after if after.get(k, 0) != before.get(k, 0)}
+
+def test_model_clarify_counts_as_model(monkeypatch):
+    out, delta = _create(monkeypatch, lambda *a, **kw: {"intent": "clarify", "notes": "¿Qué producto?"})
+    assert out["clarify"] and "degraded" not in out["brief"]
+    assert delta == {"clarify_model": 1}
+
+def test_failed_model_clarify_counts_by_cause(monkeypatch):
+    def boom(*a, **kw):
+        raise RuntimeError("sin respuesta")
+    out, delta = _create(monkeypatch, boom)
+    assert out["clarify"] and out["brief"]["degraded"] == "error"
+    assert delta == {"clarify_error": 1}
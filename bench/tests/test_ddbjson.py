@@ -0,0 +1,56 @@
+from __future__ import annotations
+import json
+from decimal import Decimal
+import pytest
+from shared import ddbjson
+
+WIRE = {
+    "product_id": {"S": "prd_1"},
+    "price": {"N": "1500"},
+    "ratio": {"N": "0.25"},
+    "whole": {"N": "3.0"},
+    "active": {"BOOL": True},
+    "gone": {"NULL": True},
+    "tags": {"SS": ["a", "b"]},
+    "sizes": {"NS": ["1", "2.5"]},
+    "listing": {"M": {"status": {"S": "active"}, "stage": {"NULL": True}}},
+    "media_keys": {"L": [{"S": "k1.png"}, {"M": {"n": {"N": "7"}}}]},
+    "blob": {"B": b"\x00\xff"},
+    "blobs": {"BS": [b"x", b"y"]},
+}
+
+def test_decode_item_to_plain_types():
+    it = ddbjson.decode_item(WIRE)
+    assert it == {
+        "product_id": "prd_1", "price": 1500, "ratio": 0.25, "whole": 3, "active": True, "gone": None,
+        "tags": ["a", "b"], "sizes": [1, 2.5], "listing": {"status": "active", "stage": None},
+        "media_keys": ["k1.png", {"n": 7}], "blob": "AP8=", "blobs": ["eA==", "eQ=="],
+    }
+    assert isinstance(it["price"], int) and not isinstance(it["price"], bool)
+
+def test_decoded_page_serializes():
+    page = {"items": ddbjson.decode_items([WIRE, WIRE])}
+    assert json.loads(ddbjson.dumps_bytes(page)) == json.loads(ddbjson.dumps(page))
+    assert json.loads(ddbjson.dumps(page))["items"][1]["blob"] == "AP8="
+
+def test_decode_none_and_unknown():
+    assert ddbjson.decode_item(None) is None
+    assert ddbjson.decode_value({}) is None
+
+def test_encode_roundtrip():
+    item = {"id": "x", "n": 3, "f": 1.5, "ok": False, "none": None, "m": {"l": [1, "a", {"z": True}]}}
+    enc = ddbjson.encode_item(item)
+    assert enc["ok"] == {"BOOL": False} and enc["n"] == {"N": "3"}
+    assert ddbjson.decode_item(enc) == item
+
+def test_encode_key_and_projection():
+    assert ddbjson.encode_key(None) is None
+    assert ddbjson.encode_key({"pk": "a", "sk": 1}) == {"pk": {"S": "a"}, "sk": {"N": "1"}}
+    pe, names = ddbjson.projection(["status", "name"])
+    assert pe == "#p0, #p1" and names == {"#p0": "status", "#p1": "name"}
+
+def test_dumps_accepts_resource_layer_types():
+    out = json.loads(ddbjson.dumps({"d": Decimal("2"), "f": Decimal("2.5"), "s": {"x"}, "b": b"hi"}))
+    assert out == {"d": 2, "f": 2.5, "s": ["x"], "b": "aGk="}
+    with pytest.raises(TypeError):
+        ddbjson.dumps({"o": object()})
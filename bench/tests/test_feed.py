@@ -0,0 +1,113 @@
+from __future__ import annotations
+import threading
+from shared import feed
+from shared.cache import TTLCache
+from shared.feed import Prefetcher, etag_for, etag_matches, page_key
+
+def _etag(version=1, **kw):
+    args = {"status": None, "cursor": None, "limit": 20, "view": "api", **kw}
+    return etag_for("u1", version, **args)
+
+def test_etag_is_weak_and_changes_with_version_and_params():
+    e = _etag()
+    assert e.startswith('W/"v1-')
+    assert _etag() == e
+    assert _etag(version=2) != e
+    assert len({e, _etag(status="draft"), _etag(cursor="abc"), _etag(limit=50), _etag(view="lambda")}) == 5
+
+def test_etag_matches_weak_strong_lists_and_star():
+    e = _etag()
+    strong = e[2:]
+    assert etag_matches(e, e)
+    assert etag_matches(strong, e)
+    assert etag_matches(f'W/"other", {e}', e)
+    assert etag_matches("*", e)
+    assert not etag_matches(None, e)
+    assert not etag_matches(_etag(version=2), e)
+
+def test_etag_and_page_key_roll_with_presign_window(override):
+    override(presign_expiry_s=300)
+    assert feed.presign_epoch(0) == feed.presign_epoch(149.9) != feed.presign_epoch(150)
+    assert _etag(epoch=1) == _etag(epoch=1) != _etag(epoch=2)
+    args = {"status": None, "cursor": None, "limit": 20, "view": "api"}
+    assert page_key("u1", 1, epoch=1, **args) != page_key("u1", 1, epoch=2, **args)
+
+def test_page_key_includes_version():
+    k1 = page_key("u1", 1, status=None, cursor=None, limit=20, view="api", epoch=7)
+    assert k1 == page_key("u1", 1, status="", cursor="", limit="20", view="api", epoch=7)
+    assert k1 != page_key("u1", 2, status=None, cursor=None, limit=20, view="api", epoch=7)
+
+def test_header_is_case_insensitive():
+    assert feed.header({"If-None-Match": "x"}, "if-none-match") == "x"
+    assert feed.header(None, "if-none-match") is None
+
+def test_ttl_cache_expires_and_evicts_lru():
+    c = TTLCache(maxsize=2, ttl=60)
+    c.set("a", 1)
+    c.set("b", 2)
+    assert c.get("a") == 1          # "a" pasa a ser el más reciente
+    c.set("c", 3)
+    assert "b" not in c and c.get("a") == 1 and c.get("c") == 3
+    c.set("x", 9, ttl=0)
+    assert c.get("x") is None
+    assert c.stats()["misses"] == 1
+
+def test_prefetcher_serves_scheduled_page_once(override):
+    override(feed_prefetch_enabled=True)
+    p = Prefetcher(workers=1, maxsize=8, ttl=30, max_active=4)
+    gate = threading.Event()
+
+    def render():
+        gate.wait(2)
+        return {"items": [1]}
+    assert p.schedule("k", render)
+    assert not p.schedule("k", render)          # ya en vuelo
+    gate.set()
+    assert p.take("k", wait_s=2) == {"items": [1]}
+    assert p.take("k", wait_s=0) is None          # se entrega una sola vez
+    stats = p.stats()
+    assert stats["scheduled"] == 1 and stats["served"] == 1
+
+def test_prefetcher_skips_under_load(override):
+    override(feed_prefetch_enabled=True)
+    p = Prefetcher(workers=1, maxsize=8, ttl=30, max_active=1)
+    with p.serving(), p.serving():
+        assert not p.schedule("k", lambda: {})
+    assert p.stats()["skipped_load"] == 1
+
+def test_prefetcher_off_does_nothing(override):
+    override(feed_prefetch_enabled=False)
+    assert not Prefetcher(workers=1, maxsize=8, ttl=30, max_active=4).schedule("k", lambda: {})
+
+def test_products_304_until_feed_version_bumps(monkeypatch):
+    from fastapi.testclient import TestClient
+    import api.main as main
+    from shared.dynamo import bump_feed_version
+    monkeypatch.setattr(feed, "presign_epoch", lambda now=None: 1)
+    c = TestClient(main.app)
+    first = c.get("/products", params={"owner": "u_feed_test"})
+    etag = first.headers["etag"]
+    assert c.get("/products", params={"owner": "u_feed_test"}, headers={"If-None-Match": etag}).status_code == 304
+    bump_feed_version("u_feed_test")
+    again = c.get("/products", params={"owner": "u_feed_test"}, headers={"If-None-Match": etag})
+    assert again.status_code == 200 and again.headers["etag"] != etag
+
+def test_products_304_stops_when_presigned_urls_roll(monkeypatch):
+    from fastapi.testclient import TestClient
+    import api.main as main
+    monkeypatch.setattr(feed, "presign_epoch", lambda now=None: 1)
+    c = TestClient(main.app)
+    etag = c.get("/products", params={"owner": "u_feed_roll"}).headers["etag"]
+    monkeypatch.setattr(feed, "presign_epoch", lambda now=None: 2)
+    again = c.get("/products", params={"owner": "u_feed_roll"}, headers={"If-None-Match": etag})
+    assert again.status_code == 200 and again.headers["etag"] != etag
+
+def test_feed_diagnostics_need_admin_token(override):
+    from fastapi.testclient import TestClient
+    import api.main as main
+    override(admin_token="secreto")
+    c = TestClient(main.app)
+    for path in ("/products/prefetch", "/stats", "/admission"):
+        assert c.get(path).status_code == 403
+        assert c.get(path, headers={"X-Admin-Token": "otro"}).status_code == 403
+        assert c.get(path, headers={"X-Admin-Token": "secreto"}).status_code == 200
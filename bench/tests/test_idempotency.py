@@ -0,0 +1,99 @@
+from __future__ import annotations
+import threading, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from shared import idempotency
+from shared.idempotency import IdempotencyConflict
+
+def _key():
+    return f"k-{uuid.uuid4().hex}"
+
+class _Counted:
+    def __init__(self, gate: threading.Event = None, fail: bool = False):
+        self.calls = 0
+        self.gate = gate
+        self.fail = fail
+
+    def __call__(self):
+        self.calls += 1
+        if self.gate is not None:
+            assert self.gate.wait(5)
+        if self.fail:
+            raise RuntimeError("falló")
+        return {"conversation_id": f"conv_{self.calls}", "n": self.calls}
+
+def test_valid_key_and_fingerprint():
+    assert idempotency.valid_key("abc") and not idempotency.valid_key("") and not idempotency.valid_key(None)
+    assert not idempotency.valid_key("x" * (idempotency.MAX_KEY_LEN + 1)) and not idempotency.valid_key("a\nb")
+    assert idempotency.fingerprint("q", 1500) == idempotency.fingerprint("q", 1500)
+    assert idempotency.fingerprint("q", 1500) != idempotency.fingerprint("q", 1600)
+
+def test_without_key_always_runs():
+    fn = _Counted()
+    assert idempotency.run("u", None, "fp", fn) == ({"conversation_id": "conv_1", "n": 1}, False)
+    assert idempotency.run("u", None, "fp", fn)[1] is False and fn.calls == 2
+
+def test_retry_replays_stored_response():
+    fn, key = _Counted(), _key()
+    first = idempotency.run("u", key, "fp", fn)
+    again = idempotency.run("u", key, "fp", fn)
+    assert first == ({"conversation_id": "conv_1", "n": 1}, False)
+    assert again == (first[0], True) and fn.calls == 1
+    # la key es por usuario
+    assert idempotency.run("otro", key, "fp", fn)[1] is False and fn.calls == 2
+
+def test_same_key_other_payload_is_rejected():
+    key = _key()
+    idempotency.run("u", key, "fp-a", _Counted())
+    with pytest.raises(IdempotencyConflict) as e:
+        idempotency.run("u", key, "fp-b", _Counted())
+    assert e.value.reason == "key_reused"
+
+def test_concurrent_duplicates_single_flight():
+    gate, key = threading.Event(), _key()
+    fn = _Counted(gate)
+    with ThreadPoolExecutor(5) as pool:
+        futs = [pool.submit(idempotency.run, "u", key, "fp", fn) for _ in range(5)]
+        gate.set()
+        results = [f.result(5) for f in futs]
+    assert fn.calls == 1
+    assert all(body == results[0][0] for body, _ in results)
+    assert sorted(replayed for _, replayed in results) == [False, True, True, True, True]
+
+def test_failure_releases_key_for_the_next_attempt():
+    key = _key()
+    with pytest.raises(RuntimeError):
+        idempotency.run("u", key, "fp", _Counted(fail=True))
+    ok = _Counted()
+    assert idempotency.run("u", key, "fp", ok) == ({"conversation_id": "conv_1", "n": 1}, False)
+
+def test_duplicate_gives_up_while_first_is_in_flight(override):
+    override(idempotency_wait_s=0.05)
+    gate, key = threading.Event(), _key()
+    leader = threading.Thread(target=idempotency.run, args=("u", key, "fp", _Counted(gate)))
+    leader.start()
+    try:
+        until = time.monotonic() + 2
+        while f"u#{key}" not in idempotency._flights and time.monotonic() < until:
+            time.sleep(0.005)
+        with pytest.raises(IdempotencyConflict) as e:
+            idempotency.run("u", key, "fp", _Counted())
+        assert e.value.reason == "in_progress" and e.value.retry_after > 0
+    finally:
+        gate.set()
+        leader.join(5)
+
+def test_claim_held_by_another_process(override):
+    """Sin vuelo en memoria: el duplicado espera el item en DynamoDB y luego responde 409."""
+    from shared.dynamo import claim_idempotency, complete_idempotency
+    override(idempotency_wait_s=0.3)
+    key = _key()
+    ik = f"u#{key}"
+    now = time.time()
+    assert claim_idempotency(ik, "fp", "otro-proceso", now, 60, 3600) is None
+    with pytest.raises(IdempotencyConflict) as e:
+        idempotency.run("u", key, "fp", _Counted())
+    assert e.value.reason == "in_progress"
+    assert complete_idempotency(ik, "otro-proceso", '{"conversation_id": "conv_x"}', now + 3600)
+    fn = _Counted()
+    assert idempotency.run("u", key, "fp", fn) == ({"conversation_id": "conv_x"}, True) and fn.calls == 0
@@ -0,0 +1,53 @@
+from __future__ import annotations
+from shared.jsonrepair import coerce, extract_object, followup_prompt, problems
+
+SCHEMA = {
+    "type": "object",
+    "required": ["intent", "product_type", "tags"],
+    "properties": {
+        "intent": {"type": "string"},
+        "product_type": {"type": "string", "enum": ["poster", "t_shirt", "book"]},
+        "tags": {"type": "array", "items": {"type": "string"}, "maxItems": 3},
+        "price": {"type": "integer"},
+    },
+}
+
+def test_clean_json():
+    assert extract_object('{"a": 1}') == ({"a": 1}, "ok")
+
+def test_preamble_fence_and_trailing_commas():
+    text = 'Claro, aquí está:\n```json\n{"a": [1, 2,], "b": {"c": "x",},}\n```\nSaludos'
+    assert extract_object(text) == ({"a": [1, 2], "b": {"c": "x"}}, "repaired")
+
+def test_python_literals_outside_strings_only():
+    obj, how = extract_object('{"a": True, "b": None, "c": "True story"}')
+    assert (obj, how) == ({"a": True, "b": None, "c": "True story"}, "repaired")
+
+def test_truncated_keeps_complete_members():
+    obj, how = extract_object('{"intent": "poster", "tags": ["a", "b"], "notes": "sin term')
+    assert how == "truncated" and obj == {"intent": "poster", "tags": ["a", "b"]}
+
+def test_raw_newlines_inside_strings():
+    obj, _ = extract_object('x {"notes": "línea 1\nlínea 2"}')
+    assert obj == {"notes": "línea 1\nlínea 2"}
+
+def test_no_object():
+    assert extract_object("no hay json aquí") == (None, "")
+    assert extract_object("") == (None, "")
+
+def test_skips_brace_that_is_not_an_object():
+    assert extract_object('usa {llaves} así: {"a": 1}')[0] == {"a": 1}
+
+def test_coerce_unambiguous_fixes():
+    obj = coerce({"intent": 42, "product_type": "T-Shirt", "tags": "a; b, c", "extra": 1}, SCHEMA)
+    assert obj == {"intent": "42", "product_type": "t_shirt", "tags": ["a", "b", "c"], "extra": 1}
+
+def test_problems_only_lists_bad_fields():
+    bad = problems({"intent": "x", "product_type": "mug", "tags": ["a", "b", "c", "d"], "price": True}, SCHEMA)
+    assert set(bad) == {"product_type", "tags", "price"}
+    assert problems({"intent": "x"}, SCHEMA) == {"product_type": "falta", "tags": "falta"}
+    assert problems({"intent": "x", "product_type": "book", "tags": []}, SCHEMA) == {}
+
+def test_followup_prompt_names_only_bad_fields():
+    prompt = followup_prompt({"tags": "falta"}, SCHEMA)
+    assert "tags" in prompt and "product_type" not in prompt and "maxItems" in prompt
@@ -0,0 +1,44 @@
+from __future__ import annotations
+import json
+from shared.jsonstream import ObjectFields, field_callback
+
+BODY = ('{"intent": "póster, con coma", "tags": ["a", "b"], "nested": {"x": [1, {"y": "}"}]}, '
+        '"quote": "dice \\"hola\\"", "n": 3}')
+DOC = "```json\n" + BODY + "\n```"
+
+def _feed_all(chunks):
+    p = ObjectFields()
+    out = []
+    for c in chunks:
+        out.extend(p.feed(c))
+    return p, out
+
+def test_whole_document_in_one_chunk():
+    p, out = _feed_all([DOC])
+    assert [k for k, _ in out] == ["intent", "tags", "nested", "quote", "n"]
+    assert dict(out) == json.loads(BODY)
+    assert p.done
+
+def test_any_chunking_gives_same_fields():
+    expected = _feed_all([DOC])[1]
+    for size in (1, 2, 3, 7, 16):
+        _, out = _feed_all([DOC[i:i + size] for i in range(0, len(DOC), size)])
+        assert out == expected, size
+
+def test_field_is_emitted_as_soon_as_it_closes():
+    p = ObjectFields()
+    assert p.feed('{"intent": "po') == []
+    assert p.feed('ster", "sty') == [("intent", "poster")]
+    assert p.feed('le": "x"}') == [("style", "x")]
+    assert p.feed(', "late": 1}') == []          # después del cierre no hay más
+
+def test_duplicates_and_garbage_are_skipped():
+    _, out = _feed_all(['{"a": 1, "a": 2, oops, "b": [1,]}'])
+    assert out == [("a", 1)]
+
+def test_field_callback_adapter():
+    seen = []
+    on_text = field_callback(lambda k, v: seen.append((k, v)))
+    for c in ('{"a"', ': 1,', ' "b": 2}'):
+        on_text(c)
+    assert seen == [("a", 1), ("b", 2)]
@@ -0,0 +1,22 @@
+from __future__ import annotations
+import uuid
+from shared import counters
+from shared.dynamo import get_active_listings_by_product, put_listing, update_listing
+
+def _hits():
+    return counters.group("cache").snapshot().get("product_listings.hit", 0)
+
+def test_legacy_listing_lookup_is_batched_and_cached():
+    pid, other = f"prd_{uuid.uuid4().hex[:12]}", f"prd_{uuid.uuid4().hex[:12]}"
+    lid = f"lst_{uuid.uuid4().hex[:12]}"
+    put_listing({"listing_id": lid, "product_id": pid, "price_cents": 900, "currency": "USD",
+                 "status": "active", "metadata": {"stage": "dev"}})
+    put_listing({"listing_id": f"lst_{uuid.uuid4().hex[:12]}", "product_id": pid, "price_cents": 1,
+                 "currency": "USD", "status": "inactive", "metadata": {"stage": "dev"}})
+    got = get_active_listings_by_product([pid, other])
+    assert [x["listing_id"] for x in got[pid]] == [lid] and got[other] == []
+    hits = _hits()
+    assert get_active_listings_by_product([pid, other]) == got      # también el "no hay" queda en cache
+    assert _hits() == hits + 2
+    update_listing(lid, pid, {"status": "inactive"})
+    assert get_active_listings_by_product([pid])[pid] == []
@@ -0,0 +1,85 @@
+from __future__ import annotations
+import threading, time
+import pytest
+from shared.pipeline import Graph, StepFailed
+
+def test_steps_see_dependency_results_and_run_in_parallel():
+    both = threading.Barrier(2, timeout=2)
+
+    def left(r):
+        both.wait()          # sólo pasa si "right" corre a la vez
+        return 1
+
+    def right(r):
+        both.wait()
+        return 2
+    g = Graph("t")
+    g.step("left", left).step("right", right)
+    g.step("sum", lambda r: r["left"] + r["right"], deps=("left", "right"))
+    assert g.run() == {"left": 1, "right": 2, "sum": 3}
+    tl = {s["step"]: s for s in g.timeline()}
+    assert tl["sum"]["deps"] == ["left", "right"] and all(s["ok"] for s in tl.values())
+
+def test_declaration_errors():
+    g = Graph("t").step("a", lambda r: 1)
+    with pytest.raises(ValueError):
+        g.step("a", lambda r: 2)
+    with pytest.raises(ValueError):
+        g.step("b", lambda r: 2, deps=("missing",))
+
+def test_failure_undoes_finished_steps_in_reverse_and_stops_scheduling():
+    undone, ran = [], []
+
+    def boom(r):
+        raise RuntimeError("no")
+    g = Graph("t", max_workers=1)
+    g.step("a", lambda r: "A", undo=undone.append)
+    g.step("b", lambda r: "B", deps=("a",), undo=undone.append)
+    g.step("c", boom, deps=("b",), undo=undone.append)
+    g.step("d", lambda r: ran.append("d"), deps=("c",))
+    with pytest.raises(StepFailed) as e:
+        g.run()
+    assert e.value.step == "c" and isinstance(e.value.error, RuntimeError)
+    assert undone == ["B", "A"]
+    assert ran == []
+
+def test_running_siblings_finish_and_are_undone():
+    undone = []
+    started = threading.Event()
+
+    def slow(r):
+        started.set()
+        time.sleep(0.05)
+        return "slow"
+
+    def fail(r):
+        started.wait(2)
+        raise ValueError("x")
+    g = Graph("t", max_workers=2)
+    g.step("slow", slow, undo=undone.append)
+    g.step("fail", fail)
+    with pytest.raises(StepFailed):
+        g.run()
+    assert undone == ["slow"]
+
+def test_skipped_steps_return_none_and_are_not_undone():
+    undone = []
+    g = Graph("t")
+    g.step("a", lambda r: "A", when=lambda r: False, undo=undone.append)
+    g.step("b", lambda r: r["a"], deps=("a",))
+    g.step("c", lambda r: 1 / 0, deps=("b",))
+    with pytest.raises(StepFailed):
+        g.run()
+    assert undone == []
+    tl = {s["step"]: s for s in g.timeline()}
+    assert tl["a"].get("skipped") is True
+
+def test_undo_errors_do_not_mask_the_failure():
+    def bad_undo(_):
+        raise OSError("undo")
+    g = Graph("t")
+    g.step("a", lambda r: 1, undo=bad_undo)
+    g.step("b", lambda r: 1 / 0, deps=("a",))
+    with pytest.raises(StepFailed) as e:
+        g.run()
+    assert e.value.step == "b"
@@ -0,0 +1,66 @@
+from __future__ import annotations
+import json
+from agents.refine_flow import approx_tokens, render_message, split_turns, window
+
+def _user(text):
+    return {"role": "user", "content": text}
+
+def _brief(intent, product_type="poster"):
+    return {"role": "assistant", "content": json.dumps({"brief": {
+        "intent": intent, "product_type": product_type, "style": "neón", "design_prompt": intent}})}
+
+def _turns(n):
+    msgs = []
+    for i in range(n):
+        msgs += [_user(f"cambio {i}"), _brief(f"idea {i}"),
+                 {"role": "assistant", "content": json.dumps({"ids": {"product_id": "p"}})}]
+    return msgs
+
+def test_render_message_reduces_assistant_json():
+    assert render_message(_user("  hola \n mundo ")) == "Usuario: hola mundo"
+    assert render_message(_brief("jaguar")) == "Asistente (brief): poster · jaguar · estilo neón"
+    design = {"role": "assistant", "content": json.dumps({"design": {"regenerated": ["image"]}})}
+    assert render_message(design) == "Asistente (assets): image"
+    assert render_message({"role": "assistant", "content": json.dumps({"ids": {}})}) is None
+    assert render_message(_user("x" * 10_000)).endswith("…")
+
+def test_split_turns_groups_replies_under_user():
+    turns = split_turns(_turns(3))
+    assert len(turns) == 3 and all(len(t) == 3 and t[0]["role"] == "user" for t in turns)
+    assert len(split_turns([_brief("sola")])) == 1
+
+def test_window_keeps_recent_turns_and_folds_the_rest(override):
+    override(refine_recent_turns=2, refine_context_tokens=10_000)
+    msgs = _turns(5)
+    text, folded, stats = window("resumen previo", msgs)
+    assert stats["turns"] == 2
+    assert folded == msgs[:9]
+    assert text.startswith("Resumen: resumen previo\n")
+    assert "cambio 3" in text and "cambio 4" in text and "cambio 2" not in text
+    assert text.index("cambio 3") < text.index("cambio 4")
+
+def test_window_respects_token_budget(override):
+    override(refine_recent_turns=10)
+    msgs = _turns(6)
+    per_turn = sum(approx_tokens(line) for line in map(render_message, msgs[:3]) if line)
+    override(refine_context_tokens=per_turn * 2 + 1)
+    text, folded, stats = window("", msgs)
+    assert stats["turns"] == 2 and stats["tokens"] <= per_turn * 2 + 1
+    assert len(folded) == 12
+
+def test_window_trims_last_turn_when_it_alone_does_not_fit(override):
+    override(refine_recent_turns=3)
+    msgs = [_user("corto"), _brief("x" * 400)]
+    budget = approx_tokens("Usuario: corto") + 2
+    override(refine_context_tokens=budget)
+    text, folded, stats = window("", msgs)
+    assert text == "Usuario: corto" and folded == [] and stats["turns"] == 1
+
+def test_window_counts_summary_against_budget(override):
+    override(refine_recent_turns=4, refine_context_tokens=50)
+    msgs = _turns(2)
+    text, folded, stats = window("r" * 400, msgs)
+    assert stats["summary_tokens"] == 100
+    # el resumen se come el presupuesto: el último turno no entra (se plegará en el próximo refine)
+    assert text == "Resumen: " + "r" * 400
+    assert folded == msgs[:3]
@@ -5,6 +5,7 @@ from aws_cdk import (
     aws_iam as iam, aws_kms as kms,
     aws_lambda as _lambda,
     aws_apigateway as apigw,
+    aws_events as events, aws_events_targets as targets,
 )
 from constructs import Construct
 from aws_cdk.aws_lambda_python_alpha import PythonFunction, PythonLayerVersion
@@ -50,6 +51,28 @@ class CoreStack(Stack):
             sort_key=ddb.Attribute(name="created_at", type=ddb.AttributeType.STRING),
             billing_mode=ddb.BillingMode.PAY_PER_REQUEST,
             point_in_time_recovery=True)
+        usage = ddb.Table(self, "Usage",
+            partition_key=ddb.Attribute(name="scope_id", type=ddb.AttributeType.STRING),
+            sort_key=ddb.Attribute(name="period", type=ddb.AttributeType.STRING),
+            billing_mode=ddb.BillingMode.PAY_PER_REQUEST)
+        rate_limits = ddb.Table(self, "RateLimits",
+            partition_key=ddb.Attribute(name="bucket_id", type=ddb.AttributeType.STRING),
+            billing_mode=ddb.BillingMode.PAY_PER_REQUEST)
+        # índice invertido: (token, product_id) -> peso/ts; (token, "#") -> tamaño del posting list
+        search = ddb.Table(self, "Search",
+            partition_key=ddb.Attribute(name="token", type=ddb.AttributeType.STRING),
+            sort_key=ddb.Attribute(name="product_id", type=ddb.AttributeType.STRING),
+            billing_mode=ddb.BillingMode.PAY_PER_REQUEST)
+        # Idempotency-Key de /create: registro en vuelo/hecho con la respuesta, borrado por TTL
+        idempotency = ddb.Table(self, "Idempotency",
+            partition_key=ddb.Attribute(name="idem_key", type=ddb.AttributeType.STRING),
+            billing_mode=ddb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at")
+        # feed público: (bucket de tiempo, <ms>#product_id) -> tarjeta; ("#buckets", bucket) -> directorio
+        public_feed = ddb.Table(self, "PublicFeed",
+            partition_key=ddb.Attribute(name="bucket", type=ddb.AttributeType.STRING),
+            sort_key=ddb.Attribute(name="sk", type=ddb.AttributeType.STRING),
+            billing_mode=ddb.BillingMode.PAY_PER_REQUEST)
 
 
         managed = iam.ManagedPolicy(self, "LambdaBedrockS3DdbPolicy",
@@ -59,7 +82,8 @@ class CoreStack(Stack):
                 ], resources=["*"]),
                 iam.PolicyStatement(actions=["dynamodb:*"], resources=[
                     products.table_arn, listings.table_arn, users.table_arn, jobs.table_arn,
-                    conversations.table_arn, messages.table_arn
+                    conversations.table_arn, messages.table_arn, usage.table_arn,
+                    rate_limits.table_arn, search.table_arn, public_feed.table_arn
                 ]),
                 iam.PolicyStatement(actions=["s3:*Object","s3:ListBucket"], resources=[
                     uploads.bucket_arn, f"{uploads.bucket_arn}/*",
@@ -91,6 +115,11 @@ class CoreStack(Stack):
             "DDB_TABLE_JOBS": jobs.table_name,
             "DDB_TABLE_CONVERSATIONS": conversations.table_name,
             "DDB_TABLE_MESSAGES": messages.table_name,
+            "DDB_TABLE_USAGE": usage.table_name,
+            "DDB_TABLE_RATE_LIMITS": rate_limits.table_name,
+            "DDB_TABLE_SEARCH": search.table_name,
+            "DDB_TABLE_IDEMPOTENCY": idempotency.table_name,
+            "DDB_TABLE_PUBLIC_FEED": public_feed.table_name,
             "S3_BUCKET_UPLOADS": uploads.bucket_name,
             "S3_BUCKET_ASSETS": assets.bucket_name,
             "S3_BUCKET_PUBLIC": public.bucket_name,
@@ -101,7 +130,15 @@ class CoreStack(Stack):
             "LLM_STREAMING": "true",   
             "LLM_CACHE_PROMPT": "",     
             "BEDROCK_IMAGE_MODEL_ID": "amazon.titan-image-generator-v2:0",
+            "ADMISSION_BACKEND": "dynamodb",
+            "ADMISSION_USER_RPM": "10",
+            "ADMISSION_TEXT_RPM": "50",
+            "ADMISSION_IMAGE_RPM": "20",
+            "USAGE_FLUSH_CALLS": "20",
+            "USAGE_FLUSH_SECS": "10",
             "STAGE": "dev",
+            "TRACING_ENABLED": "true",
+            "METRICS_NAMESPACE": "KaiKashi/DreamForge",
             "AUTH_BYPASS": "true",
             "COGNITO_USER_POOL_ID": "us-east-1_XXXXXXXXX",
             "COGNITO_CLIENT_ID": "XXXXXXXXXXXXXXXXXXXX"
@@ -128,12 +165,35 @@ class CoreStack(Stack):
             runtime=_lambda.Runtime.PYTHON_3_11, memory_size=1024, timeout=Duration.seconds(60),
             environment=env, role=role, layers=[app_layer])
 
+        fn_usage = PythonFunction(self, "UsageFn",
+            entry="lambdas/usage", index="index.py", handler="handler",
+            runtime=_lambda.Runtime.PYTHON_3_11, memory_size=256, timeout=Duration.seconds(10),
+            environment=env, role=role, layers=[app_layer])
+
+        fn_feed_compact = PythonFunction(self, "FeedCompactFn",
+            entry="lambdas/feed_compact", index="index.py", handler="handler",
+            runtime=_lambda.Runtime.PYTHON_3_11, memory_size=256, timeout=Duration.minutes(5),
+            environment=env, role=role, layers=[app_layer])
+        events.Rule(self, "FeedCompactSchedule",
+            schedule=events.Schedule.cron(minute="15", hour="3"),
+            targets=[targets.LambdaFunction(fn_feed_compact)])
+
         products.grant_read_write_data(fn_interpret); products.grant_read_write_data(fn_design); products.grant_read_data(fn_listing)
         listings.grant_read_write_data(fn_listing)
+        # publish: product + listing en un TransactWriteItems
+        products.grant_read_write_data(fn_create); listings.grant_read_write_data(fn_create)
         uploads.grant_read_write(fn_design); assets.grant_read_write(fn_design); assets.grant_read(fn_listing)
         key.grant_encrypt_decrypt(fn_interpret); key.grant_encrypt_decrypt(fn_design); key.grant_encrypt_decrypt(fn_listing)
         conversations.grant_read_write_data(fn_interpret); conversations.grant_read_write_data(fn_design); conversations.grant_read_write_data(fn_create)
         messages.grant_read_write_data(fn_interpret); messages.grant_read_write_data(fn_design); messages.grant_read_write_data(fn_create)
+        usage.grant_read_write_data(fn_interpret); usage.grant_read_write_data(fn_design); usage.grant_read_write_data(fn_create); usage.grant_read_data(fn_usage)
+        conversations.grant_read_data(fn_usage)   # /usage?conversation_id: comprueba el dueño
+        rate_limits.grant_read_write_data(fn_interpret); rate_limits.grant_read_write_data(fn_design); rate_limits.grant_read_write_data(fn_create)
+        users.grant_read_write_data(fn_design); users.grant_read_write_data(fn_create); users.grant_read_data(fn_listing)
+        search.grant_read_write_data(fn_create); search.grant_read_data(fn_listing)
+        idempotency.grant_read_write_data(fn_create)
+        public_feed.grant_read_write_data(fn_create); public_feed.grant_read_data(fn_listing)
+        public_feed.grant_read_write_data(fn_feed_compact)
 
         api = apigw.RestApi(self, "KaiKashiApi",
             rest_api_name="KaiKashi DreamForge API",
@@ -141,6 +201,10 @@ class CoreStack(Stack):
 
         api.root.add_resource("interpret").add_method("POST", apigw.LambdaIntegration(fn_interpret))
         api.root.add_resource("design").add_method("POST", apigw.LambdaIntegration(fn_design))
-        api.root.add_resource("products").add_method("GET", apigw.LambdaIntegration(fn_listing))
+        products_res = api.root.add_resource("products")
+        products_res.add_method("GET", apigw.LambdaIntegration(fn_listing))
+        products_res.add_resource("search").add_method("GET", apigw.LambdaIntegration(fn_listing))
         api.root.add_resource("create").add_method("POST", apigw.LambdaIntegration(fn_create))
+        api.root.add_resource("feed").add_method("GET", apigw.LambdaIntegration(fn_listing))
+        api.root.add_resource("usage").add_method("GET", apigw.LambdaIntegration(fn_usage))
         CfnOutput(self, "ApiUrl", value=api.url)
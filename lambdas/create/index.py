@@ -1,10 +1,9 @@
 from __future__ import annotations
 import json, uuid
-from agents.dream_interpret import interpret_dream
-from agents.design_generate import generate_assets
-from agents.listing_publish import create_product_and_listing
-from shared.dynamo import ensure_conversation, put_message
-from shared.config import settings
+from agents.create_flow import run_create
+from shared import deadline, idempotency, tracing, usage
+from shared.admission import AdmissionRejected
+from shared.idempotency import IdempotencyConflict
 
 def _ok(b, c=200):
     return {
@@ -13,7 +12,13 @@ def _ok(b, c=200):
         "body": json.dumps(b, ensure_ascii=False),
     }
 
-def handler(event, _ctx):
+def _too_many(e: AdmissionRejected):
+    r = _ok({"error": "too_many_requests", "reason": e.reason, "retry_after": e.retry_after}, 429)
+    r["headers"]["Retry-After"] = str(int(e.retry_after + 0.999))
+    return r
+
+@tracing.lambda_traced("create")
+def handler(event, ctx):
     body = event.get("body") or "{}"
     try:
         payload = json.loads(body)
@@ -30,51 +35,68 @@ def handler(event, _ctx):
     if not q:
         return _ok({"error": "missing q"}, 400)
 
-    conversation_id = f"conv_{uuid.uuid4().hex[:12]}"
-    ensure_conversation(
-        conversation_id=conversation_id,
-        user_id=user_id,
-        model_id=settings.bedrock_text_model_id,
-        title=q[:64] + ("…" if len(q) > 64 else ""),
-    )
-    put_message(conversation_id, role="user", content=q)
+    idem_key = payload.get("idempotency_key") or _header(event, "idempotency-key")
+    if idem_key is not None and not idempotency.valid_key(idem_key):
+        return _ok({"error": "invalid idempotency_key"}, 400)
+
+    def execute():
+        return _create(q, user_id, user_id_defaulted, price_cents)
+
+    fp = idempotency.fingerprint(q, price_cents)
+    try:
+        # el plazo cubre también la espera de un duplicado a la ejecución en vuelo
+        with deadline.scope(deadline.lambda_budget(ctx)):
+            body, replayed = idempotency.run(user_id, idem_key, fp, execute)
+    except AdmissionRejected as e:
+        return _too_many(e)
+    except IdempotencyConflict as e:
+        if e.reason == "key_reused":
+            return _ok({"error": "idempotency_key_reused"}, 422)
+        r = _ok({"error": "request_in_progress", "retry_after": e.retry_after}, 409)
+        r["headers"]["Retry-After"] = str(int(e.retry_after + 0.999))
+        return r
+    r = _ok(body)
+    if replayed:
+        r["headers"]["Idempotent-Replayed"] = "true"
+    return r
 
-    brief = interpret_dream(q)
-    put_message(conversation_id, role="assistant",
-                content=json.dumps({"brief": brief}, ensure_ascii=False))
+def _header(event, name: str):
+    for k, v in (event.get("headers") or {}).items():
+        if k.lower() == name:
+            return v
+    return None
 
-    design = generate_assets(brief.get("design_prompt", q), brief, user_id)
-    all_keys = []
-    for k in ["image_key","pdf_key","docx_key","rtf_key","text_key","video_key","model3d_key"]:
-        v = design.get(k)
-        if v: all_keys.append(v)
-    for v in design.get("media_keys", []):
-        if v not in all_keys:
-            all_keys.append(v)
-    put_message(conversation_id, role="assistant",
-                content=json.dumps({"design": design}, ensure_ascii=False),
-                media_keys=all_keys or None)
+def _create(q, user_id, user_id_defaulted, price_cents):
+    conversation_id = f"conv_{uuid.uuid4().hex[:12]}"
+    try:
+        with usage.scope(user_id=user_id, conversation_id=conversation_id) as use:
+            out = run_create(q, user_id, conversation_id=conversation_id, price_cents=price_cents)
+    finally:
+        usage.flush()
 
-    ids = create_product_and_listing(
-        user_id=user_id,
-        package=design["package"],
-        media_keys=all_keys,
-        price_cents=price_cents,
-    )
-    put_message(conversation_id, role="assistant",
-                content=json.dumps({"ids": ids}, ensure_ascii=False))
+    if out["clarify"]:
+        return {
+            "conversation_id": out["conversation_id"],
+            "brief": out["brief"],
+            "clarify": True,
+            "message": out["brief"].get("notes", ""),
+            "user_id": user_id,
+            "user_id_defaulted": user_id_defaulted,
+            "usage": use.totals(),
+        }
 
     resp = {
         "conversation_id": conversation_id,
-        "brief": brief,
-        "design": design,
-        "ids": ids,
+        "brief": out["brief"],
+        "design": out["design"],
+        "ids": out["ids"],
         "price_cents": price_cents,
         "currency": "USD",
         "user_id": user_id,
-        "user_id_defaulted": user_id_defaulted
+        "user_id_defaulted": user_id_defaulted,
+        "timeline": out["timeline"],
+        "usage": use.totals(),
     }
     if user_id_defaulted:
         resp["message"] = "user_id not provided; using test user 'user_dev_001'."
-
-    return _ok(resp)
+    return resp
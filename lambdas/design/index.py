@@ -1,5 +1,7 @@
 from __future__ import annotations
 import json
+from shared import deadline, tracing, usage
+from shared.admission import AdmissionRejected
 from agents.dream_interpret import interpret_dream
 from agents.design_generate import generate_assets
 
@@ -7,7 +9,13 @@ def _ok(b, c=200):
     return {"statusCode": c, "headers":{"Content-Type":"application/json"},
             "body": json.dumps(b, ensure_ascii=False)}
 
-def handler(event, _ctx):
+def _too_many(e: AdmissionRejected):
+    r = _ok({"error": "too_many_requests", "reason": e.reason, "retry_after": e.retry_after}, 429)
+    r["headers"]["Retry-After"] = str(int(e.retry_after + 0.999))
+    return r
+
+@tracing.lambda_traced("design")
+def handler(event, ctx):
     body = event.get("body") or "{}"
     try: payload = json.loads(body)
     except: payload = {}
@@ -17,7 +25,13 @@ def handler(event, _ctx):
     if not q:
         return _ok({"error":"missing q"}, 400)
 
-    brief = interpret_dream(q)
-    out = generate_assets(brief.get("design_prompt", q), brief, user_id=user_id)
+    try:
+        with deadline.scope(deadline.lambda_budget(ctx)), usage.scope(user_id=user_id) as use:
+            brief = interpret_dream(q)
+            out = generate_assets(brief.get("design_prompt", q), brief, user_id=user_id)
+    except AdmissionRejected as e:
+        return _too_many(e)
+    finally:
+        usage.flush()
 
-    return _ok({"brief": brief, "design": out})
+    return _ok({"brief": brief, "design": out, "usage": use.totals()})
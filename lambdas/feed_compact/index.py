@@ -0,0 +1,15 @@
+from __future__ import annotations
+import json
+from shared import discovery, tracing
+
+# Programado (EventBridge, una vez al día): borra los buckets del feed público fuera de
+# DISCOVERY_RETENTION_DAYS. El evento puede traer {"dry_run": true} o {"retention_days": n}.
+
+@tracing.lambda_traced("feed_compact")
+def handler(event, _ctx):
+    event = event if isinstance(event, dict) else {}
+    days = event.get("retention_days")
+    out = discovery.compact(retention_days=int(days) if days is not None else None,
+                            dry_run=bool(event.get("dry_run")))
+    print(json.dumps({"feed_compact": out}))
+    return out
@@ -1,12 +1,20 @@
 from __future__ import annotations
 import json
+from shared import deadline, tracing, usage
+from shared.admission import AdmissionRejected
 from agents.dream_interpret import interpret_dream
 
 def _ok(body, code=200):
     return {"statusCode": code, "headers":{"Content-Type":"application/json"},
             "body": json.dumps(body, ensure_ascii=False)}
 
-def handler(event, _ctx):
+def _too_many(e: AdmissionRejected):
+    r = _ok({"error": "too_many_requests", "reason": e.reason, "retry_after": e.retry_after}, 429)
+    r["headers"]["Retry-After"] = str(int(e.retry_after + 0.999))
+    return r
+
+@tracing.lambda_traced("interpret")
+def handler(event, ctx):
     body = event.get("body") or "{}"
     try:
         payload = json.loads(body)
@@ -15,5 +23,12 @@ def handler(event, _ctx):
     q = payload.get("q") or payload.get("text") or ""
     if not q:
         return _ok({"error":"missing q"}, 400)
-    brief = interpret_dream(q)
-    return _ok({"brief": brief})
+    user_id = payload.get("user_id")
+    try:
+        with deadline.scope(deadline.lambda_budget(ctx)), usage.scope(user_id=user_id) as use:
+            brief = interpret_dream(q, reserve_s=0)
+    except AdmissionRejected as e:
+        return _too_many(e)
+    finally:
+        usage.flush()
+    return _ok({"brief": brief, "usage": use.totals()})
@@ -1,25 +1,22 @@
 from __future__ import annotations
-import os, json, base64, boto3
-from boto3.dynamodb.conditions import Attr
-from decimal import Decimal
+import os, json, base64
 from typing import Optional, Dict, Any, List
+from shared.aws import dynamodb_client
 from shared.config import settings
 from shared.s3 import presign_get
+from shared import tracing, feed, ddbjson, search, discovery
+from shared.dynamo import get_active_listings_by_product, get_feed_version, get_products
 
-ddb = boto3.resource("dynamodb")
-tbl_products = ddb.Table(settings.ddb_products)
-tbl_listings = ddb.Table(settings.ddb_listings)
+# Cliente de bajo nivel: los items se decodifican en una pasada a tipos planos
+# (sin TypeDeserializer ni Decimal) y se serializan directo.
+ddb = dynamodb_client()
 
-def _to_jsonable(x):
-    if isinstance(x, list):  return [_to_jsonable(v) for v in x]
-    if isinstance(x, dict):  return {k: _to_jsonable(v) for k, v in x.items()}
-    if isinstance(x, Decimal):
-        return int(x) if x == x.to_integral_value() else float(x)
-    return x
+PRODUCT_ATTRS = ("product_id", "owner_id", "title", "description", "status", "media_keys", "listing")
+LISTING_ATTRS = ("listing_id", "product_id", "price_cents", "currency", "status", "metadata")
 
-def _ok(b, c=200):
-    return {"statusCode": c, "headers": {"Content-Type": "application/json"},
-            "body": json.dumps(_to_jsonable(b), ensure_ascii=False)}
+def _ok(b, c=200, headers: Optional[Dict[str, str]] = None):
+    return {"statusCode": c, "headers": {"Content-Type": "application/json", **(headers or {})},
+            "body": ddbjson.dumps(b)}
 
 def _enc(d: Optional[Dict[str, Any]]) -> Optional[str]:
     if not d: return None
@@ -32,13 +29,24 @@ def _dec(s: Optional[str]) -> Optional[Dict[str, Any]]:
     except Exception:
         return None
 
-def _first_active_listing_for_product(pid: str, want_stage: str | None):
-    fe = Attr("product_id").eq(pid) & Attr("status").eq("active")
-    if want_stage:
-        fe = fe & Attr("metadata.stage").eq(want_stage)
-    resp = tbl_listings.scan(Limit=1, FilterExpression=fe)
-    items = resp.get("Items") or []
-    return items[0] if items else None
+def _pick_listing(listings: List[Dict[str, Any]], want_stage: str | None):
+    for lst in listings:
+        if not want_stage or (lst.get("metadata") or {}).get("stage") == want_stage:
+            return {k: lst.get(k) for k in LISTING_ATTRS}
+    return None
+
+def _listing_from_summary(pid: str, s: Dict[str, Any], want_stage: str | None):
+    """Resumen denormalizado en el product -> misma forma que la listing, sin leer la tabla."""
+    if s.get("status") != "active" or (want_stage and s.get("stage") != want_stage):
+        return None
+    return {
+        "listing_id": s.get("listing_id"),
+        "product_id": pid,
+        "price_cents": s.get("price_cents"),
+        "currency": s.get("currency"),
+        "status": s.get("status"),
+        "metadata": {"stage": s.get("stage")},
+    }
 
 def _infer_type(key: str) -> str:
     k = (key or "").lower()
@@ -61,32 +69,38 @@ def _presign_media(keys: List[str]) -> List[Dict[str, Any]]:
         out.append({"key": mk, "url": url, "type": _infer_type(mk)})
     return out
 
-def handler(event, _ctx):
-    qs: Dict[str, str] = event.get("queryStringParameters") or {}
-    owner  = qs.get("owner") or qs.get("user_id")  # acepta owner o user_id
-    status = qs.get("status")
-    limit  = int(qs.get("limit") or "20")
-    stage  = qs.get("stage") or os.environ.get("STAGE")
-    page_token = qs.get("page_token")
+def _render_page(owner: str, status: Optional[str], limit: int, stage: Optional[str],
+                 page_token: Optional[str]) -> Dict[str, Any]:
     cursor = _dec(page_token)
-
-    if not owner:
-        return _ok({"error": "missing owner/user_id"}, 400)
-
-    fe = Attr("media_keys").size().gt(0) & Attr("owner_id").eq(owner)
+    names = {"#o": "owner_id", "#m": "media_keys"}
+    values: Dict[str, Any] = {":o": {"S": owner}, ":z": {"N": "0"}}
+    fe = "size(#m) > :z AND #o = :o"
     if status:
-        fe = fe & Attr("status").eq(status)
+        names["#s"] = "status"
+        values[":s"] = {"S": status}
+        fe += " AND #s = :s"
+    pe, pnames = ddbjson.projection(PRODUCT_ATTRS)
+    names.update(pnames)
 
     scan_kwargs = {
+        "TableName": settings.ddb_products,
         "Limit": limit,
         "FilterExpression": fe,
+        "ProjectionExpression": pe,
+        "ExpressionAttributeNames": names,
+        "ExpressionAttributeValues": values,
     }
     if cursor:
-        scan_kwargs["ExclusiveStartKey"] = cursor
+        scan_kwargs["ExclusiveStartKey"] = ddbjson.encode_key(cursor)
 
-    resp = tbl_products.scan(**scan_kwargs)
-    products = resp.get("Items", [])
-    last_key = resp.get("LastEvaluatedKey")
+    with tracing.span("ddb.list_products"):
+        resp = ddb.scan(**scan_kwargs)
+    products = ddbjson.decode_items(resp.get("Items", []))
+    last_key = ddbjson.decode_item(resp.get("LastEvaluatedKey"))
+
+    # products anteriores al resumen: sus listings activas, en lote y vía cache
+    legacy = [p["product_id"] for p in products if p.get("product_id") and not p.get("listing")]
+    by_product = get_active_listings_by_product(legacy) if legacy else {}
 
     out = []
     for p in products:
@@ -94,7 +108,9 @@ def handler(event, _ctx):
         if not pid:
             continue
         media = _presign_media(p.get("media_keys") or [])
-        listing = _first_active_listing_for_product(pid, stage)
+        summary = p.pop("listing", None)
+        listing = _listing_from_summary(pid, summary, stage) if summary \
+            else _pick_listing(by_product.get(pid) or [], stage)
         out.append({
             "product": {**p, "media": media},
             "listing": listing
@@ -103,10 +119,105 @@ def handler(event, _ctx):
     has_more = bool(last_key)
     next_page_token = _enc(last_key) if has_more else None
 
-    return _ok({
+    return {
         "items": out,
         "count": len(out),
         "has_more": has_more,
         "next_page_token": next_page_token,
         "applied_filters": {"owner": owner, "status": status, "limit": limit}
-    })
+    }
+
+def _search(qs: Dict[str, str], stage: Optional[str]):
+    q = qs.get("q") or ""
+    tags = [t for t in (qs.get("tags") or "").split(",") if t.strip()]
+    ptype = qs.get("type") or ""
+    limit = max(1, min(int(qs.get("limit") or "20"), 100))
+    if not search.query_tokens(q, tags, ptype):
+        return _ok({"error": "missing q/tags/type"}, 400)
+    hits = search.search(q, tags, ptype, limit=limit)
+    products = get_products([h["product_id"] for h in hits])
+    out = []
+    for h in hits:
+        p = products.get(h["product_id"])
+        if not p:
+            continue  # índice por delante/detrás del product (p.ej. borrado)
+        summary = p.pop("listing", None)
+        out.append({
+            "product": {**p, "media": _presign_media(p.get("media_keys") or [])},
+            "listing": _listing_from_summary(p["product_id"], summary, stage) if summary else None,
+            "score": h["score"],
+        })
+    return _ok({"items": out, "count": len(out),
+                "applied_filters": {"q": q, "tags": tags, "type": ptype, "limit": limit}})
+
+def _discovery(qs: Dict[str, str]):
+    limit = max(1, min(int(qs.get("limit") or "20"), 100))
+    page_token = qs.get("page_token")
+    key = (limit, page_token or "")
+    page = discovery.pages.get(key)
+    if page is None:
+        cards, nxt = discovery.page(limit, _dec(page_token))
+        items = []
+        for c in cards:
+            items.append({
+                "product_id": c["product_id"],
+                "owner_id": c.get("owner_id"),
+                "title": c.get("title", ""),
+                "product_type": c.get("product_type", ""),
+                "preview": _presign_media([c["preview_key"]])[0] if c.get("preview_key") else None,
+                "price_cents": c.get("price_cents"),
+                "currency": c.get("currency"),
+                "published_at": c.get("published_at"),
+            })
+        page = {"items": items, "count": len(items), "has_more": nxt is not None, "next_page_token": _enc(nxt)}
+        discovery.pages.set(key, page)
+    return _ok(page, headers={"Cache-Control": f"public, max-age={int(settings.discovery_cache_ttl_s)}"})
+
+@tracing.lambda_traced("listing")
+def handler(event, _ctx):
+    qs: Dict[str, str] = event.get("queryStringParameters") or {}
+    route = (event.get("resource") or event.get("path") or "").rstrip("/")
+    if route.endswith("/search"):
+        return _search(qs, qs.get("stage") or os.environ.get("STAGE"))
+    if route.endswith("/feed"):
+        return _discovery(qs)
+    owner  = qs.get("owner") or qs.get("user_id")  # acepta owner o user_id
+    status = qs.get("status")
+    limit  = int(qs.get("limit") or "20")
+    stage  = qs.get("stage") or os.environ.get("STAGE")
+    page_token = qs.get("page_token")
+
+    if not owner:
+        return _ok({"error": "missing owner/user_id"}, 400)
+
+    try:
+        version: Optional[int] = get_feed_version(owner)
+    except Exception:
+        version = None
+
+    if version is None:
+        return _ok(_render_page(owner, status, limit, stage, page_token))
+
+    view = f"lambda:{stage or ''}"
+    epoch = feed.presign_epoch()
+    etag = feed.etag_for(owner, version, status=status, cursor=page_token, limit=limit, view=view, epoch=epoch)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if feed.etag_matches(feed.header(event.get("headers"), "If-None-Match"), etag):
+        return {"statusCode": 304, "headers": headers, "body": ""}
+
+    with feed.prefetcher.serving():
+        key = feed.page_key(owner, version, status=status, cursor=page_token, limit=limit, view=view, epoch=epoch)
+        page = feed.page_cache.get(key)
+        if page is None:
+            page = feed.prefetcher.take(key)
+            if page is None:
+                page = _render_page(owner, status, limit, stage, page_token)
+            feed.page_cache.set(key, page)
+
+        # El hilo de prefetch sigue mientras el contenedor esté caliente (se congela
+        # entre invocaciones); la siguiente página lo espera hasta FEED_PREFETCH_WAIT_S.
+        nxt = page.get("next_page_token")
+        if nxt:
+            nkey = feed.page_key(owner, version, status=status, cursor=nxt, limit=limit, view=view, epoch=epoch)
+            feed.prefetcher.schedule(nkey, lambda: _render_page(owner, status, limit, stage, nxt))
+    return _ok(page, headers=headers)
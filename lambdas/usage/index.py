@@ -0,0 +1,33 @@
+from __future__ import annotations
+import json
+from typing import Any, Dict, Optional
+from shared import usage
+from shared.config import settings
+from shared.dynamo import get_conversation, get_usage_items
+
+def _ok(b, c=200):
+    return {"statusCode": c, "headers": {"Content-Type": "application/json"},
+            "body": json.dumps(b, ensure_ascii=False)}
+
+def _caller(event: Dict[str, Any]) -> Optional[str]:
+    """Usuario del authorizer (Cognito: `claims.sub`; Lambda authorizer: `principalId`), nunca del query string."""
+    auth = (event.get("requestContext") or {}).get("authorizer") or {}
+    uid = (auth.get("claims") or {}).get("sub") or auth.get("principalId")
+    if uid:
+        return uid
+    return "user_dev_001" if settings.auth_bypass else None   # mismo criterio que get_user_id en la API
+
+def handler(event, _ctx):
+    qs = event.get("queryStringParameters") or {}
+    user_id = _caller(event)
+    if not user_id:
+        return _ok({"error": "unauthorized"}, 401)
+    conversation_id = qs.get("conversation_id")
+    if conversation_id:
+        conv = get_conversation(conversation_id, ("user_id",))
+        if not conv or conv.get("user_id") != user_id:
+            return _ok({"error": "conversation not found"}, 404)
+
+    scope_id = f"conv#{conversation_id}" if conversation_id else f"user#{user_id}"
+    items = get_usage_items(scope_id)
+    return _ok({"scope": scope_id, **usage.summarize(items)})
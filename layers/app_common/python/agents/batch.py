@@ -0,0 +1,158 @@
+from __future__ import annotations
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from agents.create_flow import collect_media_keys, is_clarify, presign_media
+from agents.design_generate import generate_assets
+from agents.dream_interpret import interpret_dream
+from agents.listing_publish import finish_publish, publish_new, stable_id
+from shared import admission, counters, tracing, usage
+from shared.admission import AdmissionRejected
+from shared.config import settings
+from shared.dynamo import get_product
+
+def dedup_key(q: str) -> str:
+    return " ".join((q or "").split()).casefold()
+
+def _with_retry(fn: Callable[[], Any]) -> Any:
+    """
+    Si la admisión rechaza (cola/bucket global), espera `retry_after` y reintenta;
+    un throttling de Bedrock que llegue hasta aquí espera con backoff exponencial.
+    """
+    for attempt in range(settings.batch_item_retries + 1):
+        try:
+            return fn()
+        except AdmissionRejected as e:
+            if attempt >= settings.batch_item_retries:
+                raise
+            counters.group("batch").incr("admission_retry")
+            time.sleep(e.retry_after)
+        except Exception as e:
+            if attempt >= settings.batch_item_retries or not admission.is_throttle(e):
+                raise
+            counters.group("batch").incr("throttle_retry")
+            time.sleep(min(30.0, 2.0 ** attempt))
+    raise RuntimeError("unreachable")
+
+def interpret_item(q: str, user_id: Optional[str]) -> Dict[str, Any]:
+    with usage.scope(user_id=user_id) as use:
+        brief = _with_retry(lambda: interpret_dream(q))
+    return {"brief": brief, "usage": use.totals()}
+
+def design_item(q: str, user_id: str) -> Dict[str, Any]:
+    with usage.scope(user_id=user_id) as use:
+        brief = _with_retry(lambda: interpret_dream(q))
+        if is_clarify(brief):
+            return {"brief": brief, "clarify": True, "usage": use.totals()}
+        design = _with_retry(lambda: generate_assets(brief.get("design_prompt", q), brief, user_id))
+    return {"brief": brief, "design": {**design, "media": presign_media(collect_media_keys(design))},
+            "usage": use.totals()}
+
+def catalog_item(q: str, user_id: str, price_cents: int = 1500,
+                 render: Optional[Callable[..., bytes]] = None, key: Optional[str] = None) -> Dict[str, Any]:
+    """
+    interpret -> generate_assets -> product + listing (backfill de catálogo). Con `key` (id de
+    fila) los ids salen de `user_id#key`: si la fila ya se publicó en un intento anterior no se
+    regenera ni se duplica nada, sólo se completan índice y feed.
+    """
+    pid = stable_id("prd", f"{user_id}#{key}") if key else None
+    lid = stable_id("lst", f"{user_id}#{key}") if key else None
+    if pid:
+        prev = get_product(pid)
+        if prev is not None:
+            _with_retry(lambda: finish_publish(prev, resume=True))
+            counters.group("batch").incr("resumed")
+            return {"clarify": False, "product_id": pid, "listing_id": lid, "resumed": True}
+    brief = _with_retry(lambda: interpret_dream(q))
+    if is_clarify(brief):
+        return {"clarify": True, "intent": brief.get("intent")}
+    prompt = brief.get("design_prompt", q)
+    design = _with_retry(lambda: generate_assets(prompt, brief, user_id, render=render))
+    product = publish_new(user_id, design["package"], design.get("media_keys") or [], price_cents, pid, lid)
+    _with_retry(lambda: finish_publish(product))
+    out: Dict[str, Any] = {"clarify": False, "product_id": product["product_id"],
+                           "listing_id": product["listing"]["listing_id"], "kinds": design.get("kinds")}
+    if design.get("errors"):
+        out["errors"] = design["errors"]
+    return out
+
+def charge(user_id: str, ideas: List[str], controllers: Tuple[admission.AdmissionController, ...]):
+    """
+    Cobra el lote a la cuota del usuario antes de lanzarlo: una llamada por idea única y
+    por tipo de modelo que usa. AdmissionRejected (429) si no le alcanza; nada queda cobrado.
+    """
+    n = len({dedup_key(q) for q in ideas})
+    done: List[admission.AdmissionController] = []
+    try:
+        for ctl in controllers:
+            ctl.charge(user_id, n)
+            done.append(ctl)
+    except AdmissionRejected:
+        for ctl in done:
+            ctl.refund(user_id, n)
+        raise
+
+def clamp_concurrency(n: Optional[int]) -> int:
+    return max(1, min(int(n or settings.batch_concurrency), settings.batch_max_concurrency))
+
+def run_batch(ideas: List[str], work: Callable[[str], Dict[str, Any]],
+              concurrency: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Ejecuta `work(q)` para cada idea con concurrencia acotada y produce un dict por
+    idea (más uno final de resumen) a medida que terminan, no en el orden de entrada.
+    Ideas idénticas (espacios/mayúsculas aparte) se procesan una vez; las copias
+    salen junto a la original con `duplicate_of`. Corre en modo batch: la cuota por
+    usuario se cobra antes (`charge`); sí pasa por la cola justa y el bucket global.
+    """
+    stats = counters.group("batch")
+    t0 = time.perf_counter()
+    first: Dict[str, int] = {}
+    copies: Dict[int, List[int]] = {}
+    for i, q in enumerate(ideas):
+        k = dedup_key(q)
+        if k in first:
+            copies[first[k]].append(i)
+        else:
+            first[k] = i
+            copies[i] = []
+    uniques = list(copies)
+    stats.incr("items", len(ideas))
+    stats.incr("deduped", len(ideas) - len(uniques))
+
+    def one(i: int) -> Dict[str, Any]:
+        t = time.perf_counter()
+        with admission.batch_mode():
+            out = work(ideas[i])
+        out["ms"] = round((time.perf_counter() - t) * 1000.0, 1)
+        return out
+
+    errors = 0
+    pool = ThreadPoolExecutor(max_workers=clamp_concurrency(concurrency), thread_name_prefix="batch")
+    try:
+        running: Dict[Future, int] = {pool.submit(tracing.bind(one), i): i for i in uniques}
+        while running:
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for fut in done:
+                i = running.pop(fut)
+                try:
+                    res: Dict[str, Any] = {"status": "ok", **fut.result()}
+                except Exception as e:
+                    errors += 1
+                    stats.incr("errors")
+                    res = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+                    if isinstance(e, AdmissionRejected):
+                        res["retry_after"] = e.retry_after
+                yield {"index": i, "q": ideas[i], **res}
+                for j in copies[i]:
+                    yield {"index": j, "q": ideas[j], "duplicate_of": i, **res}
+    finally:
+        # cliente desconectado o fin: no lanzar lo que quede en cola
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    yield {
+        "done": True,
+        "count": len(ideas),
+        "unique": len(uniques),
+        "errors": errors,
+        "ms": round((time.perf_counter() - t0) * 1000.0, 1),
+    }
@@ -0,0 +1,196 @@
+from __future__ import annotations
+import threading, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from agents.design_generate import _build_book_docx_bytes, _build_book_txt_bytes, _make_book_outline
+from agents.factory import AgentOptions, make_agent
+from shared import admission, counters, tracing, usage
+from shared.config import settings
+from shared.dynamo import set_conversation_meta
+from shared.s3 import put_object
+from shared.tracing import traced
+
+# Libro "real": un capítulo por llamada al LLM sobre el índice de `_make_book_outline`.
+# Los capítulos se piden en paralelo (BOOK_WORKERS, y detrás la admisión de texto) y se
+# entregan en el orden del índice, así el DOCX se arma mientras se escriben los siguientes.
+
+_SYSTEM = (
+    "Eres KaiKashi, autor de libros de divulgación. Escribes capítulos completos, claros y "
+    "coherentes con el resto del libro. Responde sólo con el texto del capítulo: sin título, "
+    "sin markdown, con párrafos separados por una línea en blanco."
+)
+PLACEHOLDER = "Contenido de capítulo (placeholder)."
+
+def chapter_titles(brief: Dict[str, Any]) -> List[str]:
+    """Capítulos que escribe el LLM: el índice sin la bibliografía (queda de plantilla)."""
+    return [c for c in _make_book_outline(brief) if not c.lower().startswith("bibliograf")]
+
+def chapter_prompt(brief: Dict[str, Any], design_prompt: str, titles: List[str], i: int) -> str:
+    toc = "\n".join(f"{n}. {c}" for n, c in enumerate(titles, 1))
+    return (
+        f"Libro: {brief.get('intent') or 'Libro'}\n"
+        f"Estilo: {brief.get('style') or ''}\n"
+        f"Notas: {brief.get('notes') or ''}\n"
+        f"Idea original: {design_prompt}\n\n"
+        f"Índice:\n{toc}\n\n"
+        f"Escribe el capítulo {i + 1}, \"{titles[i]}\", en unas {settings.book_chapter_words} palabras "
+        "y en el idioma del libro. No adelantes lo que corresponde a otros capítulos."
+    )
+
+def _write_one(prompt: str, reserve_s: float) -> str:
+    # un agente por capítulo: el Agent guarda historial y no es para hilos concurrentes
+    agent = make_agent(opts=AgentOptions(
+        system_prompt=_SYSTEM,
+        temperature=0.7,
+        top_p=0.9,
+        max_tokens=settings.book_chapter_max_tokens,
+        stream=settings.llm_streaming,
+    ), quiet=True)
+    # el libro ya pagó la cuota del usuario con el brief; los capítulos pasan por la cola y el bucket global
+    with admission.batch_mode(), admission.text.admit():
+        return str(agent.ask(prompt, reserve_s=reserve_s)).strip()
+
+class BookProgress:
+    """Estado de un libro en curso; con `conversation_id` se guarda en `meta.book` de la conversación."""
+
+    def __init__(self, titles: List[str], conversation_id: Optional[str] = None):
+        self.titles = titles
+        self.conversation_id = conversation_id
+        self.chapters = ["pending"] * len(titles)   # pending | done | failed
+        self.status = "pending"                    # pending | running | done | failed
+        self.started_at: Optional[int] = None
+        self.finished_at: Optional[int] = None
+        self.keys: Dict[str, str] = {}
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "status": self.status,
+            "total": len(self.titles),
+            "done": self.chapters.count("done"),
+            "failed": self.chapters.count("failed"),
+            "chapters": [{"title": t, "status": s} for t, s in zip(self.titles, self.chapters)],
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            **self.keys,
+        }
+
+    def _save(self):
+        # bajo el lock: un snapshot viejo no pisa a uno nuevo
+        if self.conversation_id is None:
+            return
+        try:
+            set_conversation_meta(self.conversation_id, "book", self.snapshot())
+        except Exception:
+            counters.group("book").incr("progress_errors")
+
+    def update(self, *, chapter: Optional[int] = None, ok: bool = True, **fields: Any):
+        with self._lock:
+            if chapter is not None:
+                self.chapters[chapter] = "done" if ok else "failed"
+            for k, v in fields.items():
+                setattr(self, k, v)
+            self._save()
+
+def write_chapters(brief: Dict[str, Any], design_prompt: str, *,
+                   progress: Optional[BookProgress] = None, workers: Optional[int] = None,
+                   reserve_s: float = 0.0) -> Iterator[Tuple[str, str]]:
+    """
+    (título, texto) de cada capítulo en orden del índice. Se escriben hasta `workers`
+    a la vez; un capítulo que falla (o no cabe en el plazo) queda con texto de relleno.
+    `reserve_s`: segundos del plazo que se dejan para armar y subir el libro.
+    """
+    stats = counters.group("book")
+    titles = chapter_titles(brief)
+    n = max(1, min(workers or settings.book_workers, len(titles)))
+    pool = ThreadPoolExecutor(max_workers=n, thread_name_prefix="book")
+
+    def _done(i: int):
+        def cb(fut):
+            ok = not fut.cancelled() and fut.exception() is None
+            stats.incr("chapters" if ok else "chapter_failed")
+            if progress is not None:
+                progress.update(chapter=i, ok=ok)
+        return cb
+
+    try:
+        futs = []
+        for i in range(len(titles)):
+            fut = pool.submit(tracing.bind(_write_one), chapter_prompt(brief, design_prompt, titles, i), reserve_s)
+            fut.add_done_callback(_done(i))
+            futs.append(fut)
+        for title, fut in zip(titles, futs):
+            try:
+                text = fut.result() or PLACEHOLDER
+            except Exception:
+                text = PLACEHOLDER
+            yield title, text
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+@traced("book.write")
+def write_book(design_prompt: str, brief: Dict[str, Any], *, docx_key: str, text_key: Optional[str] = None,
+               progress: Optional[BookProgress] = None, reserve_s: float = 0.0) -> Dict[str, Any]:
+    """Escribe los capítulos y sube DOCX (+ TXT). Devuelve {docx_key, text_key, chapters, failed}."""
+    written: List[Tuple[str, str]] = []
+
+    def chapters() -> Iterator[Tuple[str, str]]:
+        for cap, text in write_chapters(brief, design_prompt, progress=progress, reserve_s=reserve_s):
+            written.append((cap, text))
+            yield cap, text
+
+    docx_bytes = _build_book_docx_bytes(brief, design_prompt, chapters())
+    put_object(settings.s3_bucket_assets, docx_key, docx_bytes,
+               "application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+    out: Dict[str, Any] = {"docx_key": docx_key, "chapters": len(written),
+                           "failed": sum(1 for _, t in written if t == PLACEHOLDER)}
+    if text_key:
+        put_object(settings.s3_bucket_assets, text_key, _build_book_txt_bytes(brief, design_prompt, written),
+                   "text/plain; charset=utf-8")
+        out["text_key"] = text_key
+    return out
+
+# ---------- en segundo plano (API): /create responde con el libro de relleno y lo reemplaza al terminar
+
+_jobs: Dict[str, BookProgress] = {}
+_jobs_lock = threading.Lock()
+_job_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="book-job")
+
+def _run(conversation_id: str, progress: BookProgress, design_prompt: str, brief: Dict[str, Any],
+         user_id: str, docx_key: str, text_key: Optional[str]):
+    stats = counters.group("book")
+    with usage.scope(user_id=user_id, conversation_id=conversation_id):
+        try:
+            progress.update(status="running", started_at=int(time.time() * 1000))
+            out = write_book(design_prompt, brief, docx_key=docx_key, text_key=text_key, progress=progress)
+            stats.incr("books")
+            progress.update(status="done", finished_at=int(time.time() * 1000),
+                            keys={k: out[k] for k in ("docx_key", "text_key") if k in out})
+        except Exception as e:
+            stats.incr("book_failed")
+            progress.update(status="failed", finished_at=int(time.time() * 1000), error=f"{type(e).__name__}: {e}")
+        finally:
+            usage.flush()
+            with _jobs_lock:
+                _jobs.pop(conversation_id, None)
+
+def start(conversation_id: str, design_prompt: str, brief: Dict[str, Any], user_id: str, *,
+          docx_key: str, text_key: Optional[str] = None) -> BookProgress:
+    """Encola el libro de la conversación (uno a la vez por conversación) y devuelve su progreso."""
+    with _jobs_lock:
+        running = _jobs.get(conversation_id)
+        if running is not None:
+            return running
+        progress = BookProgress(chapter_titles(brief), conversation_id)
+        _jobs[conversation_id] = progress
+    progress.update()
+    _job_pool.submit(_run, conversation_id, progress, design_prompt, brief, user_id, docx_key, text_key)
+    return progress
+
+def get(conversation_id: str) -> Optional[Dict[str, Any]]:
+    """Progreso en memoria de un libro en curso en este proceso (si no, está en `meta.book`)."""
+    with _jobs_lock:
+        progress = _jobs.get(conversation_id)
+    return progress.snapshot() if progress is not None else None
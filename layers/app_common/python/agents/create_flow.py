@@ -0,0 +1,294 @@
+from __future__ import annotations
+import json, threading, time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+from agents.dream_interpret import interpret_dream, local_clarify, preview_brief
+from agents.design_generate import generate_assets, package_for, render_image, wants_image
+from agents.listing_publish import listing_item, product_item
+from agents import book_write
+from shared import counters, deadline, discovery, tracing
+from shared.admission import AdmissionRejected
+from shared.config import settings
+from shared.dynamo import (
+    bump_feed_version, delete_listing, delete_product, ensure_conversation, listing_summary, new_id,
+    publish_product_listing, put_message, set_conversation_meta, set_product_media,
+)
+from shared.pipeline import Graph, StepFailed
+from shared.search import index_product, unindex_product
+from shared.s3 import presign_get
+
+MEDIA_KEY_FIELDS = ["image_key", "pdf_key", "docx_key", "rtf_key", "text_key", "video_key", "model3d_key"]
+
+def collect_media_keys(design: Dict[str, Any]) -> List[str]:
+    keys: List[str] = []
+    for k in MEDIA_KEY_FIELDS:
+        v = design.get(k)
+        if v:
+            keys.append(v)
+    for v in design.get("media_keys") or []:
+        if v not in keys:
+            keys.append(v)
+    return keys
+
+def infer_media_type(key: str) -> str:
+    k = (key or "").lower()
+    if k.endswith((".png", ".jpg", ".jpeg", ".webp", ".svg")): return "image"
+    if k.endswith(".pdf"):   return "pdf"
+    if k.endswith(".docx"):  return "docx"
+    if k.endswith(".rtf"):   return "rtf"
+    if k.endswith(".txt"):   return "txt"
+    if k.endswith((".mp4", ".mov", ".webm", ".gif")): return "video"
+    if k.endswith((".obj", ".glb", ".gltf", ".fbx")): return "3d"
+    return "file"
+
+def presign_media(keys: List[str]) -> List[Dict[str, Any]]:
+    media: List[Dict[str, Any]] = []
+    for mk in keys:
+        try:
+            url = presign_get(settings.s3_bucket_assets, mk)
+        except Exception:
+            url = None
+        media.append({"key": mk, "url": url, "type": infer_media_type(mk)})
+    return media
+
+_early_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="early-image")
+
+class EarlyImage:
+    """
+    Lanza la invocación de imagen en cuanto el streaming del brief trae `intent`,
+    `product_type` y `design_prompt` (normalizados igual que `_postprocess`), mientras
+    el LLM sigue generando `notes`. `claim` la entrega sólo si el brief final lleva al
+    mismo prompt y sigue pidiendo imagen; si no, se cancela (o se descarta si ya corría).
+    """
+    NEEDED = ("intent", "product_type", "design_prompt")
+
+    def __init__(self, q: str, user_id: str):
+        self.q = q
+        self.user_id = user_id
+        self.fields: Dict[str, Any] = {}
+        self.prompt: Optional[str] = None
+        self.future: Optional[Future] = None
+        self.outcome: Optional[str] = None
+        self._lock = threading.Lock()
+        # el callback de streaming corre en otro hilo: se fija aquí el contexto (traza, uso)
+        self._render = tracing.bind(render_image)
+
+    def on_field(self, key: str, value: Any):
+        with self._lock:
+            if self.future is not None or not settings.early_image_enabled:
+                return
+            self.fields[key] = value
+            if not all(k in self.fields for k in self.NEEDED):
+                return
+            if str(self.fields.get("intent") or "").strip().lower() == "clarify":
+                return
+            preview = preview_brief(self.fields, self.q)
+            if not wants_image(preview):
+                return
+            self.prompt = preview["design_prompt"]
+            self.future = _early_pool.submit(self._render, self.prompt, self.user_id)
+            self.outcome = "started"
+
+    def claim(self, design_prompt: str, brief: Dict[str, Any]):
+        with self._lock:
+            fut = self.future
+        if fut is None:
+            return None
+        if design_prompt == self.prompt and wants_image(brief):
+            self.outcome = "used"
+            return fut.result
+        self.cancel()
+        return None
+
+    def cancel(self):
+        with self._lock:
+            fut = self.future
+        if fut is not None and self.outcome == "started":
+            # una invocación ya en vuelo no se puede abortar: se descarta su resultado
+            self.outcome = "cancelled" if fut.cancel() else "discarded"
+
+def is_clarify(brief: Optional[Dict[str, Any]]) -> bool:
+    return str((brief or {}).get("intent") or "").strip().lower() == "clarify"
+
+def _clarify_result(conversation_id: Optional[str], brief: Dict[str, Any],
+                    timeline: List[Dict[str, Any]], uploaded_key: Optional[str] = None) -> Dict[str, Any]:
+    return {
+        "conversation_id": conversation_id,
+        "uploaded_key": uploaded_key,
+        "brief": brief,
+        "clarify": True,
+        "design": None,
+        "media_keys": [],
+        "media": [],
+        "ids": None,
+        "timeline": timeline,
+        "early_image": None,
+    }
+
+def run_create(
+    q: str,
+    user_id: str,
+    *,
+    conversation_id: str,
+    price_cents: int = 1500,
+    title: Optional[str] = None,
+    upload: Optional[Callable[[], Optional[str]]] = None,
+    book: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Pipeline de /create como grafo de dependencias:
+
+        upload, conversation, brief          sin dependencias: arrancan juntos
+        user_message      <- conversation, upload
+        brief_message     <- brief, user_message
+        publish           <- brief
+        assets            <- brief
+        media             <- assets
+        design_message    <- media, brief_message
+        discover          <- media, publish
+        attach_media      <- discover
+        index             <- attach_media
+        ids_message       <- attach_media, design_message
+
+    La conversación y el mensaje del usuario se escriben mientras corre Bedrock;
+    product y listing se publican (una transacción) mientras se generan/suben los assets, y al final
+    se les adjuntan las media keys (hasta entonces el feed no los muestra). La búsqueda lo indexa
+    después de adjuntarlas: un hit nunca trae un product sin media. `discover` escribe
+    la tarjeta del feed público (`shared/discovery.py`) con el mismo `published_at` que se guarda en el product.
+    Los mensajes siguen en cadena para conservar su orden. La imagen puede arrancar
+    antes, desde el brief parcial (`EarlyImage`).
+
+    Libros: `book="background"` publica el libro de relleno y, al terminar el grafo, encarga
+    los capítulos a `book_write.start` (progreso en `meta.book`); ver `generate_assets`.
+
+    Briefs `clarify`: si el pre-clasificador local ya lo resuelve, se responde sin
+    escribir nada (ni conversación); si lo decide el modelo, se guarda la conversación
+    con la pregunta y se omiten assets, S3 y product/listing.
+    """
+    stats = counters.group("create")
+    pre = local_clarify(q)
+    if pre is not None:
+        stats.incr("clarify_local")
+        return _clarify_result(None, pre, [])
+
+    product_id, listing_id = new_id("prd"), new_id("lst")
+    early = EarlyImage(q, user_id)
+
+    def _design_prompt(r: Dict[str, Any]) -> str:
+        return r["brief"].get("design_prompt", q)
+
+    def _user_message(r: Dict[str, Any]):
+        key = r["upload"]
+        put_message(conversation_id, role="user", content=q, media_keys=[key] if key else None)
+
+    def _product(r: Dict[str, Any]) -> Dict[str, Any]:
+        return product_item(user_id, package_for(_design_prompt(r), r["brief"]), [], product_id)
+
+    def _publish(r: Dict[str, Any]) -> Dict[str, str]:
+        publish_product_listing(_product(r), listing_item(product_id, price_cents, listing_id))
+        return {"product_id": product_id, "listing_id": listing_id}
+
+    def _index(r: Dict[str, Any]) -> Dict[str, Any]:
+        item = {**_product(r), "media_keys": r["media"][0]}
+        index_product(item)
+        return item
+
+    def _unpublish(ids: Dict[str, str]):
+        delete_product(ids["product_id"])
+        delete_listing(ids["listing_id"])
+
+    def _media(r: Dict[str, Any]):
+        keys = collect_media_keys(r["assets"])
+        return keys, presign_media(keys)
+
+    def _design_message(r: Dict[str, Any]):
+        keys, media = r["media"]
+        put_message(conversation_id, role="assistant",
+                    content=json.dumps({"design": {**r["assets"], "media": media}}, ensure_ascii=False),
+                    media_keys=keys or None)
+
+    def _discover(r: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        listing = listing_summary(listing_item(product_id, price_cents, listing_id))
+        return discovery.publish({**_product(r), "media_keys": r["media"][0], "listing": listing,
+                                  "published_at": int(time.time() * 1000)})
+
+    def _attach_media(r: Dict[str, Any]) -> Dict[str, str]:
+        card = r["discover"]
+        set_product_media(product_id, r["media"][0], published_at=card["published_at"] if card else None)
+        bump_feed_version(user_id)
+        return {"product_id": product_id, "listing_id": listing_id}
+
+    def _actionable(r: Dict[str, Any]) -> bool:
+        return not is_clarify(r["brief"])
+
+    g = Graph("create")
+    g.step("upload", lambda r: upload() if upload else None)
+    g.step("conversation", lambda r: ensure_conversation(
+        conversation_id=conversation_id,
+        user_id=user_id,
+        model_id=settings.bedrock_text_model_id,
+        title=title or (q[:64] + ("…" if len(q) > 64 else "")),
+    ))
+    g.step("user_message", _user_message, deps=("conversation", "upload"))
+    g.step("brief", lambda r: interpret_dream(q, on_field=early.on_field))
+    g.step("brief_message", lambda r: put_message(
+        conversation_id, role="assistant", content=json.dumps({"brief": r["brief"]}, ensure_ascii=False),
+    ), deps=("brief", "user_message"))
+    g.step("publish", _publish, deps=("brief",), undo=_unpublish, when=_actionable)
+    g.step("assets", lambda r: generate_assets(
+        _design_prompt(r), r["brief"], user_id, image=early.claim(_design_prompt(r), r["brief"]), book=book,
+        scope=conversation_id,
+    ), deps=("brief",), when=_actionable)
+    g.step("media", _media, deps=("assets",), when=_actionable)
+    g.step("design_message", _design_message, deps=("media", "brief_message"), when=_actionable)
+    g.step("discover", _discover, deps=("media", "publish"), undo=discovery.unpublish, when=_actionable)
+    g.step("attach_media", _attach_media, deps=("discover",), when=_actionable)
+    g.step("index", _index, deps=("attach_media",), undo=unindex_product, when=_actionable)
+    g.step("ids_message", lambda r: put_message(
+        conversation_id, role="assistant", content=json.dumps({"ids": r["attach_media"]}, ensure_ascii=False),
+    ), deps=("attach_media", "design_message"), when=_actionable)
+
+    try:
+        r = g.run()
+    except StepFailed as e:
+        early.cancel()
+        if isinstance(e.error, AdmissionRejected):
+            raise e.error
+        raise
+
+    timeline = g.timeline()
+    trace = tracing.current()
+    if trace is not None:
+        try:
+            left = deadline.remaining()
+            set_conversation_meta(conversation_id, "timings", {**trace.summary(), "pipeline": timeline,
+                                                            "early_image": early.outcome,
+                                                            "deadline_left_ms": None if left is None else int(left * 1000)})
+        except Exception:
+            pass
+
+    if is_clarify(r["brief"]):
+        early.cancel()
+        # el brief clarify de un modelo que no respondió (plazo/error) no es una pregunta del modelo
+        cause = r["brief"].get("degraded")
+        stats.incr(f"clarify_{cause}" if cause else "clarify_model")
+        return _clarify_result(conversation_id, r["brief"], timeline, r["upload"])
+
+    stats.incr("full")
+    keys, media = r["media"]
+    assets = r["assets"]
+    if (assets.get("book") or {}).get("status") == "pending" and assets.get("docx_key"):
+        book_write.start(conversation_id, _design_prompt(r), r["brief"], user_id,
+                         docx_key=assets["docx_key"], text_key=assets.get("text_key"))
+    return {
+        "conversation_id": conversation_id,
+        "uploaded_key": r["upload"],
+        "brief": r["brief"],
+        "clarify": False,
+        "design": r["assets"],
+        "media_keys": keys,
+        "media": media,
+        "ids": r["attach_media"],
+        "timeline": timeline,
+        "early_image": early.outcome,
+    }
@@ -1,9 +1,13 @@
 from __future__ import annotations
-import base64, json, datetime, io, random
-from typing import Dict, Any, Optional, List, Tuple
+import base64, json, datetime, io, random, time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 from shared.aws import bedrock_runtime
 from shared.s3 import put_object
 from shared.config import settings
+from shared.tracing import traced, span
+from shared import usage, admission, counters, deadline
+from shared.admission import AdmissionRejected
+from shared.deadline import DeadlineExceeded
 
 def _vendor_from_model_id(model_id: str) -> str:
     mid = (model_id or "").lower()
@@ -99,13 +103,17 @@ def _make_book_outline(brief: Dict[str, Any]) -> List[str]:
         base.insert(2, "Glosario para jóvenes lectores")
     return base
 
-def _build_book_docx_bytes(brief: Dict[str, Any], design_prompt: str) -> bytes:
+@traced("render.docx")
+def _build_book_docx_bytes(brief: Dict[str, Any], design_prompt: str,
+                           chapters: Optional[Iterable[Tuple[str, str]]] = None) -> bytes:
     """
     Genera un DOCX de 'libro real' con:
     - Portada (título, subtítulo/estilo)
     - Índice (lista numerada de capítulos)
     - Introducción y capítulos con headings
     - Bibliografía (placeholder)
+    `chapters`: (título, texto) en orden del índice, p.ej. a medida que los escribe
+    el LLM (`agents/book_write.py`); sin él, párrafos de relleno.
     """
     from docx import Document
     from docx.enum.text import WD_ALIGN_PARAGRAPH
@@ -145,6 +153,13 @@ def _build_book_docx_bytes(brief: Dict[str, Any], design_prompt: str) -> bytes:
 
     doc.add_page_break()
 
+    if chapters is not None:
+        for cap, text in chapters:
+            doc.add_heading(cap, level=1)
+            for para in _paragraphs(text):
+                doc.add_paragraph(para, style="KaiKashi Body")
+        return _finish_book_docx(doc, outline, design_prompt)
+
     doc.add_heading("Introducción", level=1)
     intro = (
         f"Este libro aborda {title.lower()}. "
@@ -170,7 +185,12 @@ def _build_book_docx_bytes(brief: Dict[str, Any], design_prompt: str) -> bytes:
         doc.add_heading(cap, level=1)
         for _ in range(3):
             doc.add_paragraph(random.choice(sample_paras), style="KaiKashi Body")
+    return _finish_book_docx(doc, outline, design_prompt)
+
+def _paragraphs(text: str) -> List[str]:
+    return [p.strip() for p in (text or "").splitlines() if p.strip()]
 
+def _finish_book_docx(doc: Any, outline: List[str], design_prompt: str) -> bytes:
     if not any("conclu" in c.lower() for c in outline):
         doc.add_heading("Conclusiones", level=1)
         doc.add_paragraph(
@@ -195,7 +215,9 @@ def _build_book_docx_bytes(brief: Dict[str, Any], design_prompt: str) -> bytes:
     doc.save(buf)
     return buf.getvalue()
 
-def _build_book_txt_bytes(brief: Dict[str, Any], design_prompt: str) -> bytes:
+@traced("render.txt")
+def _build_book_txt_bytes(brief: Dict[str, Any], design_prompt: str,
+                          chapters: Optional[Iterable[Tuple[str, str]]] = None) -> bytes:
     title = brief.get("intent") or "Libro"
     style = brief.get("style") or ""
     outline = _make_book_outline(brief)
@@ -205,15 +227,20 @@ def _build_book_txt_bytes(brief: Dict[str, Any], design_prompt: str) -> bytes:
     lines += ["ÍNDICE", "------"]
     for i, cap in enumerate(outline, 1):
         lines.append(f"{i}. {cap}")
-    lines += ["", "INTRODUCCIÓN", "------------",
-              f"Este libro aborda {title.lower()}.",
-              ""]
-    for cap in outline:
-        if cap.lower().startswith(("intro", "bibliograf")):
-            continue
-        lines += [cap.upper(), "-" * len(cap),
-                  "Contenido de capítulo (placeholder).", ""]
-    lines += ["CONCLUSIONES", "------------", "Resumen de hallazgos y recomendaciones.", ""]
+    lines.append("")
+    if chapters is not None:
+        for cap, text in chapters:
+            lines += [cap.upper(), "-" * len(cap), *_paragraphs(text), ""]
+    else:
+        lines += ["INTRODUCCIÓN", "------------",
+                  f"Este libro aborda {title.lower()}.",
+                  ""]
+        for cap in outline:
+            if cap.lower().startswith(("intro", "bibliograf")):
+                continue
+            lines += [cap.upper(), "-" * len(cap),
+                      "Contenido de capítulo (placeholder).", ""]
+        lines += ["CONCLUSIONES", "------------", "Resumen de hallazgos y recomendaciones.", ""]
     lines += ["BIBLIOGRAFÍA", "------------",
               "- Autor, A. (Año). Título del libro. Editorial.",
               "- Autor, B. (Año). Artículo en Revista. Revista X, Vol(Y), pp–pp.",
@@ -221,6 +248,24 @@ def _build_book_txt_bytes(brief: Dict[str, Any], design_prompt: str) -> bytes:
               "ANEXO: DESIGN PROMPT", "-------------------", design_prompt]
     return ("\n".join(lines)).encode("utf-8")
 
+@traced("render.gif")
+def _build_gif_bytes(frames: int = 12, size: int = 1024) -> bytes:
+    """
+    GIF animado placeholder (círculos que se desplazan).
+    """
+    from PIL import Image, ImageDraw
+    imgs: List[Any] = []
+    for i in range(frames):
+        img = Image.new("RGB", (size, size))
+        d = ImageDraw.Draw(img)
+        d.rectangle((0, 0, size, size), fill=(10, 10, 20))
+        d.ellipse((112+i*2, 112, size-112, size-112), fill=(10, 150, 230))
+        d.ellipse((212, 212, size-212-i*2, size-212), fill=(120, 80, 255))
+        imgs.append(img)
+    buf = io.BytesIO()
+    imgs[0].save(buf, format="GIF", save_all=True, append_images=imgs[1:], duration=80, loop=0)
+    return buf.getvalue()
+
 def _decide_kinds(brief: Dict[str, Any]) -> List[str]:
     """
     Decide los tipos a generar. ¡Sin PDF!
@@ -246,39 +291,128 @@ def _decide_kinds(brief: Dict[str, Any]) -> List[str]:
         return ["3d"]
     return ["image"]
 
-def generate_assets(design_prompt: str, brief: Dict[str, Any], user_id: str) -> Dict[str, Any]:
-    outputs: Dict[str, Any] = {}
+# Campos del brief de los que depende cada tipo de asset: al refinar sólo se regenera
+# lo que cambió. DOCX y TXT salen de los mismos capítulos, van juntos.
+_KIND_FIELDS = {
+    "image": ("design_prompt", "intent", "style"),
+    "docx": ("design_prompt", "intent", "style", "notes", "tags"),
+    "txt": ("design_prompt", "intent", "style", "notes", "tags"),
+    "video": (),
+    "3d": ("intent",),
+}
+
+def affected_kinds(old: Dict[str, Any], new: Dict[str, Any]) -> List[str]:
+    """Tipos del brief nuevo que hay que (re)generar: los que no existían o cuyos campos cambiaron."""
+    before = set(_decide_kinds(old))
+    return [k for k in _decide_kinds(new)
+            if k not in before or any(old.get(f) != new.get(f) for f in _KIND_FIELDS.get(k, ()))]
+
+def wants_image(brief: Dict[str, Any]) -> bool:
+    return "image" in _decide_kinds(brief)
+
+def package_for(design_prompt: str, brief: Dict[str, Any]) -> Dict[str, Any]:
+    """Título/descripción sugeridos; sólo dependen del brief (se puede publicar antes que los assets)."""
+    return {
+        "design_prompt": design_prompt,
+        "brief": brief,
+        "suggested_title": brief.get("intent", "Producto creativo"),
+        "suggested_description": f"Generado automáticamente a partir de tu idea: {brief.get('notes','')}",
+    }
+
+def render_image(design_prompt: str, user_id: str) -> Tuple[Optional[bytes], Optional[str]]:
+    """Invoca el modelo de imagen. Devuelve (png, None) o (None, motivo); AdmissionRejected se propaga."""
     model_id = getattr(settings, "bedrock_image_model_id", "")
     vendor = _vendor_from_model_id(model_id)
-    base = f"assets/{user_id}/generated/{brief.get('product_type','generic')}_{brief.get('intent','idea')}"
+    if vendor == "anthropic":
+        return None, "El modelo configurado es Anthropic/Claude (no genera imágenes)."
+    if vendor not in ("titan", "sdxl"):
+        return None, f"Modelo '{model_id}' no reconocido como generador de imagen."
+    rt = bedrock_runtime()
+    body = _payload_titan(design_prompt) if vendor == "titan" else _payload_sdxl(design_prompt)
+    with admission.image.admit(user_id):
+        t0 = time.perf_counter()
+        with span("bedrock.invoke_model"):
+            try:
+                res = rt.invoke_model(modelId=model_id, body=json.dumps(body))
+            except Exception as e:
+                if admission.is_throttle(e):
+                    admission.image.throttled()
+                raise
+            payload = json.loads(res["body"].read())
+    usage.record(usage.CallUsage(model_id=model_id, images=1,
+                                 latency_ms=int((time.perf_counter() - t0) * 1000)))
+    if vendor == "titan":
+        img_b64 = (payload.get("images") or [None])[0] or payload.get("image_base64")
+    else:
+        artifacts = payload.get("artifacts", [])
+        img_b64 = artifacts[0].get("base64") if artifacts else None
+    if not img_b64:
+        return None, "Modelo de imagen no devolvió salida base64."
+    return base64.b64decode(img_b64), None
+
+def _render(render: Optional[Callable[..., bytes]], fn: Callable[..., bytes], *args: Any) -> bytes:
+    return render(fn, *args) if render is not None else fn(*args)
+
+@traced("generate_assets")
+def generate_assets(design_prompt: str, brief: Dict[str, Any], user_id: str,
+                    image: Optional[Callable[[], Tuple[Optional[bytes], Optional[str]]]] = None,
+                    render: Optional[Callable[..., bytes]] = None,
+                    book: Optional[str] = None, only: Optional[List[str]] = None,
+                    scope: Optional[str] = None) -> Dict[str, Any]:
+    """
+    `image`: resultado de imagen ya en curso para este mismo `design_prompt`
+    (p.ej. lanzado desde el brief parcial); si no viene, se invoca aquí.
+    `render(fn, *args)`: ejecuta los renders de CPU (DOCX, GIF) fuera del hilo,
+    p.ej. en un pool de procesos; por defecto se llaman en línea.
+    Con un plazo activo, imagen y renders esperan como mucho lo que queda menos
+    `DEADLINE_FINISH_S`; si no llega: placeholder para la imagen y DOCX/GIF omitidos
+    (`degraded`), para que la request termine con un resultado coherente.
+    `book` (libros DOCX/TXT): "llm" escribe los capítulos aquí (`agents/book_write.py`),
+    "background" sube el libro de relleno y marca `book.status=pending` para que el
+    llamador lo encargue en segundo plano, "placeholder" sólo relleno. Por defecto
+    "llm" si `BOOK_LLM`.
+    `only`: subconjunto de los tipos del brief a generar (refinar, `affected_kinds`).
+    `scope` (p.ej. conversation_id) entra en las keys: sin él, dos ideas con el mismo
+    tipo/intent comparten keys, y el libro en segundo plano pisaría el de otra creación.
+    """
+    outputs: Dict[str, Any] = {}
+    base = f"assets/{user_id}/generated/{scope + '/' if scope else ''}" \
+           f"{brief.get('product_type','generic')}_{brief.get('intent','idea')}"
     errors: Dict[str, str] = {}
     media_keys: List[str] = []
-    kinds = _decide_kinds(brief)
+    degraded: List[str] = []
+    kinds = [k for k in _decide_kinds(brief) if only is None or k in only]
+    finish = settings.deadline_finish_s
+
+    def _timed_render(kind: str, fn: Callable[..., bytes], *args: Any) -> bytes:
+        t = deadline.timeout(finish)
+        if t is not None and t < settings.deadline_min_render_s:
+            counters.group("deadline").incr("render.skipped")
+            raise DeadlineExceeded(f"{kind}: sin tiempo")
+        return deadline.call(_render, render, fn, *args, timeout_s=t, what="render")
 
     # Image
     if "image" in kinds:
         image_key: Optional[str] = None
         try:
-            if vendor in ("titan", "sdxl"):
-                rt = bedrock_runtime()
-                body = _payload_titan(design_prompt) if vendor == "titan" else _payload_sdxl(design_prompt)
-                res = rt.invoke_model(modelId=model_id, body=json.dumps(body))
-                payload = json.loads(res["body"].read())
-                if vendor == "titan":
-                    img_b64 = (payload.get("images") or [None])[0] or payload.get("image_base64")
-                else:
-                    artifacts = payload.get("artifacts", [])
-                    img_b64 = artifacts[0].get("base64") if artifacts else None
-                if img_b64:
-                    raw = base64.b64decode(img_b64)
-                    image_key = f"{base}.png"
-                    put_object(settings.s3_bucket_assets, image_key, raw, "image/png")
-                else:
-                    errors["image"] = "Modelo de imagen no devolvió salida base64."
-            elif vendor == "anthropic":
-                errors["image"] = "El modelo configurado es Anthropic/Claude (no genera imágenes)."
+            t = deadline.timeout(finish)
+            if image is not None:
+                raw, err = deadline.call(image, timeout_s=t, what="image")
+            elif t is not None and t < settings.deadline_min_image_s:
+                counters.group("deadline").incr("image.skipped")
+                raise DeadlineExceeded("image: sin tiempo")
+            else:
+                raw, err = deadline.call(render_image, design_prompt, user_id, timeout_s=t, what="image")
+            if raw:
+                image_key = f"{base}.png"
+                put_object(settings.s3_bucket_assets, image_key, raw, "image/png")
             else:
-                errors["image"] = f"Modelo '{model_id}' no reconocido como generador de imagen."
+                errors["image"] = err or "Sin imagen."
+        except AdmissionRejected:
+            raise
+        except DeadlineExceeded as e:
+            errors["image"] = f"{type(e).__name__}: {e}"
+            degraded.append("image")
         except Exception as e:
             errors["image"] = f"{type(e).__name__}: {e}"
 
@@ -294,18 +428,37 @@ def generate_assets(design_prompt: str, brief: Dict[str, Any], user_id: str) ->
         media_keys.append(image_key)
 
     # (DOCX + TXT)
-    if "docx" in kinds:
+    book = book or ("llm" if settings.book_llm else "placeholder")
+    if "docx" in kinds and book == "llm":
+        from agents.book_write import write_book   # importa los builders de este módulo
+        try:
+            written = write_book(design_prompt, brief, docx_key=f"{base}.docx",
+                                 text_key=f"{base}.txt" if "txt" in kinds else None, reserve_s=finish)
+            for field in ("docx_key", "text_key"):
+                if written.get(field):
+                    outputs[field] = written[field]
+                    media_keys.append(written[field])
+            outputs["book"] = {"status": "done", "chapters": written["chapters"], "failed": written["failed"]}
+        except Exception as e:
+            errors["book"] = f"{type(e).__name__}: {e}"
+    elif "docx" in kinds and book == "background":
+        outputs["book"] = {"status": "pending"}
+
+    if "docx" in kinds and "docx_key" not in outputs:
         try:
-            docx_bytes = _build_book_docx_bytes(brief, design_prompt)
+            docx_bytes = _timed_render("docx", _build_book_docx_bytes, brief, design_prompt)
             docx_key = f"{base}.docx"
             put_object(settings.s3_bucket_assets, docx_key, docx_bytes,
                        "application/vnd.openxmlformats-officedocument.wordprocessingml.document")
             outputs["docx_key"] = docx_key
             media_keys.append(docx_key)
+        except DeadlineExceeded as e:
+            errors["doc"] = f"{type(e).__name__}: {e}"
+            degraded.append("docx")
         except Exception as e:
             errors["doc"] = f"{type(e).__name__}: {e}"
 
-    if "txt" in kinds:
+    if "txt" in kinds and "text_key" not in outputs:
         try:
             txt_bytes = _build_book_txt_bytes(brief, design_prompt)
             txt_key = f"{base}.txt"
@@ -318,21 +471,13 @@ def generate_assets(design_prompt: str, brief: Dict[str, Any], user_id: str) ->
     # Video (GIF placeholder)
     if "video" in kinds:
         try:
-            from PIL import Image, ImageDraw
-            imgs: List[Any] = []
-            for i in range(12):
-                img = Image.new("RGB", (1024, 1024))
-                d = ImageDraw.Draw(img)
-                d.rectangle((0, 0, 1024, 1024), fill=(10, 10, 20))
-                d.ellipse((112+i*2, 112, 912, 912), fill=(10, 150, 230))
-                d.ellipse((212, 212, 812-i*2, 812), fill=(120, 80, 255))
-                imgs.append(img)
-            buf = io.BytesIO()
-            imgs[0].save(buf, format="GIF", save_all=True, append_images=imgs[1:], duration=80, loop=0)
             gif_key = f"{base}.gif"
-            put_object(settings.s3_bucket_assets, gif_key, buf.getvalue(), "image/gif")
+            put_object(settings.s3_bucket_assets, gif_key, _timed_render("video", _build_gif_bytes), "image/gif")
             outputs["video_key"] = gif_key
             media_keys.append(gif_key)
+        except DeadlineExceeded as e:
+            errors["video"] = f"{type(e).__name__}: {e}"
+            degraded.append("video")
         except Exception as e:
             errors["video"] = f"{type(e).__name__}: {e}"
 
@@ -349,12 +494,9 @@ def generate_assets(design_prompt: str, brief: Dict[str, Any], user_id: str) ->
 
     outputs["kinds"] = kinds
     outputs["media_keys"] = media_keys
-    outputs["package"] = {
-        "design_prompt": design_prompt,
-        "brief": brief,
-        "suggested_title": brief.get("intent", "Producto creativo"),
-        "suggested_description": f"Generado automáticamente a partir de tu idea: {brief.get('notes','')}",
-    }
+    outputs["package"] = package_for(design_prompt, brief)
     if errors:
         outputs["errors"] = errors
+    if degraded:
+        outputs["degraded"] = degraded
     return outputs
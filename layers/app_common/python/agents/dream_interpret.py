@@ -1,6 +1,13 @@
 from __future__ import annotations
-from typing import Dict, Any, List
+import json, re, unicodedata
+from typing import Any, Callable, Dict, List, Optional
 from .factory import make_agent
+from shared.jsonstream import field_callback
+from shared.tracing import traced
+from shared.admission import AdmissionRejected
+from shared.config import settings
+from shared.deadline import DeadlineExceeded
+from shared import admission, counters
 
 SYSTEM_PROMPT = r"""
 ROLE
@@ -67,7 +74,7 @@ _JSON_SCHEMA: Dict[str, Any] = {
             "enum": [
                 "poster","tshirt","mug","book","ebook","audiobook",
                 "3d_model","3d_printable","nft","sticker","mockup",
-                "bundle","other","clarify"
+                "bundle","other","clarify",""
             ]
         },
         "tags": {"type": "array", "items": {"type": "string"}, "minItems": 0, "maxItems": 12},
@@ -99,6 +106,51 @@ def _detect_lang(text: str) -> str:
     if es_hits > en_hits: return "ES"
     return "ES"
 
+_CLARIFY_NOTES = {
+    "EN": "What would you like to create? e.g., 'a vaporwave poster of a cosmic fox', 'a retro children’s book cover with origami dragons'.",
+    "ES": "¿Qué te gustaría crear? Ej.: 'un póster vaporwave de un zorro cósmico', 'una portada de libro infantil con dragones de origami'.",
+}
+
+def _clarify_brief(lang: str, degraded: Optional[str] = None) -> Dict[str, Any]:
+    """`degraded`: el modelo no llegó a responder ("deadline" / "error"); no es una pregunta suya."""
+    brief = {
+        "intent": "clarify",
+        "style": "",
+        "product_type": "",
+        "tags": [],
+        "design_prompt": "",
+        "notes": _CLARIFY_NOTES["EN" if lang == "EN" else "ES"],
+    }
+    if degraded:
+        brief["degraded"] = degraded
+    return brief
+
+# Palabras que por sí solas no piden nada (saludos, cortesía, pruebas). Sin tildes, minúsculas.
+_NON_ACTIONABLE = {
+    "hola", "holi", "buenas", "buenos", "dias", "tardes", "noches", "saludos", "que", "tal", "como", "estas",
+    "hi", "hello", "hey", "heya", "yo", "sup", "good", "morning", "afternoon", "evening", "there",
+    "gracias", "thanks", "thank", "you", "thx", "ok", "okay", "vale", "si", "no", "yes", "test", "prueba",
+    "probando", "ayuda", "help", "hmm", "eh", "ey", "alo", "ping", "kaikashi",
+}
+_WORD = re.compile(r"[a-z0-9]+")
+
+def _fold(text: str) -> str:
+    t = unicodedata.normalize("NFKD", (text or "").lower())
+    return "".join(c for c in t if not unicodedata.combining(c))
+
+def local_clarify(user_text: str) -> Optional[Dict[str, Any]]:
+    """
+    Pre-clasificador local: si la entrada es vacía, sólo signos/emoji, o sólo saludos/
+    cortesía (hasta 6 palabras, todas en `_NON_ACTIONABLE`), devuelve el brief `clarify`
+    sin llamar al modelo. Cualquier palabra con contenido la deja pasar al LLM.
+    """
+    words = _WORD.findall(_fold(user_text))
+    if len(words) > 6:
+        return None
+    if any(w not in _NON_ACTIONABLE for w in words):
+        return None
+    return _clarify_brief(_detect_lang(user_text))
+
 def _clip_words(s: str, mn: int, mx: int) -> str:
     ws = s.split()
     if len(ws) < mn: return s
@@ -116,6 +168,13 @@ def _norm_product_type(pt: str, intent: str) -> str:
     if "3d" in it: return "3d_model"
     return "other"
 
+def _fix_fields(d: Dict[str, Any]) -> Dict[str, Any]:
+    """Antes de validar: sinónimos conocidos de product_type no merecen repreguntar al modelo."""
+    pt = d.get("product_type")
+    if isinstance(pt, str) and pt.lower() in _CANON_PT:
+        d["product_type"] = _CANON_PT[pt.lower()]
+    return d
+
 def _ensure_lists(x) -> List[str]:
     return [str(t) for t in (x or [])]
 
@@ -161,44 +220,96 @@ def _postprocess(d: Dict[str, Any], lang: str) -> Dict[str, Any]:
 
     return out
 
-def interpret_dream(user_text: str) -> Dict[str, Any]:
+def preview_brief(partial: Dict[str, Any], user_text: str) -> Dict[str, Any]:
+    """`_postprocess` sobre los campos recibidos hasta ahora (mismo design_prompt/product_type que el final)."""
+    return _postprocess(partial, _detect_lang(user_text))
+
+@traced("interpret_dream")
+def interpret_dream(user_text: str, on_field: Optional[Callable[[str, Any], None]] = None,
+                    reserve_s: Optional[float] = None) -> Dict[str, Any]:
+    """
+    `on_field(clave, valor)` recibe cada campo del brief apenas se completa en el
+    streaming (valores crudos, antes de `_postprocess`).
+    `reserve_s`: segundos del plazo que se dejan para después del brief (por defecto
+    `DEADLINE_ASSETS_RESERVE_S`, lo que necesitan los assets); 0 si sólo se pide el brief.
+    """
     lang = _detect_lang(user_text)
+    stats = counters.group("interpret")
+
+    local = local_clarify(user_text)
+    if local is not None:
+        stats.incr("clarify_local")
+        return local
 
     try:
-        result = _agent.ask(
-            user_text,
-            expect_json=True,
-            json_schema=_JSON_SCHEMA,
-            attempts=2,
-            delay_s=0.8
-        )
+        with admission.text.admit():
+            result = _agent.ask(
+                user_text,
+                expect_json=True,
+                json_schema=_JSON_SCHEMA,
+                json_fixup=_fix_fields,
+                attempts=2,
+                delay_s=0.8,
+                on_text=field_callback(on_field) if on_field else None,
+                reserve_s=settings.deadline_assets_reserve_s if reserve_s is None else reserve_s,
+            )
         if isinstance(result, dict) and result.get("intent") == "clarify":
+            stats.incr("clarify_model")
             if not result.get("notes"):
-                result["notes"] = (
-                    "What would you like to create? e.g., 'a vaporwave poster of a cosmic fox', 'a retro children’s book cover with origami dragons'."
-                    if lang == "EN" else
-                    "¿Qué te gustaría crear? Ej.: 'un póster vaporwave de un zorro cósmico', 'una portada de libro infantil con dragones de origami'."
-                )
+                result["notes"] = _clarify_brief(lang)["notes"]
             return result
 
+        stats.incr("model")
         return _postprocess(result, lang)
 
+    except AdmissionRejected:
+        raise
+    except DeadlineExceeded:
+        stats.incr("clarify_deadline")
+        return _clarify_brief(lang, "deadline")
+    except Exception:
+        stats.incr("clarify_error")
+        return _clarify_brief(lang, "error")
+
+@traced("refine_brief")
+def refine_brief(brief: Dict[str, Any], request: str, context: str = "",
+                 reserve_s: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Brief actualizado a partir del actual y un pedido de cambio ("igual pero más oscuro").
+    `context`: resumen + últimos turnos de la conversación (acotado por el llamador).
+    Si el modelo no responde o pide aclaración, devuelve un brief `clarify`.
+    """
+    lang = _detect_lang(request)
+    stats = counters.group("interpret")
+    prompt = (
+        (f"CONVERSATION SO FAR\n{context}\n\n" if context else "")
+        + "CURRENT BRIEF\n" + json.dumps(brief, ensure_ascii=False)
+        + "\n\nCHANGE REQUEST\n" + request
+        + "\n\nReturn the full updated brief. Keep every field the change does not touch."
+    )
+    try:
+        with admission.text.admit():
+            result = _agent.ask(
+                prompt,
+                expect_json=True,
+                json_schema=_JSON_SCHEMA,
+                json_fixup=_fix_fields,
+                attempts=2,
+                delay_s=0.8,
+                reserve_s=settings.deadline_assets_reserve_s if reserve_s is None else reserve_s,
+            )
+        if isinstance(result, dict) and result.get("intent") == "clarify":
+            stats.incr("refine_clarify")
+            if not result.get("notes"):
+                result["notes"] = _clarify_brief(lang)["notes"]
+            return result
+        stats.incr("refine")
+        return _postprocess(result, lang)
+    except AdmissionRejected:
+        raise
+    except DeadlineExceeded:
+        stats.incr("refine_deadline")
+        return _clarify_brief(lang, "deadline")
     except Exception:
-        if lang == "EN":
-            return {
-                "intent": "clarify",
-                "style": "",
-                "product_type": "",
-                "tags": [],
-                "design_prompt": "",
-                "notes": "What would you like to create? e.g., 'a vaporwave poster of a cosmic fox', 'a retro children’s book cover with origami dragons'."
-            }
-        else:
-            return {
-                "intent": "clarify",
-                "style": "",
-                "product_type": "",
-                "tags": [],
-                "design_prompt": "",
-                "notes": "¿Qué te gustaría crear? Ej.: 'un póster vaporwave de un zorro cósmico', 'una portada de libro infantil con dragones de origami'."
-            }
+        stats.incr("refine_error")
+        return _clarify_brief(lang, "error")
@@ -1,10 +1,14 @@
 from __future__ import annotations
-from typing import Iterable, Optional, Dict, Any
+from typing import Any, Callable, Dict, Iterable, List, Optional
 from dataclasses import dataclass
 from botocore.config import Config
 from strands.models import BedrockModel
 from strands import Agent
+from shared.aws import PooledSession, client_config
 from shared.config import settings
+from shared.tracing import span
+from shared import usage, admission, counters, deadline, jsonrepair
+from shared.deadline import DeadlineExceeded
 import json, time
 
 @dataclass
@@ -23,16 +27,13 @@ DEFAULT_SYSTEM = (
 )
 
 def _build_boto_config() -> Config:
-    return Config(
-        retries={"max_attempts": 4, "mode": "standard"},
-        connect_timeout=getattr(settings, "bedrock_connect_timeout", 5),
-        read_timeout=getattr(settings, "bedrock_read_timeout", 90),
-    )
+    return client_config("bedrock-runtime")
 
 def _mk_model(model_id: str, opts: AgentOptions) -> BedrockModel:
     kwargs: Dict[str, Any] = {
         "model_id": model_id,
-        "region_name": settings.aws_region,
+        # el cliente sale del registro de shared.aws (uno por proceso, no uno por modelo/fallback)
+        "boto_session": PooledSession(),
         "streaming": opts.stream,
         "temperature": opts.temperature,
         "top_p": opts.top_p,
@@ -46,7 +47,21 @@ def _mk_model(model_id: str, opts: AgentOptions) -> BedrockModel:
         kwargs["cache_prompt"] = opts.cache_prompt
     return BedrockModel(**kwargs)
 
-def make_agent(system_prompt: str | None = None, *, opts: Optional[AgentOptions] = None) -> Agent:
+def _record_usage(model_id: str, resp: Any, before: Optional[Dict[str, Any]], wall_ms: float):
+    """Tokens/latencia de la invocación. `before` = acumulado previo del agente (historial compartido)."""
+    try:
+        metrics = getattr(resp, "metrics", None)
+        acc = dict(getattr(metrics, "accumulated_usage", None) or {})
+        if before:
+            acc = {k: v - before.get(k, 0) for k, v in acc.items()}
+        latency = (getattr(metrics, "accumulated_metrics", None) or {}).get("latencyMs") or wall_ms
+        usage.record(usage.from_agent_metrics(model_id, acc, int(latency)))
+    except Exception:
+        pass
+
+def make_agent(system_prompt: str | None = None, *, opts: Optional[AgentOptions] = None,
+               quiet: bool = False) -> Agent:
+    """`quiet`: sin callback de streaming (no imprime; para llamadas en paralelo)."""
     opts = opts or AgentOptions(
         system_prompt=system_prompt or DEFAULT_SYSTEM,
         temperature=getattr(settings, "llm_temperature", 0.3),
@@ -58,47 +73,148 @@ def make_agent(system_prompt: str | None = None, *, opts: Optional[AgentOptions]
     )
 
     primary_id = settings.bedrock_text_model_id
-    fallbacks = list(getattr(settings, "bedrock_text_fallback_ids", []))
+    fallbacks = [m.strip() for m in str(getattr(settings, "bedrock_text_fallback_ids", "") or "").split(",")
+                 if m.strip() and m.strip() != primary_id]
 
     model = _mk_model(primary_id, opts)
-    agent = Agent(model=model, system_prompt=opts.system_prompt or DEFAULT_SYSTEM)
+    agent_kw: Dict[str, Any] = {"callback_handler": None} if quiet else {}
+    agent = Agent(model=model, system_prompt=opts.system_prompt or DEFAULT_SYSTEM, **agent_kw)
     setattr(agent, "chosen_model_id", primary_id)
     setattr(agent, "_fallback_ids", fallbacks)
     setattr(agent, "_opts", opts)
 
+    def _json_result(tmp: Agent, mid: str, text: str, json_schema: Optional[Dict[str, Any]],
+                     fixup: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]],
+                     followups: int, live: List[bool], reserve_s: float) -> Dict[str, Any]:
+        """
+        Extrae/repara el JSON localmente. Si faltan campos o no cumplen el schema, repregunta
+        sólo por ésos en la misma conversación (hasta `followups` veces) en vez de pasar al
+        siguiente modelo. Sin ningún campo válido -> ValueError (sigue el fallback).
+        """
+        stats = counters.group("llm_json")
+        obj, how = jsonrepair.extract_object(text)
+        if obj is None:
+            stats.incr("unparseable")
+            raise ValueError("la respuesta no contiene un objeto JSON")
+        stats.incr(how)
+        if not json_schema:
+            return obj
+
+        def fix_all(o: Dict[str, Any]) -> Dict[str, Any]:
+            o = jsonrepair.coerce(o, json_schema)
+            return fixup(o) if fixup else o
+
+        obj = fix_all(obj)
+        bad = jsonrepair.problems(obj, json_schema)
+        live[0] = False   # la repregunta no va al parser incremental del stream
+        for _ in range(followups):
+            if not bad:
+                break
+            budget = deadline.timeout(reserve_s)
+            if budget is not None and budget < settings.deadline_min_llm_s:
+                stats.incr("reprompt_skipped")
+                break
+            stats.incr("reprompt")
+            stats.incr("reprompt_fields", len(bad))
+            before = dict(tmp.event_loop_metrics.accumulated_usage)
+            t0 = time.perf_counter()
+            try:
+                with span("bedrock.converse_fix"):
+                    resp = deadline.call(tmp, jsonrepair.followup_prompt(bad, json_schema),
+                                         timeout_s=budget, what="llm_fix")
+            except DeadlineExceeded:
+                stats.incr("reprompt_skipped")
+                break
+            _record_usage(mid, resp, before, (time.perf_counter() - t0) * 1000)
+            fix, _how = jsonrepair.extract_object(getattr(resp, "text", str(resp)))
+            if fix:
+                fix = fix_all(fix)
+                obj.update({k: v for k, v in fix.items() if k in bad})
+            bad = jsonrepair.problems(obj, json_schema)
+            if not bad:
+                stats.incr("reprompt_fixed")
+        if bad:
+            good = [k for k in (json_schema.get("properties") or {}) if k in obj and k not in bad]
+            if not good:
+                stats.incr("invalid")
+                raise ValueError(f"JSON sin campos válidos: {bad}")
+            # lo que sigue mal se descarta; el llamador pone sus valores por defecto
+            stats.incr("partial")
+            for k in bad:
+                obj.pop(k, None)
+        return obj
+
     def ask(prompt: str, *, expect_json: bool = False,
             json_schema: Optional[Dict[str, Any]] = None,
-            attempts: int = 2, delay_s: float = 0.8):
+            json_fixup: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+            attempts: int = 2, delay_s: float = 0.8,
+            on_text: Optional[Callable[[str], None]] = None,
+            reserve_s: float = 0.0):
+        """
+        Con un plazo activo (`shared/deadline.py`), cada intento recibe un timeout del tiempo
+        que queda menos `reserve_s` (lo que necesita el resto de la request), repartido entre
+        el modelo y sus fallbacks; sin tiempo suficiente no se lanza el siguiente intento.
+        """
         tried = []
         model_ids = [agent.chosen_model_id] + getattr(agent, "_fallback_ids", [])
         last_exc = None
 
         for i, mid in enumerate(model_ids):
+            budget = deadline.timeout(reserve_s)
+            per_call = budget
+            if budget is not None:
+                if budget < settings.deadline_min_llm_s:
+                    counters.group("deadline").incr("llm.skipped")
+                    last_exc = DeadlineExceeded(f"sin tiempo para {mid}")
+                    break
+                left = len(model_ids) - i
+                if left > 1 and budget / left >= settings.deadline_min_llm_s:
+                    per_call = budget / left
+            live = [True]
             try:
                 if i > 0:
                     agent.model = _mk_model(mid, agent._opts)
                     setattr(agent, "chosen_model_id", mid)
 
-                if expect_json:
-                    sys = (agent.system_prompt or DEFAULT_SYSTEM) + (
-                        "\n\nDevuelve ÚNICAMENTE un JSON válido, sin texto adicional."
-                    )
-                    tmp = Agent(model=agent.model, system_prompt=sys)
-                    user = prompt
-                    if json_schema:
-                        user += "\n\nSchema aproximado: " + json.dumps(json_schema, ensure_ascii=False)
-                    resp = tmp(user)
-                else:
-                    resp = agent(prompt)
+                t0 = time.perf_counter()
+                with span("bedrock.converse"):
+                    if expect_json:
+                        sys = (agent.system_prompt or DEFAULT_SYSTEM) + (
+                            "\n\nDevuelve ÚNICAMENTE un JSON válido, sin texto adicional."
+                        )
+                        kw: Dict[str, Any] = {}
+                        if on_text is not None and i == 0:
+                            # trozos de texto a medida que llegan (parseo incremental del JSON);
+                            # los fallbacks no re-emiten para no mezclar dos respuestas
+                            kw["callback_handler"] = lambda **ev: live[0] and ev.get("data") and on_text(ev["data"])
+                        tmp = Agent(model=agent.model, system_prompt=sys, **kw)
+                        user = prompt
+                        if json_schema:
+                            user += "\n\nSchema aproximado: " + json.dumps(json_schema, ensure_ascii=False)
+                        resp = deadline.call(tmp, user, timeout_s=per_call, what="llm")
+                        before = None
+                    else:
+                        before = dict(agent.event_loop_metrics.accumulated_usage)
+                        resp = deadline.call(agent, prompt, timeout_s=per_call, what="llm")
+                _record_usage(mid, resp, before, (time.perf_counter() - t0) * 1000)
 
                 text = getattr(resp, "text", str(resp))
-                return json.loads(text) if expect_json else text
+                if not expect_json:
+                    return text
+                return _json_result(tmp, mid, text, json_schema, json_fixup, max(0, attempts - 1), live, reserve_s)
             except Exception as e:
+                live[0] = False   # una llamada vencida sigue en su hilo: que no alimente el stream
                 last_exc = e
                 tried.append(mid)
+                if isinstance(e, DeadlineExceeded) and not expect_json:
+                    break   # el agente con historial sigue ocupado por la llamada vencida
+                if admission.is_throttle(e):
+                    admission.text.throttled()
                 if i < len(model_ids) - 1:
                     time.sleep(delay_s)
                 continue
+        if isinstance(last_exc, DeadlineExceeded):
+            raise last_exc
         raise RuntimeError(f"LLM invoke failed. Tried={tried}. Last error={last_exc}")
 
     setattr(agent, "ask", ask)
@@ -1,33 +1,101 @@
 from __future__ import annotations
+import hashlib, time
 from typing import Dict, Any, List, Optional
-from shared.dynamo import put_product, put_listing, new_id
+from shared import discovery
+from shared.dynamo import (
+    bump_feed_version, get_listing, get_product, listing_summary, new_id, publish_product_listing, update_listing,
+)
 from shared.config import settings
+from shared.search import index_product, is_indexed
+from shared.tracing import traced
 
-def create_product_and_listing(
-    user_id: str,
-    package: Dict[str, Any],
-    media_keys: Optional[List[str]] = None,
-    price_cents: int = 1500
-) -> Dict[str, str]:
-    product_id = new_id("prd")
-    item = {
-        "product_id": product_id,
+def product_item(user_id: str, package: Dict[str, Any], media_keys: Optional[List[str]] = None,
+                 product_id: Optional[str] = None) -> Dict[str, Any]:
+    brief = package.get("brief") or {}
+    return {
+        "product_id": product_id or new_id("prd"),
         "owner_id": user_id,
         "title": package.get("suggested_title", "Producto creativo"),
         "description": package.get("suggested_description", ""),
         "media_keys": media_keys or [],
         "status": "draft",
+        "tags": [str(t) for t in (brief.get("tags") or []) if str(t).strip()],
+        "style": brief.get("style") or "",
+        "product_type": brief.get("product_type") or "",
     }
-    put_product(item)
 
-    listing_id = new_id("lst")
-    listing = {
-        "listing_id": listing_id,
+def listing_item(product_id: str, price_cents: int = 1500, listing_id: Optional[str] = None) -> Dict[str, Any]:
+    return {
+        "listing_id": listing_id or new_id("lst"),
         "product_id": product_id,
         "price_cents": price_cents,
         "currency": "USD",
         "status": "active",
         "metadata": {"stage": settings.stage},
     }
-    put_listing(listing)
-    return {"product_id": product_id, "listing_id": listing_id}
+
+def stable_id(prefix: str, seed: str) -> str:
+    """Id derivado de `seed` (p.ej. la fila de un backfill): la misma semilla da el mismo id."""
+    return f"{prefix}_{hashlib.sha256(seed.encode('utf-8')).hexdigest()[:12]}"
+
+def publish_new(user_id: str, package: Dict[str, Any], media_keys: Optional[List[str]] = None,
+                price_cents: int = 1500, product_id: Optional[str] = None,
+                listing_id: Optional[str] = None) -> Dict[str, Any]:
+    """Escribe product + listing (transacción). Devuelve el product con su resumen de listing."""
+    item = product_item(user_id, package, media_keys, product_id)
+    if item["media_keys"]:
+        item["published_at"] = int(time.time() * 1000)
+    listing = listing_item(item["product_id"], price_cents, listing_id)
+    publish_product_listing(item, listing)
+    return {**item, "listing": listing_summary(listing)}
+
+def finish_publish(product: Dict[str, Any], resume: bool = False):
+    """
+    Lo que sigue a la transacción: índice, tarjeta del feed público y versión del feed.
+    Con `resume` (el product ya estaba escrito) no vuelve a indexar si ya tiene postings.
+    """
+    if not resume or not is_indexed(product):
+        index_product(product)
+    discovery.publish(product)
+    bump_feed_version(product["owner_id"])
+
+@traced("publish")
+def create_product_and_listing(
+    user_id: str,
+    package: Dict[str, Any],
+    media_keys: Optional[List[str]] = None,
+    price_cents: int = 1500
+) -> Dict[str, str]:
+    product = publish_new(user_id, package, media_keys, price_cents)
+    finish_publish(product)
+    return {"product_id": product["product_id"], "listing_id": product["listing"]["listing_id"]}
+
+LISTING_STATUSES = ("active", "inactive")
+
+@traced("listing.update")
+def edit_listing(user_id: str, listing_id: str, changes: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Cambia precio/status de una listing del usuario. Mantiene al día lo que la copia:
+    `product.listing` (misma transacción), la versión de su feed (ETag/páginas) y la
+    tarjeta del feed público. LookupError si no existe o no es suya; ValueError si el cambio no vale.
+    """
+    listing = get_listing(listing_id)
+    product = get_product(listing["product_id"]) if listing else None
+    if not product or product.get("owner_id") != user_id:
+        raise LookupError(listing_id)
+    clean: Dict[str, Any] = {}
+    if changes.get("price_cents") is not None:
+        price = int(changes["price_cents"])
+        if price < 0:
+            raise ValueError("price_cents debe ser >= 0")
+        clean["price_cents"] = price
+    if changes.get("status") is not None:
+        if changes["status"] not in LISTING_STATUSES:
+            raise ValueError(f"status debe ser uno de {', '.join(LISTING_STATUSES)}")
+        clean["status"] = changes["status"]
+    if not clean:
+        raise ValueError("nada que cambiar (price_cents, status)")
+    update_listing(listing_id, product["product_id"], clean)
+    bump_feed_version(user_id)
+    discovery.refresh(product["product_id"])
+    return {**listing, **clean}
@@ -0,0 +1,238 @@
+from __future__ import annotations
+import json
+from typing import Any, Dict, List, Optional, Tuple
+from agents import book_write
+from agents.create_flow import is_clarify, presign_media
+from agents.design_generate import _decide_kinds, affected_kinds, generate_assets, package_for
+from agents.dream_interpret import local_clarify, refine_brief
+from agents.factory import AgentOptions, make_agent
+from agents.listing_publish import product_item
+from shared import admission, counters, discovery
+from shared.config import settings
+from shared.dynamo import (
+    bump_feed_version, get_conversation, list_messages, put_message, set_conversation_meta, update_product,
+)
+from shared.search import index_product, unindex_product
+from shared.tracing import traced
+
+# Refinar = otro turno sobre la conversación de /create. El estado vive en `meta.refine`:
+#   brief, assets (key por campo), ids, summary (resumen acumulado) y upto (created_at
+#   del último mensaje ya resumido). El prompt lleva el resumen + los últimos turnos dentro
+#   de REFINE_CONTEXT_TOKENS; lo que sale de la ventana se pliega al resumen al final de
+#   cada refine, así ni el prompt ni las lecturas crecen con la conversación.
+
+_KEY_FIELDS = {"image": "image_key", "docx": "docx_key", "txt": "text_key", "video": "video_key", "3d": "model3d_key"}
+_LINE_CHARS = 600
+
+_SUMMARY_SYSTEM = (
+    "Resumes conversaciones sobre el diseño de un producto. Conserva sólo lo vigente: qué producto es, "
+    "decisiones de estilo y contenido, cambios pedidos y descartados. Texto plano, sin saludos."
+)
+
+def approx_tokens(text: str) -> int:
+    return (len(text or "") + 3) // 4   # ~4 caracteres por token
+
+def _clip(text: str, tokens: int) -> str:
+    return text if approx_tokens(text) <= tokens else text[:max(0, tokens * 4 - 1)] + "…"
+
+def render_message(m: Dict[str, Any]) -> Optional[str]:
+    """Una línea por mensaje para el contexto; los JSON del asistente se reducen a lo que decide."""
+    content = m.get("content") or ""
+    if m.get("role") == "user":
+        return "Usuario: " + _clip(" ".join(content.split()), _LINE_CHARS // 4)
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return "Asistente: " + _clip(" ".join(content.split()), _LINE_CHARS // 4)
+    if not isinstance(data, dict):
+        return None
+    brief = data.get("brief")
+    if isinstance(brief, dict):
+        if is_clarify(brief):
+            return "Asistente (pregunta): " + (brief.get("notes") or "")
+        return f"Asistente (brief): {brief.get('product_type')} · {brief.get('intent')} · estilo {brief.get('style')}"
+    design = data.get("design")
+    if isinstance(design, dict):
+        return "Asistente (assets): " + ", ".join(design.get("regenerated") or design.get("kinds") or [])
+    return None   # ids y demás no aportan al modelo
+
+def split_turns(messages: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """Turnos: un mensaje del usuario y las respuestas que le siguen."""
+    turns: List[List[Dict[str, Any]]] = []
+    for m in messages:
+        if m.get("role") == "user" or not turns:
+            turns.append([m])
+        else:
+            turns[-1].append(m)
+    return turns
+
+def window(summary: str, messages: List[Dict[str, Any]]) -> Tuple[str, List[Dict[str, Any]], Dict[str, int]]:
+    """
+    (contexto, mensajes a plegar al resumen, stats). Entran los últimos REFINE_RECENT_TURNS
+    turnos enteros que quepan junto al resumen en REFINE_CONTEXT_TOKENS (del último, si no
+    cabe entero, sus primeras líneas); los turnos anteriores quedan para el resumen.
+    """
+    turns = split_turns(messages)
+    budget = settings.refine_context_tokens - approx_tokens(summary)
+    recent = turns[-max(1, settings.refine_recent_turns):] if turns else []
+    kept: List[List[str]] = []
+    for turn in reversed(recent):
+        lines = [line for line in map(render_message, turn) if line]
+        cost = sum(approx_tokens(line) for line in lines)
+        if cost > budget:
+            if not kept:
+                fit: List[str] = []
+                for line in lines:
+                    if approx_tokens(line) > budget:
+                        break
+                    fit.append(line)
+                    budget -= approx_tokens(line)
+                kept.append(fit)
+            break
+        kept.append(lines)
+        budget -= cost
+    folded = [m for turn in turns[:len(turns) - len(kept)] for m in turn]
+    lines = [line for turn in reversed(kept) for line in turn]
+    text = (f"Resumen: {summary}\n" if summary else "") + "\n".join(lines)
+    return text.strip(), folded, {"tokens": approx_tokens(text), "turns": len(kept), "summary_tokens": approx_tokens(summary)}
+
+@traced("refine.summarize")
+def summarize(summary: str, messages: List[Dict[str, Any]]) -> str:
+    """Pliega `messages` en el resumen (una llamada corta, tope REFINE_SUMMARY_TOKENS)."""
+    lines = [line for line in map(render_message, messages) if line]
+    if not lines:
+        return summary
+    agent = make_agent(opts=AgentOptions(
+        system_prompt=_SUMMARY_SYSTEM,
+        temperature=0.2,
+        top_p=0.8,
+        max_tokens=settings.refine_summary_tokens,
+        stream=settings.llm_streaming,
+    ), quiet=True)
+    prompt = (f"Resumen actual:\n{summary or '(vacío)'}\n\nMensajes nuevos:\n" + "\n".join(lines) +
+              f"\n\nDevuelve el resumen actualizado en menos de {settings.refine_summary_tokens * 3 // 4} palabras.")
+    # el refine ya pagó la cuota del usuario con el brief
+    with admission.batch_mode(), admission.text.admit():
+        text = " ".join(str(agent.ask(prompt)).split())
+    return _clip(text, settings.refine_summary_tokens)
+
+def _state_from(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Primer refine: brief, assets e ids desde los mensajes que dejó /create."""
+    state: Dict[str, Any] = {"summary": "", "upto": None, "turns": 0, "assets": {}}
+    for m in messages:
+        if m.get("role") != "assistant":
+            continue
+        try:
+            data = json.loads(m.get("content") or "")
+        except ValueError:
+            continue
+        if not isinstance(data, dict):
+            continue
+        if isinstance(data.get("brief"), dict) and not is_clarify(data["brief"]):
+            state["brief"] = data["brief"]
+        if isinstance(data.get("design"), dict):
+            state["assets"] = {f: data["design"][f] for f in _KEY_FIELDS.values() if data["design"].get(f)}
+        if isinstance(data.get("ids"), dict):
+            state["ids"] = data["ids"]
+    return state
+
+def _save(conversation_id: str, state: Dict[str, Any], messages: List[Dict[str, Any]]):
+    stats = counters.group("refine")
+    summary = state.get("summary") or ""
+    _, folded, _ = window(summary, messages)
+    if folded:
+        try:
+            state["summary"] = summarize(summary, folded)
+            state["upto"] = folded[-1]["created_at"]
+            stats.incr("folded", len(folded))
+        except Exception:
+            stats.incr("fold_errors")   # se reintenta en el próximo refine
+    set_conversation_meta(conversation_id, "refine", state)
+
+@traced("refine")
+def run_refine(conversation_id: str, user_id: str, q: str, *, book: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Un pedido de cambio sobre el producto de la conversación: brief nuevo desde el actual
+    + contexto acotado, y sólo se regeneran los assets cuyos campos cambiaron
+    (`affected_kinds`); el resto conserva sus keys. Actualiza product, índice de búsqueda,
+    tarjeta del feed público, mensajes y `meta.refine`. LookupError si la conversación no es del usuario,
+    ValueError si no tiene producto.
+    """
+    stats = counters.group("refine")
+    conv = get_conversation(conversation_id, ("user_id", "meta"))
+    if not conv or conv.get("user_id") != user_id:
+        raise LookupError("conversation not found")
+    state = (conv.get("meta") or {}).get("refine")
+    if state is None:
+        messages = list_messages(conversation_id)
+        state = _state_from(messages)
+        stats.incr("bootstrap")
+    else:
+        messages = list_messages(conversation_id, after=state.get("upto"))
+    if not state.get("brief") or not state.get("ids"):
+        raise ValueError("la conversación no tiene un producto que refinar")
+
+    old = state["brief"]
+    context, _, ctx_stats = window(state.get("summary") or "", messages)
+    messages.append(put_message(conversation_id, role="user", content=q))
+    brief = local_clarify(q) or refine_brief(old, q, context)
+    state["turns"] = int(state.get("turns") or 0) + 1
+
+    if is_clarify(brief):
+        stats.incr("clarify")
+        messages.append(put_message(conversation_id, role="assistant",
+                                    content=json.dumps({"brief": brief}, ensure_ascii=False)))
+        _save(conversation_id, state, messages)
+        return {"conversation_id": conversation_id, "clarify": True, "brief": brief,
+                "message": brief.get("notes", ""), "context": ctx_stats}
+
+    stats.incr("refined")
+    design_prompt = brief.get("design_prompt", q)
+    regenerate = affected_kinds(old, brief)
+    fresh = generate_assets(design_prompt, brief, user_id, book=book, only=regenerate,
+                            scope=conversation_id) if regenerate else {}
+    stats.incr("regenerated", len(regenerate))
+
+    kinds = _decide_kinds(brief)
+    assets: Dict[str, str] = {}
+    for kind in kinds:
+        field = _KEY_FIELDS[kind]
+        key = fresh.get(field) or state["assets"].get(field)
+        if key:
+            assets[field] = key
+    keys = [assets[f] for f in _KEY_FIELDS.values() if f in assets]
+    package = package_for(design_prompt, brief)
+
+    ids = state["ids"]
+    item = product_item(user_id, package, keys, ids["product_id"])
+    update_product(ids["product_id"], {k: item[k] for k in ("title", "description", "tags", "style",
+                                                            "product_type", "media_keys")})
+    unindex_product(product_item(user_id, package_for(old.get("design_prompt", ""), old), [], ids["product_id"]))
+    index_product(item)
+    discovery.refresh(ids["product_id"])
+    bump_feed_version(user_id)
+
+    design: Dict[str, Any] = {**assets, "kinds": kinds, "regenerated": regenerate,
+                              "reused": [k for k in kinds if k not in regenerate],
+                              "media_keys": keys, "package": package}
+    for extra in ("errors", "degraded", "book"):
+        if fresh.get(extra):
+            design[extra] = fresh[extra]
+    messages.append(put_message(conversation_id, role="assistant",
+                                content=json.dumps({"brief": brief}, ensure_ascii=False)))
+    messages.append(put_message(conversation_id, role="assistant",
+                                content=json.dumps({"design": design}, ensure_ascii=False), media_keys=keys or None))
+    if (fresh.get("book") or {}).get("status") == "pending" and assets.get("docx_key"):
+        book_write.start(conversation_id, design_prompt, brief, user_id,
+                         docx_key=assets["docx_key"], text_key=assets.get("text_key"))
+
+    state.update(brief=brief, assets=assets)
+    _save(conversation_id, state, messages)
+    return {
+        "conversation_id": conversation_id,
+        "clarify": False,
+        "brief": brief,
+        "design": {**design, "media": presign_media(keys)},
+        "ids": ids,
+        "context": ctx_stats,
+    }
@@ -0,0 +1,303 @@
+from __future__ import annotations
+import contextlib, contextvars, threading, time
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, Optional, Tuple
+from .config import settings
+from .tracing import span
+
+class AdmissionRejected(Exception):
+    """La request no entró (cuota del usuario, cuota global o espera agotada). Se traduce a 429."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"admission rejected: {reason} (retry after {retry_after:.1f}s)")
+        self.reason = reason
+        self.retry_after = max(1.0, float(retry_after))
+
+# Trabajos por lotes (batch): cada llamada no consume la cuota por usuario (el lote se
+# cobra entero al lanzarlo, `AdmissionController.charge`), pero sí la cola justa y el
+# bucket global del modelo.
+_skip_user_quota: contextvars.ContextVar[bool] = contextvars.ContextVar("kkt_skip_user_quota", default=False)
+
+@contextlib.contextmanager
+def batch_mode() -> Iterator[None]:
+    token = _skip_user_quota.set(True)
+    try:
+        yield
+    finally:
+        _skip_user_quota.reset(token)
+
+# ---------- backends de token buckets
+
+class MemoryBuckets:
+    """Token buckets en proceso (API local / un solo proceso)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._b: Dict[str, Tuple[float, float]] = {}
+
+    def try_take(self, key: str, cost: float, rate: float, burst: float, debt: bool = False) -> Tuple[bool, float]:
+        """`debt`: basta con min(cost, burst) disponibles; el resto queda en negativo y se repone con el tiempo."""
+        need = min(cost, burst) if debt else cost
+        now = time.monotonic()
+        with self._lock:
+            tokens, ts = self._b.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - ts) * rate)
+            if tokens >= need:
+                self._b[key] = (tokens - cost, now)
+                return True, 0.0
+            self._b[key] = (tokens, now)
+            return False, (need - tokens) / rate if rate > 0 else 60.0
+
+    def refund(self, key: str, cost: float, rate: float, burst: float):
+        now = time.monotonic()
+        with self._lock:
+            tokens, ts = self._b.get(key, (burst, now))
+            self._b[key] = (min(burst, tokens + (now - ts) * rate + cost), now)
+
+    def drain(self, key: str):
+        with self._lock:
+            self._b[key] = (0.0, time.monotonic())
+
+class DynamoBuckets:
+    """
+    Token buckets compartidos entre Lambdas: lectura consistente + escritura condicional
+    sobre `ts` (control optimista). Si otro contenedor escribió en medio, se reintenta.
+    """
+
+    def __init__(self, attempts: int = 4):
+        self.attempts = attempts
+
+    def try_take(self, key: str, cost: float, rate: float, burst: float, debt: bool = False) -> Tuple[bool, float]:
+        from .dynamo import get_rate_bucket, put_rate_bucket
+        need = min(cost, burst) if debt else cost
+        for _ in range(self.attempts):
+            now = time.time()
+            item = get_rate_bucket(key)
+            if item:
+                old_ts = float(item["ts"])
+                tokens = min(burst, float(item["tokens"]) + max(0.0, now - old_ts) * rate)
+            else:
+                old_ts, tokens = None, burst
+            if tokens < need:
+                return False, (need - tokens) / rate if rate > 0 else 60.0
+            if put_rate_bucket(key, tokens - cost, now, old_ts):
+                return True, 0.0
+        # contención alta sobre la misma clave: tratarlo como cuota agotada
+        return False, 1.0 / rate if rate > 0 else 1.0
+
+    def refund(self, key: str, cost: float, rate: float, burst: float):
+        """Best-effort: si pierde la carrera todas las veces, el token se recupera con el tiempo."""
+        from .dynamo import get_rate_bucket, put_rate_bucket
+        for _ in range(self.attempts):
+            now = time.time()
+            item = get_rate_bucket(key)
+            if not item:
+                return
+            old_ts = float(item["ts"])
+            tokens = min(burst, float(item["tokens"]) + max(0.0, now - old_ts) * rate + cost)
+            if put_rate_bucket(key, tokens, now, old_ts):
+                return
+
+    def drain(self, key: str):
+        from .dynamo import put_rate_bucket
+        try:
+            put_rate_bucket(key, 0.0, time.time(), None, force=True)
+        except Exception:
+            pass
+
+def _make_backend():
+    if settings.admission_backend == "dynamodb":
+        return DynamoBuckets()
+    return MemoryBuckets()
+
+# ---------- cola justa (round-robin por usuario) delante de N slots
+
+class _Waiter:
+    __slots__ = ("granted",)
+
+    def __init__(self):
+        self.granted = False
+
+class FairLimiter:
+    """
+    Límite de concurrencia con cola por usuario. Al liberar un slot se entrega
+    directamente al primer waiter del siguiente usuario en orden round-robin,
+    así un usuario con 50 requests en cola no adelanta a otro con 1.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = max(1, int(limit))
+        self._cv = threading.Condition()
+        self._active = 0
+        self._queues: Dict[str, Deque[_Waiter]] = {}
+        self._rr: Deque[str] = deque()
+
+    def acquire(self, user_id: str, timeout: float) -> bool:
+        with self._cv:
+            if self._active < self.limit and not self._rr:
+                self._active += 1
+                return True
+            w = _Waiter()
+            self._queues.setdefault(user_id, deque()).append(w)
+            if user_id not in self._rr:
+                self._rr.append(user_id)
+            deadline = time.monotonic() + max(0.0, timeout)
+            while not w.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    q = self._queues.get(user_id)
+                    if q and w in q:
+                        q.remove(w)
+                        if not q:
+                            del self._queues[user_id]
+                            self._rr.remove(user_id)
+                    return False
+                self._cv.wait(remaining)
+            return True
+
+    def release(self):
+        with self._cv:
+            while self._rr:
+                uid = self._rr.popleft()
+                q = self._queues[uid]
+                w = q.popleft()
+                if q:
+                    self._rr.append(uid)
+                else:
+                    del self._queues[uid]
+                w.granted = True
+                self._cv.notify_all()
+                return
+            self._active -= 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cv:
+            return {"active": self._active, "limit": self.limit,
+                    "queued": sum(len(q) for q in self._queues.values()), "queued_users": len(self._rr)}
+
+class AdmissionController:
+    """
+    Delante de cada llamada a Bedrock de un tipo (`text` / `image`):
+      1) token bucket por usuario (rechazo inmediato si se pasó de su cuota),
+      2) slot de concurrencia con cola justa y espera acotada,
+      3) token bucket global ajustado al RPM del modelo.
+    """
+
+    def __init__(self, kind: str, *, concurrency: int, global_rpm: float,
+                 user_rpm: float, user_burst: float, max_wait_s: float, backend=None):
+        self.kind = kind
+        self.limiter = FairLimiter(concurrency)
+        self.global_rate = global_rpm / 60.0
+        self.global_burst = float(max(1, concurrency))
+        self.user_rate = user_rpm / 60.0
+        self.user_burst = float(max(1.0, user_burst))
+        self.max_wait_s = max_wait_s
+        self.backend = backend or _make_backend()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, float] = {"admitted": 0, "rejected_user_rate": 0, "rejected_queue_timeout": 0,
+                                         "rejected_global_rate": 0, "throttled": 0, "charged_batch": 0,
+                                         "wait_ms_total": 0.0}
+
+    def _count(self, key: str, n: float = 1):
+        with self._lock:
+            self._stats[key] = self._stats.get(key, 0) + n
+
+    @contextlib.contextmanager
+    def admit(self, user_id: Optional[str] = None) -> Iterator[None]:
+        if not settings.admission_enabled:
+            yield
+            return
+        if user_id is None:
+            from .usage import current
+            sc = current()
+            user_id = sc.user_id if sc and sc.user_id else None
+        uid = user_id or "anonymous"
+        quota = not _skip_user_quota.get()
+
+        if quota:
+            ok, wait = self.backend.try_take(f"user#{self.kind}#{uid}", 1, self.user_rate, self.user_burst)
+            if not ok:
+                self._count("rejected_user_rate")
+                raise AdmissionRejected("user_rate", wait)
+
+        t0 = time.monotonic()
+        deadline = t0 + self.max_wait_s
+        with span(f"admission.{self.kind}"):
+            # rechazos por la cola o el bucket global: la llamada no se hizo, el token del usuario se devuelve
+            if not self.limiter.acquire(uid, self.max_wait_s):
+                self._count("rejected_queue_timeout")
+                if quota:
+                    self.refund(uid)
+                raise AdmissionRejected("queue_timeout", self.max_wait_s)
+            try:
+                while True:
+                    ok, wait = self.backend.try_take(f"global#{self.kind}", 1, self.global_rate, self.global_burst)
+                    if ok:
+                        break
+                    if time.monotonic() + wait > deadline:
+                        self._count("rejected_global_rate")
+                        if quota:
+                            self.refund(uid)
+                        raise AdmissionRejected("global_rate", wait)
+                    time.sleep(wait)
+            except BaseException:
+                self.limiter.release()
+                raise
+        self._count("admitted")
+        self._count("wait_ms_total", (time.monotonic() - t0) * 1000.0)
+        try:
+            yield
+        finally:
+            self.limiter.release()
+
+    def charge(self, user_id: str, cost: float):
+        """
+        Cobra `cost` llamadas de golpe a la cuota del usuario (un lote antes de correr en
+        `batch_mode`). Basta con tener el burst; lo que exceda deja el bucket en negativo.
+        """
+        if not settings.admission_enabled or cost <= 0:
+            return
+        ok, wait = self.backend.try_take(f"user#{self.kind}#{user_id}", cost, self.user_rate, self.user_burst, debt=True)
+        if not ok:
+            self._count("rejected_user_rate")
+            raise AdmissionRejected("user_rate", wait)
+        self._count("charged_batch", cost)
+
+    def refund(self, user_id: str, cost: float = 1):
+        """Devuelve a la cuota del usuario llamadas cobradas que no se hicieron."""
+        if not settings.admission_enabled:
+            return
+        self.backend.refund(f"user#{self.kind}#{user_id}", cost, self.user_rate, self.user_burst)
+
+    def throttled(self):
+        """Bedrock devolvió throttling: vaciar el bucket global para que el resto espere en cola."""
+        self._count("throttled")
+        self.backend.drain(f"global#{self.kind}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = dict(self._stats)
+        out.update(self.limiter.snapshot())
+        return out
+
+text = AdmissionController(
+    "text",
+    concurrency=settings.admission_text_concurrency,
+    global_rpm=settings.admission_text_rpm,
+    user_rpm=settings.admission_user_rpm,
+    user_burst=settings.admission_user_burst,
+    max_wait_s=settings.admission_max_wait_s,
+)
+
+image = AdmissionController(
+    "image",
+    concurrency=settings.admission_image_concurrency,
+    global_rpm=settings.admission_image_rpm,
+    user_rpm=settings.admission_user_rpm,
+    user_burst=settings.admission_user_burst,
+    max_wait_s=settings.admission_max_wait_s,
+)
+
+def is_throttle(e: BaseException) -> bool:
+    name = type(e).__name__
+    return "Throttl" in name or "ThrottlingException" in str(e) or "Too many requests" in str(e)
@@ -1,34 +1,106 @@
 from __future__ import annotations
+import threading
+from typing import Any, Dict, Optional, Tuple
 import boto3
-from .config import settings
 from botocore.config import Config
+from .config import settings
+
+# Registro de clientes: uno por (servicio, región, config) y por proceso, compartido
+# entre hilos (los clientes de botocore son thread-safe; crear clientes desde una
+# misma Session no lo es, por eso la creación va bajo lock).
+
+_lock = threading.RLock()
+_session: Optional[boto3.session.Session] = None
+_clients: Dict[Tuple[str, str, str, Tuple], Any] = {}
+
+def base_config() -> Config:
+    return Config(
+        max_pool_connections=settings.aws_max_pool_connections,
+        tcp_keepalive=True,
+        connect_timeout=settings.aws_connect_timeout,
+        read_timeout=settings.aws_read_timeout,
+        retries={"max_attempts": settings.aws_max_attempts, "mode": settings.aws_retry_mode},
+    )
+
+def _service_config(service: str) -> Optional[Config]:
+    if service == "s3":
+        return Config(signature_version="s3v4", s3={"addressing_style": "virtual"})
+    if service == "bedrock-runtime":
+        # streaming largo: el read timeout cubre el tiempo entre chunks
+        return Config(connect_timeout=settings.bedrock_connect_timeout,
+                      read_timeout=settings.bedrock_read_timeout)
+    return None
+
+def client_config(service: str, extra: Optional[Config] = None) -> Config:
+    cfg = base_config()
+    svc = _service_config(service)
+    if svc is not None:
+        cfg = cfg.merge(svc)
+    return cfg.merge(extra) if extra is not None else cfg
+
+def _config_key(cfg: Optional[Config]) -> Tuple:
+    if cfg is None:
+        return ()
+    return tuple(sorted((k, repr(v)) for k, v in cfg._user_provided_options.items()))
+
+def session() -> boto3.session.Session:
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = boto3.session.Session()
+    return _session
+
+def _get(kind: str, service: str, region: Optional[str], config: Optional[Config]) -> Any:
+    region = region or settings.aws_region
+    key = (kind, service, region, _config_key(config))
+    c = _clients.get(key)
+    if c is not None:
+        return c
+    with _lock:
+        c = _clients.get(key)
+        if c is None:
+            cfg = client_config(service, config)
+            s = session()
+            c = s.client(service, region_name=region, config=cfg) if kind == "client" \
+                else s.resource(service, region_name=region, config=cfg)
+            _clients[key] = c
+    return c
+
+def client(service: str, region: Optional[str] = None, config: Optional[Config] = None) -> Any:
+    """Cliente cacheado con la config afinada (pool, keep-alive, reintentos adaptativos, timeouts)."""
+    return _get("client", service, region, config)
+
+def resource(service: str, region: Optional[str] = None, config: Optional[Config] = None) -> Any:
+    return _get("resource", service, region, config)
+
+class PooledSession:
+    """
+    Sustituto mínimo de `boto3.Session` para librerías que crean su propio cliente
+    (p.ej. `BedrockModel` de strands): se lo entrega el registro.
+    """
+
+    def __init__(self, region: Optional[str] = None):
+        self.region_name = region or settings.aws_region
 
-_s3 = None
+    def client(self, service_name: str, region_name: Optional[str] = None,
+               config: Optional[Config] = None, **_kw: Any) -> Any:
+        return client(service_name, region_name or self.region_name, config)
 
 def s3_client():
-    global _s3
-    if _s3 is None:
-        _s3 = boto3.client(
-            "s3",
-            region_name=settings.aws_region,           
-            config=Config(
-                signature_version="s3v4",              
-                s3={"addressing_style": "virtual"},  
-            ),
-        )
-    return _s3
+    return client("s3")
 
 def dynamodb_client():
-    return boto3.client("dynamodb", region_name=settings.aws_region)
+    return client("dynamodb")
 
 def dynamodb_resource():
-    return boto3.resource("dynamodb", region_name=settings.aws_region)
+    return resource("dynamodb")
 
 def bedrock_runtime():
-    return boto3.client("bedrock-runtime", region_name=settings.aws_region)
+    return client("bedrock-runtime")
 
 def transcribe_client():
-    return boto3.client("transcribe", region_name=settings.aws_region)
+    return client("transcribe")
 
 def mediaconvert_client():
-    return boto3.client("mediaconvert", region_name=settings.aws_region)
+    return client("mediaconvert")
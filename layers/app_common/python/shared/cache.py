@@ -0,0 +1,60 @@
+from __future__ import annotations
+import threading, time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+_MISS = object()
+
+class TTLCache:
+    """LRU acotado con expiración por entrada. Thread-safe; pensado para caches cortos en proceso."""
+
+    def __init__(self, maxsize: int = 256, ttl: float = 30.0):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = float(ttl)
+        self._lock = threading.Lock()
+        self._d: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            hit = self._d.get(key, _MISS)
+            if hit is _MISS or hit[0] <= now:
+                if hit is not _MISS:
+                    del self._d[key]
+                self.misses += 1
+                return default
+            self._d.move_to_end(key)
+            self.hits += 1
+            return hit[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        exp = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._d[key] = (exp, value)
+            self._d.move_to_end(key)
+            while len(self._d) > self.maxsize:
+                self._d.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            hit = self._d.pop(key, _MISS)
+        return default if hit is _MISS else hit[1]
+
+    def clear(self):
+        with self._lock:
+            self._d.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Presencia sin tocar contadores ni el orden LRU."""
+        with self._lock:
+            hit = self._d.get(key, _MISS)
+            return hit is not _MISS and hit[0] > time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._d)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"size": len(self._d), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
@@ -8,6 +8,12 @@ load_dotenv()
 @dataclass(frozen=True)
 class Settings:
     aws_region: str = os.getenv("AWS_REGION", "us-west-2")
+    # clientes boto3 (shared/aws.py)
+    aws_max_pool_connections: int = int(os.getenv("AWS_MAX_POOL_CONNECTIONS", "50"))
+    aws_connect_timeout: float = float(os.getenv("AWS_CONNECT_TIMEOUT", "3"))
+    aws_read_timeout: float = float(os.getenv("AWS_READ_TIMEOUT", "10"))
+    aws_max_attempts: int = int(os.getenv("AWS_MAX_ATTEMPTS", "4"))
+    aws_retry_mode: str = os.getenv("AWS_RETRY_MODE", "adaptive")
     account_id: str = os.getenv("AWS_ACCOUNT_ID", "")
     stage: str = os.getenv("STAGE", "dev")
 
@@ -19,11 +25,14 @@ class Settings:
     llm_top_p: float = float(os.getenv("LLM_TOP_P", "0.8"))
     llm_streaming: bool = os.getenv("LLM_STREAMING", "true").lower() == "true"
     llm_cache_prompt: bool = os.getenv("LLM_CACHE_PROMPT", "false").lower() == "true"
+    bedrock_connect_timeout: float = float(os.getenv("BEDROCK_CONNECT_TIMEOUT", "5"))
+    bedrock_read_timeout: float = float(os.getenv("BEDROCK_READ_TIMEOUT", "90"))
     
     # S3
     s3_bucket_uploads: str = os.getenv("S3_BUCKET_UPLOADS", "kkt-uploads-dev")
     s3_bucket_assets: str = os.getenv("S3_BUCKET_ASSETS", "kkt-assets-dev")
     s3_bucket_public: str = os.getenv("S3_BUCKET_PUBLIC", "kkt-public-dev")
+    presign_expiry_s: int = int(os.getenv("PRESIGN_EXPIRY_S", "300"))
 
     # DynamoDB
     ddb_products: str = os.getenv("DDB_TABLE_PRODUCTS", "kkt_products_dev")
@@ -33,8 +42,110 @@ class Settings:
     ddb_conversations: str = os.getenv("DDB_TABLE_CONVERSATIONS", "kkt_conversations_dev")
     ddb_messages: str = os.getenv("DDB_TABLE_MESSAGES", "kkt_messages_dev")
 
+    ddb_usage: str = os.getenv("DDB_TABLE_USAGE", "kkt_usage_dev")
+    ddb_rate_limits: str = os.getenv("DDB_TABLE_RATE_LIMITS", "kkt_rate_limits_dev")
+    ddb_search: str = os.getenv("DDB_TABLE_SEARCH", "kkt_search_dev")
+    ddb_idempotency: str = os.getenv("DDB_TABLE_IDEMPOTENCY", "kkt_idempotency_dev")
+    ddb_public_feed: str = os.getenv("DDB_TABLE_PUBLIC_FEED", "kkt_public_feed_dev")
+
+    # Uso / costo por llamada
+    usage_enabled: bool = os.getenv("USAGE_ENABLED", "true").lower() == "true"
+    usage_flush_calls: int = int(os.getenv("USAGE_FLUSH_CALLS", "20"))
+    usage_flush_secs: float = float(os.getenv("USAGE_FLUSH_SECS", "10"))
+    model_pricing_json: str = os.getenv("MODEL_PRICING_JSON", "")
+
+    # Admisión (cuotas Bedrock): memory | dynamodb
+    admission_enabled: bool = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+    admission_backend: str = os.getenv("ADMISSION_BACKEND", "memory").lower()
+    admission_user_rpm: float = float(os.getenv("ADMISSION_USER_RPM", "10"))
+    admission_user_burst: float = float(os.getenv("ADMISSION_USER_BURST", "5"))
+    admission_text_concurrency: int = int(os.getenv("ADMISSION_TEXT_CONCURRENCY", "8"))
+    admission_text_rpm: float = float(os.getenv("ADMISSION_TEXT_RPM", "50"))
+    admission_image_concurrency: int = int(os.getenv("ADMISSION_IMAGE_CONCURRENCY", "4"))
+    admission_image_rpm: float = float(os.getenv("ADMISSION_IMAGE_RPM", "20"))
+    admission_max_wait_s: float = float(os.getenv("ADMISSION_MAX_WAIT_S", "10"))
+
+    # Libros: capítulos con el LLM (agents/book_write.py)
+    book_llm: bool = os.getenv("BOOK_LLM", "true").lower() == "true"          # false = texto de relleno
+    book_background: bool = os.getenv("BOOK_BACKGROUND", "true").lower() == "true"  # API /create: en segundo plano
+    book_workers: int = int(os.getenv("BOOK_WORKERS", "4"))
+    book_chapter_max_tokens: int = int(os.getenv("BOOK_CHAPTER_MAX_TOKENS", "900"))
+    book_chapter_words: int = int(os.getenv("BOOK_CHAPTER_WORDS", "450"))
+
+    # Refinar conversaciones (agents/refine_flow.py): contexto acotado en tokens
+    refine_context_tokens: int = int(os.getenv("REFINE_CONTEXT_TOKENS", "1200"))   # resumen + últimos turnos
+    refine_recent_turns: int = int(os.getenv("REFINE_RECENT_TURNS", "4"))
+    refine_summary_tokens: int = int(os.getenv("REFINE_SUMMARY_TOKENS", "250"))
+
+    # Idempotency-Key en /create (shared/idempotency.py)
+    idempotency_ttl_s: int = int(os.getenv("IDEMPOTENCY_TTL_S", "86400"))     # cuánto se repite la respuesta guardada
+    idempotency_lease_s: int = int(os.getenv("IDEMPOTENCY_LEASE_S", "90"))    # > timeout del Lambda: luego se puede reclamar
+    idempotency_wait_s: float = float(os.getenv("IDEMPOTENCY_WAIT_S", "60"))  # espera de un duplicado a la ejecución en vuelo
+
+    # Plazo por request (shared/deadline.py): Lambdas según el contexto, API con este presupuesto
+    api_request_budget_s: float = float(os.getenv("API_REQUEST_BUDGET_S", "55"))   # 0 = sin plazo
+    deadline_reserve_s: float = float(os.getenv("DEADLINE_RESERVE_S", "2"))         # para responder/flush
+    deadline_assets_reserve_s: float = float(os.getenv("DEADLINE_ASSETS_RESERVE_S", "12"))  # lo que el brief deja a assets
+    deadline_finish_s: float = float(os.getenv("DEADLINE_FINISH_S", "3"))           # lo que assets deja a S3/DynamoDB
+    deadline_min_llm_s: float = float(os.getenv("DEADLINE_MIN_LLM_S", "4"))
+    deadline_min_image_s: float = float(os.getenv("DEADLINE_MIN_IMAGE_S", "6"))
+    deadline_min_render_s: float = float(os.getenv("DEADLINE_MIN_RENDER_S", "3"))
+
+    # /create: lanzar la imagen con el brief parcial (streaming)
+    early_image_enabled: bool = os.getenv("EARLY_IMAGE_ENABLED", "true").lower() == "true"
+
+    # Lotes (/interpret/batch, /design/batch)
+    batch_max_items: int = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+    batch_concurrency: int = int(os.getenv("BATCH_CONCURRENCY", "4"))
+    batch_max_concurrency: int = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+    batch_item_retries: int = int(os.getenv("BATCH_ITEM_RETRIES", "3"))
+
+    # Búsqueda (índice invertido, shared/search.py)
+    search_posting_ttl_s: float = float(os.getenv("SEARCH_POSTING_TTL_S", "60"))
+    search_posting_max: int = int(os.getenv("SEARCH_POSTING_MAX", "512"))
+    search_full_load_max: int = int(os.getenv("SEARCH_FULL_LOAD_MAX", "2000"))
+    # Cache read-through de products/listings (shared/itemcache.py)
+    item_cache_enabled: bool = os.getenv("ITEM_CACHE_ENABLED", "true").lower() == "true"
+    item_cache_ttl_s: float = float(os.getenv("ITEM_CACHE_TTL_S", "300"))
+    item_cache_max: int = int(os.getenv("ITEM_CACHE_MAX", "2048"))
+    item_cache_shared: str = os.getenv("ITEM_CACHE_SHARED", "none").lower()   # none | redis
+    item_cache_redis_url: str = os.getenv("ITEM_CACHE_REDIS_URL", "")
+    # Feed de productos (ETag + cache de páginas)
+    feed_cache_ttl_s: float = float(os.getenv("FEED_CACHE_TTL_S", "30"))
+    feed_cache_max: int = int(os.getenv("FEED_CACHE_MAX", "256"))
+    feed_prefetch_enabled: bool = os.getenv("FEED_PREFETCH_ENABLED", "true").lower() == "true"
+    feed_prefetch_ttl_s: float = float(os.getenv("FEED_PREFETCH_TTL_S", "15"))
+    feed_prefetch_max: int = int(os.getenv("FEED_PREFETCH_MAX", "64"))
+    feed_prefetch_workers: int = int(os.getenv("FEED_PREFETCH_WORKERS", "2"))
+    feed_prefetch_max_active: int = int(os.getenv("FEED_PREFETCH_MAX_ACTIVE", "16"))
+    feed_prefetch_wait_s: float = float(os.getenv("FEED_PREFETCH_WAIT_S", "2"))
+    # Feed público de descubrimiento (shared/discovery.py): tarjetas por bucket de tiempo
+    discovery_bucket_s: int = int(os.getenv("DISCOVERY_BUCKET_S", "86400"))           # ancho de cada partición
+    discovery_retention_days: int = int(os.getenv("DISCOVERY_RETENTION_DAYS", "30"))  # la compactación borra lo anterior
+    discovery_dir_ttl_s: float = float(os.getenv("DISCOVERY_DIR_TTL_S", "30"))        # cache del directorio de buckets
+    discovery_cache_ttl_s: float = float(os.getenv("DISCOVERY_CACHE_TTL_S", "10"))    # páginas renderizadas
+
+    # Export de tablas (shared/export.py, scripts/catalog_export.py, /admin/export)
+    export_prefix: str = os.getenv("EXPORT_PREFIX", "exports")
+    export_format: str = os.getenv("EXPORT_FORMAT", "ndjson").lower()   # ndjson | parquet | auto
+    export_segments: int = int(os.getenv("EXPORT_SEGMENTS", "8"))
+    export_workers: int = int(os.getenv("EXPORT_WORKERS", "8"))
+    export_max_rcu: float = float(os.getenv("EXPORT_MAX_RCU", "200"))     # RCU/s para todo el job; 0 = sin límite
+    export_page_items: int = int(os.getenv("EXPORT_PAGE_ITEMS", "1000"))
+    export_part_items: int = int(os.getenv("EXPORT_PART_ITEMS", "20000"))
+
+    # Observabilidad
+    tracing_enabled: bool = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+    metrics_namespace: str = os.getenv("METRICS_NAMESPACE", "KaiKashi/DreamForge")
+    # Perfilado por request (shared/profiling.py): cabecera X-Profile (admin) o muestreo
+    profile_sample_rate: float = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))     # 0 = sólo con la cabecera
+    profile_prefix: str = os.getenv("PROFILE_PREFIX", "diagnostics/profiles")     # en el bucket de assets
+    profile_interval_ms: float = float(os.getenv("PROFILE_INTERVAL_MS", "5"))     # muestreo de pilas (tiempo real)
+    profile_max_s: float = float(os.getenv("PROFILE_MAX_S", "120"))               # tope del muestreo por request
+
     # Auth
     auth_bypass: bool = os.getenv("AUTH_BYPASS", "true").lower() == "true"
+    admin_token: str = os.getenv("ADMIN_TOKEN", "")   # cabecera X-Admin-Token para /admin/*
     cognito_user_pool_id: str = os.getenv("COGNITO_USER_POOL_ID", "")
     cognito_client_id: str = os.getenv("COGNITO_CLIENT_ID", "")
 
@@ -0,0 +1,40 @@
+from __future__ import annotations
+import threading
+from typing import Dict
+from . import tracing
+
+class Counters:
+    """Contadores por proceso de un grupo (p.ej. `interpret`). Cada `incr` también cuenta en la traza activa."""
+
+    def __init__(self, group: str):
+        self.group = group
+        self._lock = threading.Lock()
+        self._c: Dict[str, int] = {}
+
+    def incr(self, key: str, n: int = 1):
+        with self._lock:
+            self._c[key] = self._c.get(key, 0) + n
+        tracing.count(f"{self.group}.{key}", n)
+
+    def get(self, key: str) -> int:
+        with self._lock:
+            return self._c.get(key, 0)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._c)
+
+_registry: Dict[str, Counters] = {}
+_lock = threading.Lock()
+
+def group(name: str) -> Counters:
+    with _lock:
+        c = _registry.get(name)
+        if c is None:
+            c = _registry[name] = Counters(name)
+        return c
+
+def snapshot_all() -> Dict[str, Dict[str, int]]:
+    with _lock:
+        groups = list(_registry.values())
+    return {c.group: c.snapshot() for c in groups}
@@ -0,0 +1,109 @@
+from __future__ import annotations
+import base64, json
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:  # opcional: si está en el layer se usa para serializar respuestas
+    import orjson as _orjson
+except ImportError:  # pragma: no cover
+    _orjson = None
+
+# ---------- AttributeValue (cliente de bajo nivel) -> Python plano, en una pasada
+
+def _num(s: str) -> Any:
+    try:
+        return int(s)
+    except ValueError:
+        f = float(s)
+        return int(f) if f.is_integer() else f
+
+def _b64(v: Any) -> str:
+    # bytes crudos no son JSON (orjson tampoco los serializa): texto base64
+    return base64.b64encode(v).decode("ascii") if isinstance(v, (bytes, bytearray)) else str(v)
+
+def decode_value(av: Dict[str, Any]) -> Any:
+    """Decodifica un AttributeValue a int/float/str/list/dict/bool/None (sin Decimal; binarios en base64)."""
+    for t, v in av.items():
+        if t == "S":
+            return v
+        if t == "N":
+            return _num(v)
+        if t == "M":
+            return {k: decode_value(x) for k, x in v.items()}
+        if t == "L":
+            return [decode_value(x) for x in v]
+        if t == "BOOL":
+            return v
+        if t == "NULL":
+            return None
+        if t == "SS":
+            return list(v)
+        if t == "NS":
+            return [_num(x) for x in v]
+        if t == "B":
+            return _b64(v)
+        if t == "BS":
+            return [_b64(x) for x in v]
+    return None
+
+def decode_item(item: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if item is None:
+        return None
+    return {k: decode_value(v) for k, v in item.items()}
+
+def decode_items(items: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [{k: decode_value(v) for k, v in it.items()} for it in items]
+
+def encode_value(v: Any) -> Dict[str, Any]:
+    """Claves, cursores, valores de expresiones e items planos (dict/list anidados)."""
+    if isinstance(v, bool):
+        return {"BOOL": v}
+    if isinstance(v, (int, float, Decimal)):
+        return {"N": str(v)}
+    if v is None:
+        return {"NULL": True}
+    if isinstance(v, dict):
+        return {"M": {k: encode_value(x) for k, x in v.items()}}
+    if isinstance(v, (list, tuple)):
+        return {"L": [encode_value(x) for x in v]}
+    return {"S": str(v)}
+
+def encode_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: encode_value(v) for k, v in item.items()}
+
+def encode_key(d: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if not d:
+        return None
+    return {k: encode_value(v) for k, v in d.items()}
+
+def projection(attrs: Iterable[str]) -> Tuple[str, Dict[str, str]]:
+    """ProjectionExpression con placeholders (#p0, #p1, ...) para evitar palabras reservadas."""
+    names: Dict[str, str] = {}
+    parts: List[str] = []
+    for i, a in enumerate(attrs):
+        ph = f"#p{i}"
+        names[ph] = a
+        parts.append(ph)
+    return ", ".join(parts), names
+
+# ---------- JSON compacto
+
+def _default(o: Any) -> Any:
+    if isinstance(o, Decimal):
+        return int(o) if o == o.to_integral_value() else float(o)
+    if isinstance(o, (set, frozenset)):
+        return list(o)
+    if isinstance(o, (bytes, bytearray)):
+        return _b64(o)
+    raise TypeError(f"not JSON serializable: {type(o).__name__}")
+
+def dumps_bytes(obj: Any) -> bytes:
+    if _orjson is not None:
+        return _orjson.dumps(obj, default=_default)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+def dumps(obj: Any) -> str:
+    """JSON compacto (orjson si está disponible). Acepta Decimal de la capa resource."""
+    if _orjson is not None:
+        return _orjson.dumps(obj, default=_default).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_default)
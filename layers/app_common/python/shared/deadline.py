@@ -0,0 +1,72 @@
+from __future__ import annotations
+import contextlib, contextvars, time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Callable, Iterator, Optional
+from . import counters
+from .config import settings
+from .tracing import bind
+
+# Plazo de la request (monotonic) en un contextvar, como la traza y el scope de uso:
+# llega a los hilos del grafo vía `tracing.bind`. Sin scope activo no hay plazo y
+# todo corre como antes (sin hilos extra ni timeouts).
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("deadline", default=None)
+
+# Una llamada que vence sigue en su hilo hasta terminar (boto no se puede abortar);
+# su resultado se descarta. Pool holgado para que esas colas no bloqueen a las nuevas.
+_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="deadline")
+
+class DeadlineExceeded(Exception):
+    """No queda tiempo para la llamada (o venció su timeout)."""
+
+@contextlib.contextmanager
+def scope(seconds: Optional[float]) -> Iterator[None]:
+    """Abre un plazo de `seconds` (menos `DEADLINE_RESERVE_S` para responder). Anidado, gana el más corto."""
+    if seconds is None or seconds <= 0:
+        yield
+        return
+    at = time.monotonic() + max(0.0, seconds - settings.deadline_reserve_s)
+    cur = _deadline.get()
+    token = _deadline.set(at if cur is None else min(cur, at))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def lambda_budget(ctx: Any) -> Optional[float]:
+    """Segundos que le quedan a la invocación (`context.get_remaining_time_in_millis()`)."""
+    fn = getattr(ctx, "get_remaining_time_in_millis", None)
+    if fn is None:
+        return None
+    try:
+        return fn() / 1000.0
+    except Exception:
+        return None
+
+def remaining() -> Optional[float]:
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+def timeout(reserve: float = 0.0) -> Optional[float]:
+    """Tiempo disponible dejando `reserve` segundos para lo que viene después; None sin plazo."""
+    left = remaining()
+    return None if left is None else left - reserve
+
+def has_time(needed: float, reserve: float = 0.0) -> bool:
+    t = timeout(reserve)
+    return t is None or t >= needed
+
+def call(fn: Callable[..., Any], *args: Any, timeout_s: Optional[float], what: str = "call", **kwargs: Any) -> Any:
+    """`fn(*args)` con timeout; sin plazo (None) se llama en línea. Al vencer lanza DeadlineExceeded."""
+    if timeout_s is None:
+        return fn(*args, **kwargs)
+    if timeout_s <= 0:
+        counters.group("deadline").incr(f"{what}.skipped")
+        raise DeadlineExceeded(f"{what}: sin tiempo")
+    fut = _pool.submit(bind(fn), *args, **kwargs)
+    try:
+        return fut.result(timeout=timeout_s)
+    except FutureTimeout:
+        fut.cancel()
+        counters.group("deadline").incr(f"{what}.timeout")
+        raise DeadlineExceeded(f"{what}: sin respuesta en {timeout_s:.1f}s")
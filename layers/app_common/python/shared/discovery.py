@@ -0,0 +1,146 @@
+from __future__ import annotations
+import threading, time
+from typing import Any, Dict, List, Optional, Tuple
+from . import counters
+from .cache import TTLCache
+from .config import settings
+from .dynamo import (
+    delete_feed_bucket, delete_feed_card, get_product, list_feed_buckets, note_feed_bucket, put_feed_card,
+    query_feed_bucket,
+)
+from .tracing import traced
+
+# Feed público "lo último": tabla materializada que se escribe al publicar.
+#   bucket = inicio del tramo de DISCOVERY_BUCKET_S (UTC, "20261019T0000"): las escrituras
+#            cambian de partición con el tiempo en vez de cargar siempre la misma.
+#   sk     = <published_at ms>#<product_id>: dentro del bucket, Query descendente = más nuevo primero.
+# Cada tarjeta trae lo que pinta el feed (título, preview, precio); una página es un Query
+# a un bucket. El directorio de buckets (partición FEED_DIR) se cachea en proceso y la
+# compactación borra los buckets fuera de DISCOVERY_RETENTION_DAYS.
+
+_PREVIEW_EXT = (".png", ".jpg", ".jpeg", ".webp", ".gif", ".svg")
+
+pages = TTLCache(maxsize=128, ttl=settings.discovery_cache_ttl_s)
+_dir = TTLCache(maxsize=1, ttl=settings.discovery_dir_ttl_s)
+_noted: set = set()
+_noted_lock = threading.Lock()
+
+def bucket_of(ts_ms: int) -> str:
+    width = max(60, settings.discovery_bucket_s)
+    start = int(ts_ms) // 1000 // width * width
+    return time.strftime("%Y%m%dT%H%M", time.gmtime(start))
+
+def preview_key(media_keys: List[str]) -> Optional[str]:
+    """La primera imagen (o GIF); si no hay, el primer asset."""
+    for k in media_keys:
+        if k.lower().endswith(_PREVIEW_EXT):
+            return k
+    return media_keys[0] if media_keys else None
+
+def card_for(product: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Tarjeta del product; None si no va al feed (sin `published_at`, sin media o sin listing activa)."""
+    ts = product.get("published_at")
+    keys = product.get("media_keys") or []
+    listing = product.get("listing") or {}
+    if ts is None or not keys or listing.get("status") != "active":
+        return None
+    ts = int(ts)
+    return {
+        "bucket": bucket_of(ts),
+        "sk": f"{ts:013d}#{product['product_id']}",
+        "product_id": product["product_id"],
+        "owner_id": product.get("owner_id"),
+        "title": product.get("title") or "",
+        "product_type": product.get("product_type") or "",
+        "preview_key": preview_key(keys),
+        "price_cents": listing.get("price_cents"),
+        "currency": listing.get("currency"),
+        "published_at": ts,
+    }
+
+def _note(bucket: str):
+    # una escritura al directorio por bucket y proceso, no una por publicación
+    with _noted_lock:
+        if bucket in _noted:
+            return
+    note_feed_bucket(bucket)
+    with _noted_lock:
+        _noted.add(bucket)
+    _dir.pop("dir")
+
+@traced("discovery.publish")
+def publish(product: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Escribe (o reescribe) la tarjeta del product. Devuelve la tarjeta o None si no corresponde."""
+    card = card_for(product)
+    if card is None:
+        return None
+    _note(card["bucket"])
+    put_feed_card(card)
+    counters.group("discovery").incr("published")
+    return card
+
+def unpublish(card: Optional[Dict[str, Any]]):
+    if card:
+        delete_feed_card(card["bucket"], card["sk"])
+
+@traced("discovery.refresh")
+def refresh(product_id: str) -> Optional[Dict[str, Any]]:
+    """Tras editar un product: reescribe su tarjeta (misma clave, `published_at` no cambia)."""
+    p = get_product(product_id)
+    if not p or p.get("published_at") is None:
+        return None
+    card = card_for(p)
+    if card is None:
+        ts = int(p["published_at"])
+        delete_feed_card(bucket_of(ts), f"{ts:013d}#{product_id}")
+        return None
+    put_feed_card(card)
+    return card
+
+def buckets() -> List[str]:
+    cached = _dir.get("dir")
+    if cached is None:
+        cached = list_feed_buckets()
+        _dir.set("dir", cached)
+    return cached
+
+@traced("discovery.page")
+def page(limit: int, cursor: Optional[Dict[str, Any]] = None) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Un Query por página. El cursor es {"b": bucket, "k": último sk}; al agotar un bucket
+    sigue por el anterior del directorio, así una página no cruza buckets y puede venir
+    corta en el borde. Devuelve (tarjetas, cursor siguiente o None).
+    """
+    counters.group("discovery").incr("pages")
+    if isinstance(cursor, dict) and cursor.get("b"):
+        bucket, after = str(cursor["b"]), cursor.get("k") if isinstance(cursor.get("k"), str) else None
+    else:
+        known = buckets()
+        if not known:
+            return [], None
+        bucket, after = known[0], None
+    cards, last = query_feed_bucket(bucket, limit, after)
+    if last:
+        return cards, {"b": bucket, "k": last}
+    older = next((b for b in buckets() if b < bucket), None)
+    return cards, ({"b": older} if older else None)
+
+@traced("discovery.compact")
+def compact(now_ms: Optional[int] = None, retention_days: Optional[int] = None,
+            dry_run: bool = False) -> Dict[str, Any]:
+    """Borra los buckets que terminaron antes de la retención. Idempotente: si se corta, se relanza."""
+    stats = counters.group("discovery")
+    now_ms = int(time.time() * 1000) if now_ms is None else int(now_ms)
+    days = settings.discovery_retention_days if retention_days is None else int(retention_days)
+    cutoff = bucket_of(now_ms - days * 86400 * 1000)
+    known = list_feed_buckets()
+    old = [b for b in known if b < cutoff]
+    dropped = 0
+    if not dry_run:
+        for b in old:
+            dropped += delete_feed_bucket(b)
+            stats.incr("buckets_dropped")
+        stats.incr("cards_dropped", dropped)
+        _dir.pop("dir")
+    return {"cutoff": cutoff, "buckets": len(known), "dropped_buckets": old, "dropped_cards": dropped,
+            "dry_run": dry_run}
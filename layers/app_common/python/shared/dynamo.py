@@ -1,27 +1,356 @@
 from __future__ import annotations
 import uuid, time
+from decimal import Decimal
 from typing import Dict, Any, List, Optional, Tuple
-from boto3.dynamodb.conditions import Attr
-from .aws import dynamodb_resource
+from boto3.dynamodb.conditions import Key
+from .aws import dynamodb_client, dynamodb_resource
+from . import ddbjson
 from .config import settings
+from .itemcache import ItemCache, make_shared_tier
+from .tracing import traced
 
 ddb = dynamodb_resource()
+ddb_client = dynamodb_client()
 tbl_products = ddb.Table(settings.ddb_products)
 tbl_listings = ddb.Table(settings.ddb_listings)
 tbl_convs    = ddb.Table(settings.ddb_conversations)
 tbl_msgs     = ddb.Table(settings.ddb_messages)
+tbl_users    = ddb.Table(settings.ddb_users)
+tbl_usage    = ddb.Table(settings.ddb_usage)
+tbl_rate     = ddb.Table(settings.ddb_rate_limits)
+tbl_idem     = ddb.Table(settings.ddb_idempotency)
 
 def new_id(prefix: str) -> str:
     return f"{prefix}_{uuid.uuid4().hex[:12]}"
 
-def put_product(item: Dict[str, Any]): tbl_products.put_item(Item=item)
+@traced("ddb.batch_get")
+def batch_get(table: str, key_attr: str, ids: List[str], attempts: int = 5) -> Dict[str, Dict[str, Any]]:
+    """
+    BatchGetItem en bloques de 100 con lectura consistente (lo leído se cachea), reintentando
+    UnprocessedKeys con backoff. Devuelve {id: item} en tipos planos; los ids inexistentes no aparecen.
+    """
+    out: Dict[str, Dict[str, Any]] = {}
+    for i in range(0, len(ids), 100):
+        req: Dict[str, Any] = {table: {"Keys": [ddbjson.encode_key({key_attr: x}) for x in ids[i:i + 100]],
+                                       "ConsistentRead": True}}
+        for attempt in range(attempts):
+            resp = ddb_client.batch_get_item(RequestItems=req)
+            for it in ddbjson.decode_items(resp.get("Responses", {}).get(table, [])):
+                out[it[key_attr]] = it
+            req = resp.get("UnprocessedKeys") or {}
+            if not req:
+                break
+            time.sleep(min(1.0, 0.05 * (2 ** attempt)))
+    return out
+
+# Products y listings casi no cambian tras publicarse: lectura por clave vía cache.
+_shared_tier = make_shared_tier()
+products_cache = ItemCache("product", lambda ids: batch_get(settings.ddb_products, "product_id", ids),
+                           maxsize=settings.item_cache_max, ttl=settings.item_cache_ttl_s, shared=_shared_tier)
+listings_cache = ItemCache("listing", lambda ids: batch_get(settings.ddb_listings, "listing_id", ids),
+                           maxsize=settings.item_cache_max, ttl=settings.item_cache_ttl_s, shared=_shared_tier)
+
+@traced("ddb.put_product")
+def put_product(item: Dict[str, Any]):
+    tbl_products.put_item(Item=item)
+    products_cache.invalidate(item.get("product_id"))
+
 def get_product(product_id: str) -> Dict[str, Any] | None:
-    r = tbl_products.get_item(Key={"product_id": product_id}); return r.get("Item")
+    return products_cache.get(product_id)
+
+def get_products(product_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    return products_cache.get_many(product_ids)
+
+@traced("ddb.put_listing")
+def put_listing(item: Dict[str, Any]):
+    tbl_listings.put_item(Item=item)
+    listings_cache.invalidate(item.get("listing_id"))
+
+def get_listing(listing_id: str) -> Dict[str, Any] | None:
+    return listings_cache.get(listing_id)
+
+def get_listings(listing_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    return listings_cache.get_many(listing_ids)
+
+def _scan_active_listings(product_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Listings activas de products sin resumen `listing` (anteriores al resumen): no hay índice
+    por product_id, así que un Scan paginado filtrando por el lote (IN, hasta 100). Devuelve
+    `{pid: {"items": [...]}}` también para los que no tienen ninguna: el "no hay" queda en cache.
+    """
+    out: Dict[str, Dict[str, Any]] = {pid: {"items": []} for pid in product_ids}
+    for i in range(0, len(product_ids), 100):
+        chunk = product_ids[i:i + 100]
+        values: Dict[str, Any] = {":a": {"S": "active"}}
+        values.update({f":p{j}": {"S": pid} for j, pid in enumerate(chunk)})
+        kwargs: Dict[str, Any] = {
+            "TableName": settings.ddb_listings,
+            "FilterExpression": f"#st = :a AND #pid IN ({', '.join(f':p{j}' for j in range(len(chunk)))})",
+            "ExpressionAttributeNames": {"#st": "status", "#pid": "product_id"},
+            "ExpressionAttributeValues": values,
+        }
+        while True:
+            resp = ddb_client.scan(**kwargs)
+            for it in ddbjson.decode_items(resp.get("Items", [])):
+                out[it["product_id"]]["items"].append(it)
+            if not resp.get("LastEvaluatedKey"):
+                break
+            kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+    return out
+
+product_listings_cache = ItemCache("product_listings", _scan_active_listings,
+                                   maxsize=settings.item_cache_max, ttl=settings.item_cache_ttl_s, shared=_shared_tier)
+
+@traced("ddb.listing_lookup")
+def get_active_listings_by_product(product_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """Listings activas por product, vía cache (un Scan por lote de products que falten)."""
+    return {pid: v.get("items") or [] for pid, v in product_listings_cache.get_many(product_ids).items()}
+
+@traced("ddb.product_media")
+def set_product_media(product_id: str, media_keys: List[str], published_at: Optional[int] = None):
+    """`published_at` (ms): momento en que el product entra al feed público (clave de su tarjeta)."""
+    values: Dict[str, Any] = {":m": media_keys}
+    expr = "SET media_keys = :m"
+    if published_at is not None:
+        values[":t"] = int(published_at)
+        expr += ", published_at = :t"
+    tbl_products.update_item(
+        Key={"product_id": product_id},
+        UpdateExpression=expr,
+        ExpressionAttributeValues=values,
+    )
+    products_cache.invalidate(product_id)
+
+@traced("ddb.update_product")
+def update_product(product_id: str, changes: Dict[str, Any]):
+    """SET de varios campos del product en una escritura (p.ej. al refinar: título, tags, media)."""
+    if not changes:
+        return
+    names = {f"#f{i}": k for i, k in enumerate(changes)}
+    values = {f":v{i}": _ddb_num(v) for i, v in enumerate(changes.values())}
+    tbl_products.update_item(
+        Key={"product_id": product_id},
+        UpdateExpression="SET " + ", ".join(f"#f{i} = :v{i}" for i in range(len(changes))),
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values,
+    )
+    products_cache.invalidate(product_id)
+
+# Campos de la listing que se copian al product (`product.listing`) para que el feed
+# pinte producto + precio con una sola lectura.
+LISTING_SUMMARY_FIELDS = ("listing_id", "price_cents", "currency", "status")
+
+def listing_summary(listing: Dict[str, Any]) -> Dict[str, Any]:
+    out = {k: listing.get(k) for k in LISTING_SUMMARY_FIELDS}
+    out["stage"] = (listing.get("metadata") or {}).get("stage")
+    return out
+
+@traced("ddb.publish")
+def publish_product_listing(product: Dict[str, Any], listing: Dict[str, Any]):
+    """
+    Product (con el resumen de su listing) + listing en un solo TransactWriteItems:
+    atómico y en un viaje. Falla si cualquiera de los dos ids ya existe.
+    """
+    item = {**product, "listing": listing_summary(listing)}
+    ddb_client.transact_write_items(TransactItems=[
+        {"Put": {"TableName": settings.ddb_products, "Item": ddbjson.encode_item(item),
+                 "ConditionExpression": "attribute_not_exists(product_id)"}},
+        {"Put": {"TableName": settings.ddb_listings, "Item": ddbjson.encode_item(listing),
+                 "ConditionExpression": "attribute_not_exists(listing_id)"}},
+    ])
+    products_cache.invalidate(product["product_id"])
+    listings_cache.invalidate(listing["listing_id"])
+    product_listings_cache.invalidate(product["product_id"])
+
+@traced("ddb.update_listing")
+def update_listing(listing_id: str, product_id: str, changes: Dict[str, Any]):
+    """
+    Actualiza campos de la listing y, en la misma transacción, los del resumen en
+    `product.listing` (sólo si ese resumen es de esta listing). Products publicados
+    antes del resumen no lo tienen: en ese caso se actualiza sólo la listing.
+    """
+    if not changes:
+        return
+    try:
+        _update_listing(listing_id, product_id, changes)
+    finally:
+        listings_cache.invalidate(listing_id)
+        products_cache.invalidate(product_id)
+        product_listings_cache.invalidate(product_id)
+
+def _update_listing(listing_id: str, product_id: str, changes: Dict[str, Any]):
+    l_names: Dict[str, str] = {}
+    l_values: Dict[str, Any] = {}
+    l_sets: List[str] = []
+    for i, (k, v) in enumerate(changes.items()):
+        l_names[f"#f{i}"] = k
+        l_values[f":v{i}"] = ddbjson.encode_value(v)
+        l_sets.append(f"#f{i} = :v{i}")
+    listing_update = {
+        "TableName": settings.ddb_listings,
+        "Key": ddbjson.encode_key({"listing_id": listing_id}),
+        "UpdateExpression": "SET " + ", ".join(l_sets),
+        "ConditionExpression": "attribute_exists(listing_id)",
+        "ExpressionAttributeNames": l_names,
+        "ExpressionAttributeValues": l_values,
+    }
+
+    summary = {k: v for k, v in changes.items() if k in LISTING_SUMMARY_FIELDS and k != "listing_id"}
+    if isinstance(changes.get("metadata"), dict) and "stage" in changes["metadata"]:
+        summary["stage"] = changes["metadata"]["stage"]
+    if not summary:
+        ddb_client.update_item(**listing_update)
+        return
+    p_names: Dict[str, str] = {"#l": "listing", "#lid": "listing_id"}
+    p_values: Dict[str, Any] = {":lid": {"S": listing_id}}
+    p_sets: List[str] = []
+    for i, (k, v) in enumerate(summary.items()):
+        p_names[f"#s{i}"] = k
+        p_values[f":s{i}"] = ddbjson.encode_value(v)
+        p_sets.append(f"#l.#s{i} = :s{i}")
+    try:
+        ddb_client.transact_write_items(TransactItems=[
+            {"Update": listing_update},
+            {"Update": {
+                "TableName": settings.ddb_products,
+                "Key": ddbjson.encode_key({"product_id": product_id}),
+                "UpdateExpression": "SET " + ", ".join(p_sets),
+                "ConditionExpression": "#l.#lid = :lid",
+                "ExpressionAttributeNames": p_names,
+                "ExpressionAttributeValues": p_values,
+            }},
+        ])
+    except ddb_client.exceptions.TransactionCanceledException as e:
+        reasons = e.response.get("CancellationReasons") or []
+        if len(reasons) > 1 and reasons[0].get("Code") in (None, "None") \
+                and reasons[1].get("Code") == "ConditionalCheckFailed":
+            ddb_client.update_item(**listing_update)
+        else:
+            raise
+
+# ---------- índice invertido de búsqueda: (token, product_id) -> w, ts; (token, "#") -> n
 
-def put_listing(item: Dict[str, Any]): tbl_listings.put_item(Item=item)
+SEARCH_COUNT_SK = "#"
+
+@traced("ddb.search_put")
+def put_postings(postings: List[Dict[str, Any]]):
+    """Escribe postings {token, product_id, w, ts} con BatchWriteItem (25 por petición)."""
+    for i in range(0, len(postings), 25):
+        req = {settings.ddb_search: [{"PutRequest": {"Item": ddbjson.encode_item(p)}} for p in postings[i:i + 25]]}
+        for attempt in range(5):
+            resp = ddb_client.batch_write_item(RequestItems=req)
+            req = resp.get("UnprocessedItems") or {}
+            if not req:
+                break
+            time.sleep(min(1.0, 0.05 * (2 ** attempt)))
+
+@traced("ddb.search_delete")
+def delete_postings(token_pids: List[Tuple[str, str]]):
+    for i in range(0, len(token_pids), 25):
+        req = {settings.ddb_search: [
+            {"DeleteRequest": {"Key": ddbjson.encode_key({"token": t, "product_id": p})}}
+            for t, p in token_pids[i:i + 25]
+        ]}
+        for attempt in range(5):
+            resp = ddb_client.batch_write_item(RequestItems=req)
+            req = resp.get("UnprocessedItems") or {}
+            if not req:
+                break
+            time.sleep(min(1.0, 0.05 * (2 ** attempt)))
+
+@traced("ddb.search_count")
+def add_token_counts(deltas: Dict[str, int]):
+    """ADD sobre el item contador de cada token (tamaño del posting list)."""
+    for token, n in deltas.items():
+        ddb_client.update_item(
+            TableName=settings.ddb_search,
+            Key=ddbjson.encode_key({"token": token, "product_id": SEARCH_COUNT_SK}),
+            UpdateExpression="ADD n :n",
+            ExpressionAttributeValues={":n": {"N": str(int(n))}},
+        )
+
+@traced("ddb.search_counts")
+def get_token_counts(tokens: List[str]) -> Dict[str, int]:
+    out = {t: 0 for t in tokens}
+    keys = [ddbjson.encode_key({"token": t, "product_id": SEARCH_COUNT_SK}) for t in tokens]
+    for i in range(0, len(keys), 100):
+        req: Dict[str, Any] = {settings.ddb_search: {"Keys": keys[i:i + 100]}}
+        while req:
+            resp = ddb_client.batch_get_item(RequestItems=req)
+            for it in ddbjson.decode_items(resp.get("Responses", {}).get(settings.ddb_search, [])):
+                out[it["token"]] = int(it.get("n") or 0)
+            req = resp.get("UnprocessedKeys") or {}
+            if req:
+                time.sleep(0.05)
+    return out
+
+@traced("ddb.search_query")
+def query_posting(token: str) -> List[Dict[str, Any]]:
+    """Posting list completo de un token (Query paginado, sin el item contador)."""
+    out: List[Dict[str, Any]] = []
+    kw: Dict[str, Any] = {
+        "TableName": settings.ddb_search,
+        "KeyConditionExpression": "#t = :t",
+        "ExpressionAttributeNames": {"#t": "token", "#p": "product_id", "#w": "w", "#ts": "ts"},
+        "ExpressionAttributeValues": {":t": {"S": token}},
+        "ProjectionExpression": "#p, #w, #ts",
+    }
+    while True:
+        resp = ddb_client.query(**kw)
+        out.extend(it for it in ddbjson.decode_items(resp.get("Items", [])) if it["product_id"] != SEARCH_COUNT_SK)
+        lek = resp.get("LastEvaluatedKey")
+        if not lek:
+            return out
+        kw["ExclusiveStartKey"] = lek
+
+@traced("ddb.search_probe")
+def get_postings(token: str, product_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Postings concretos (token, pid) por clave: comprobar candidatos sin leer el posting list entero."""
+    out: Dict[str, Dict[str, Any]] = {}
+    keys = [ddbjson.encode_key({"token": token, "product_id": p}) for p in product_ids]
+    for i in range(0, len(keys), 100):
+        req: Dict[str, Any] = {settings.ddb_search: {"Keys": keys[i:i + 100]}}
+        while req:
+            resp = ddb_client.batch_get_item(RequestItems=req)
+            for it in ddbjson.decode_items(resp.get("Responses", {}).get(settings.ddb_search, [])):
+                out[it["product_id"]] = it
+            req = resp.get("UnprocessedKeys") or {}
+            if req:
+                time.sleep(0.05)
+    return out
+
+@traced("ddb.delete_product")
+def delete_product(product_id: str):
+    tbl_products.delete_item(Key={"product_id": product_id})
+    products_cache.invalidate(product_id)
+@traced("ddb.delete_listing")
+def delete_listing(listing_id: str):
+    tbl_listings.delete_item(Key={"listing_id": listing_id})
+    listings_cache.invalidate(listing_id)
 
 def _now_ms_str() -> str: return f"{int(time.time() * 1000):013d}"
 
+@traced("ddb.feed_version_bump")
+def bump_feed_version(owner_id: str) -> int:
+    """Incrementa la versión del feed del owner (invalida ETags y páginas cacheadas)."""
+    r = tbl_users.update_item(
+        Key={"user_id": owner_id},
+        UpdateExpression="ADD feed_version :one",
+        ExpressionAttributeValues={":one": 1},
+        ReturnValues="UPDATED_NEW",
+    )
+    return int(r["Attributes"]["feed_version"])
+
+@traced("ddb.feed_version")
+def get_feed_version(owner_id: str) -> int:
+    r = tbl_users.get_item(
+        Key={"user_id": owner_id},
+        ProjectionExpression="feed_version",
+        ConsistentRead=True,
+    )
+    return int((r.get("Item") or {}).get("feed_version", 0))
+
+@traced("ddb.ensure_conversation")
 def ensure_conversation(conversation_id: str, user_id: str, model_id: str, title: str="Nueva conversación"):
     now_str = _now_ms_str()
     item = {
@@ -40,6 +369,7 @@ def ensure_conversation(conversation_id: str, user_id: str, model_id: str, title
         pass
     return item
 
+@traced("ddb.touch_conversation")
 def touch_conversation(conversation_id: str):
     now_str = _now_ms_str()
     tbl_convs.update_item(
@@ -48,6 +378,18 @@ def touch_conversation(conversation_id: str):
         ExpressionAttributeValues={":t": now_str},
     )
 
+@traced("ddb.get_conversation")
+def get_conversation(conversation_id: str, attributes: Optional[Tuple[str, ...]] = None) -> Optional[Dict[str, Any]]:
+    """Conversación en tipos planos (sin Decimal); `attributes` limita la proyección."""
+    kwargs: Dict[str, Any] = {"TableName": settings.ddb_conversations,
+                              "Key": ddbjson.encode_key({"conversation_id": conversation_id})}
+    if attributes:
+        pe, names = ddbjson.projection(attributes)
+        kwargs["ProjectionExpression"] = pe
+        kwargs["ExpressionAttributeNames"] = names
+    return ddbjson.decode_item(ddb_client.get_item(**kwargs).get("Item"))
+
+@traced("ddb.put_message")
 def put_message(conversation_id: str, role: str, content: str, media_keys=None, tool_calls=None, message_id=None):
     message_id = message_id or new_id("msg")
     created_at = _now_ms_str()
@@ -64,6 +406,31 @@ def put_message(conversation_id: str, role: str, content: str, media_keys=None,
     touch_conversation(conversation_id)
     return item
 
+@traced("ddb.list_messages")
+def list_messages(conversation_id: str, after: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Mensajes de la conversación en orden, sólo los posteriores a `after` (created_at) si viene."""
+    names = {"#c": "conversation_id"}
+    values: Dict[str, Any] = {":c": {"S": conversation_id}}
+    kce = "#c = :c"
+    if after:
+        names["#t"] = "created_at"
+        values[":t"] = {"S": after}
+        kce += " AND #t > :t"
+    kw: Dict[str, Any] = {"TableName": settings.ddb_messages, "KeyConditionExpression": kce,
+                          "ExpressionAttributeNames": names, "ExpressionAttributeValues": values}
+    out: List[Dict[str, Any]] = []
+    while True:
+        resp = ddb_client.query(**kw)
+        out.extend(ddbjson.decode_items(resp.get("Items", [])))
+        lek = resp.get("LastEvaluatedKey")
+        if not lek:
+            return out
+        kw["ExclusiveStartKey"] = lek
+
+# Atributos que pinta el feed; el resto del item no viaja por la red.
+FEED_PRODUCT_ATTRS = ("product_id", "owner_id", "title", "description", "status", "media_keys", "listing")
+
+@traced("ddb.list_products")
 def list_products_by_owner(
     owner_id: str,
     *,
@@ -71,22 +438,249 @@ def list_products_by_owner(
     cursor: Optional[Dict[str, Any]] = None,
     status: Optional[str] = None,
     require_media: bool = True,
+    attributes: Optional[Tuple[str, ...]] = FEED_PRODUCT_ATTRS,
 ) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
     """
     Escanea products del owner con paginación.
     - Si require_media=True, filtra productos con media_keys no vacía (lado servidor).
     - Si status viene (e.g. 'draft' | 'active'), también filtra por status.
-    Devuelve (items, LastEvaluatedKey).
+    - `attributes` limita el ProjectionExpression (None = item completo).
+    Va por el cliente de bajo nivel y decodifica a tipos planos (sin Decimal).
+    Devuelve (items, LastEvaluatedKey) con el cursor también en formato plano.
     """
-    scan_kwargs: Dict[str, Any] = {"Limit": limit}
-    fe = Attr("owner_id").eq(owner_id)
+    names: Dict[str, str] = {"#o": "owner_id"}
+    values: Dict[str, Any] = {":o": {"S": owner_id}}
+    fe = "#o = :o"
     if status:
-        fe = fe & Attr("status").eq(status)
+        names["#s"] = "status"
+        values[":s"] = {"S": status}
+        fe += " AND #s = :s"
     if require_media:
-        fe = fe & Attr("media_keys").size().gt(0)  # media_keys con al menos 1 elemento
-    scan_kwargs["FilterExpression"] = fe
+        names["#m"] = "media_keys"
+        values[":z"] = {"N": "0"}
+        fe += " AND size(#m) > :z"  # media_keys con al menos 1 elemento
+    scan_kwargs: Dict[str, Any] = {
+        "TableName": settings.ddb_products,
+        "Limit": limit,
+        "FilterExpression": fe,
+        "ExpressionAttributeValues": values,
+    }
+    if attributes:
+        pe, pnames = ddbjson.projection(attributes)
+        names.update(pnames)
+        scan_kwargs["ProjectionExpression"] = pe
+    scan_kwargs["ExpressionAttributeNames"] = names
     if cursor:
-        scan_kwargs["ExclusiveStartKey"] = cursor
+        scan_kwargs["ExclusiveStartKey"] = ddbjson.encode_key(cursor)
+
+    resp = ddb_client.scan(**scan_kwargs)
+    return ddbjson.decode_items(resp.get("Items", [])), ddbjson.decode_item(resp.get("LastEvaluatedKey"))
+
+def _ddb_num(x: Any) -> Any:
+    if isinstance(x, float):
+        return Decimal(str(x))
+    if isinstance(x, dict):
+        return {k: _ddb_num(v) for k, v in x.items()}
+    if isinstance(x, list):
+        return [_ddb_num(v) for v in x]
+    return x
+
+@traced("ddb.conversation_meta")
+def set_conversation_meta(conversation_id: str, key: str, value: Any):
+    """Guarda `meta.<key>` en la conversación (p.ej. timings de la request)."""
+    tbl_convs.update_item(
+        Key={"conversation_id": conversation_id},
+        UpdateExpression="SET meta.#k = :v",
+        ExpressionAttributeNames={"#k": key},
+        ExpressionAttributeValues={":v": _ddb_num(value)},
+    )
+
+@traced("ddb.usage_add")
+def add_usage_counters(scope_id: str, period: str, counters: Dict[str, int]):
+    """ADD atómico de varios contadores sobre (scope_id, period) en una sola escritura."""
+    names: Dict[str, str] = {}
+    values: Dict[str, Any] = {}
+    parts: List[str] = []
+    for i, (k, v) in enumerate(sorted(counters.items())):
+        names[f"#c{i}"] = k
+        values[f":c{i}"] = int(v)
+        parts.append(f"#c{i} :c{i}")
+    if not parts:
+        return
+    tbl_usage.update_item(
+        Key={"scope_id": scope_id, "period": period},
+        UpdateExpression="ADD " + ", ".join(parts),
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values,
+    )
+
+@traced("ddb.usage_get")
+def get_usage_items(scope_id: str) -> List[Dict[str, Any]]:
+    resp = tbl_usage.query(KeyConditionExpression=Key("scope_id").eq(scope_id))
+    return resp.get("Items", [])
+
+@traced("ddb.rate_get")
+def get_rate_bucket(bucket_id: str) -> Dict[str, Any] | None:
+    r = tbl_rate.get_item(Key={"bucket_id": bucket_id}, ConsistentRead=True)
+    return r.get("Item")
+
+@traced("ddb.rate_put")
+def put_rate_bucket(bucket_id: str, tokens: float, ts: float, expected_ts: Optional[float], force: bool = False) -> bool:
+    """
+    Escribe el estado del bucket sólo si nadie lo cambió desde la lectura (`ts` esperado).
+    Devuelve False si perdió la carrera.
+    """
+    kwargs: Dict[str, Any] = {
+        "Item": {"bucket_id": bucket_id, "tokens": Decimal(str(round(tokens, 6))), "ts": Decimal(str(round(ts, 6)))},
+    }
+    if not force:
+        if expected_ts is None:
+            kwargs["ConditionExpression"] = "attribute_not_exists(bucket_id)"
+        else:
+            kwargs["ConditionExpression"] = "ts = :old"
+            kwargs["ExpressionAttributeValues"] = {":old": Decimal(str(round(expected_ts, 6)))}
+    try:
+        tbl_rate.put_item(**kwargs)
+        return True
+    except tbl_rate.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
 
-    resp = tbl_products.scan(**scan_kwargs)
-    return resp.get("Items", []), resp.get("LastEvaluatedKey")
+# ---------- Idempotency-Key (ver shared/idempotency.py)
+
+@traced("ddb.idem_claim")
+def claim_idempotency(idem_key: str, fingerprint: str, owner: str, now: float, lease_s: float,
+                      ttl_s: float) -> Optional[Dict[str, Any]]:
+    """
+    Reclama la key con una escritura condicional: libre, vencida (TTL aún no barrido) o
+    en vuelo con el lease vencido. None si es nuestra; si no, el registro actual.
+    """
+    try:
+        tbl_idem.put_item(
+            Item={"idem_key": idem_key, "fingerprint": fingerprint, "status": "in_flight", "owner": owner,
+                  "lease_until": int(now + lease_s), "expires_at": int(now + ttl_s)},
+            ConditionExpression="attribute_not_exists(idem_key) OR expires_at < :now "
+                                "OR (#s = :f AND lease_until < :now)",
+            ExpressionAttributeNames={"#s": "status"},
+            ExpressionAttributeValues={":now": int(now), ":f": "in_flight"},
+        )
+        return None
+    except tbl_idem.meta.client.exceptions.ConditionalCheckFailedException:
+        r = tbl_idem.get_item(Key={"idem_key": idem_key}, ConsistentRead=True)
+        return r.get("Item") or {}
+
+@traced("ddb.idem_get")
+def get_idempotency(idem_key: str) -> Optional[Dict[str, Any]]:
+    return tbl_idem.get_item(Key={"idem_key": idem_key}, ConsistentRead=True).get("Item")
+
+@traced("ddb.idem_complete")
+def complete_idempotency(idem_key: str, owner: str, response: str, expires_at: float) -> bool:
+    """Guarda la respuesta si la key sigue siendo nuestra. False si otro la reclamó (lease vencido)."""
+    try:
+        tbl_idem.update_item(
+            Key={"idem_key": idem_key},
+            UpdateExpression="SET #s = :d, #r = :r, expires_at = :e REMOVE lease_until",
+            ConditionExpression="#o = :o",
+            ExpressionAttributeNames={"#s": "status", "#r": "response", "#o": "owner"},
+            ExpressionAttributeValues={":d": "done", ":r": response, ":e": int(expires_at), ":o": owner},
+        )
+        return True
+    except tbl_idem.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+
+@traced("ddb.idem_release")
+def release_idempotency(idem_key: str, owner: str):
+    """La ejecución falló: se libera la key para que el reintento corra de nuevo."""
+    try:
+        tbl_idem.delete_item(
+            Key={"idem_key": idem_key},
+            ConditionExpression="#o = :o",
+            ExpressionAttributeNames={"#o": "owner"},
+            ExpressionAttributeValues={":o": owner},
+        )
+    except tbl_idem.meta.client.exceptions.ConditionalCheckFailedException:
+        pass
+
+# ---------- feed público: (bucket, sk = <ms>#<product_id>) -> tarjeta; (FEED_DIR, bucket) -> directorio
+
+FEED_DIR = "#buckets"
+
+@traced("ddb.feed_put")
+def put_feed_card(card: Dict[str, Any]):
+    ddb_client.put_item(TableName=settings.ddb_public_feed, Item=ddbjson.encode_item(card))
+
+@traced("ddb.feed_delete")
+def delete_feed_card(bucket: str, sk: str):
+    ddb_client.delete_item(TableName=settings.ddb_public_feed, Key=ddbjson.encode_key({"bucket": bucket, "sk": sk}))
+
+@traced("ddb.feed_note_bucket")
+def note_feed_bucket(bucket: str):
+    ddb_client.put_item(TableName=settings.ddb_public_feed,
+                        Item=ddbjson.encode_item({"bucket": FEED_DIR, "sk": bucket}))
+
+@traced("ddb.feed_buckets")
+def list_feed_buckets() -> List[str]:
+    """Buckets con tarjetas, del más nuevo al más viejo (el directorio es chico: uno por bucket retenido)."""
+    out: List[str] = []
+    kw: Dict[str, Any] = {
+        "TableName": settings.ddb_public_feed,
+        "KeyConditionExpression": "#b = :d",
+        "ExpressionAttributeNames": {"#b": "bucket", "#k": "sk"},
+        "ExpressionAttributeValues": {":d": {"S": FEED_DIR}},
+        "ProjectionExpression": "#k",
+        "ScanIndexForward": False,
+    }
+    while True:
+        resp = ddb_client.query(**kw)
+        out.extend(it["sk"] for it in ddbjson.decode_items(resp.get("Items", [])))
+        lek = resp.get("LastEvaluatedKey")
+        if not lek:
+            return out
+        kw["ExclusiveStartKey"] = lek
+
+@traced("ddb.feed_query")
+def query_feed_bucket(bucket: str, limit: int, after: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Una página de un bucket, más nuevas primero. Devuelve (tarjetas, sk para seguir o None)."""
+    kw: Dict[str, Any] = {
+        "TableName": settings.ddb_public_feed,
+        "KeyConditionExpression": "#b = :b",
+        "ExpressionAttributeNames": {"#b": "bucket"},
+        "ExpressionAttributeValues": {":b": {"S": bucket}},
+        "ScanIndexForward": False,
+        "Limit": limit,
+    }
+    if after:
+        kw["ExclusiveStartKey"] = ddbjson.encode_key({"bucket": bucket, "sk": after})
+    resp = ddb_client.query(**kw)
+    lek = ddbjson.decode_item(resp.get("LastEvaluatedKey"))
+    return ddbjson.decode_items(resp.get("Items", [])), (lek or {}).get("sk")
+
+@traced("ddb.feed_drop_bucket")
+def delete_feed_bucket(bucket: str) -> int:
+    """Borra las tarjetas del bucket y luego su entrada del directorio. Devuelve cuántas tarjetas."""
+    n = 0
+    kw: Dict[str, Any] = {
+        "TableName": settings.ddb_public_feed,
+        "KeyConditionExpression": "#b = :b",
+        "ExpressionAttributeNames": {"#b": "bucket", "#k": "sk"},
+        "ExpressionAttributeValues": {":b": {"S": bucket}},
+        "ProjectionExpression": "#b, #k",
+    }
+    while True:
+        resp = ddb_client.query(**kw)
+        keys = resp.get("Items", [])
+        for i in range(0, len(keys), 25):
+            req = {settings.ddb_public_feed: [{"DeleteRequest": {"Key": k}} for k in keys[i:i + 25]]}
+            for attempt in range(5):
+                out = ddb_client.batch_write_item(RequestItems=req)
+                req = out.get("UnprocessedItems") or {}
+                if not req:
+                    break
+                time.sleep(min(1.0, 0.05 * (2 ** attempt)))
+        n += len(keys)
+        lek = resp.get("LastEvaluatedKey")
+        if not lek:
+            break
+        kw["ExclusiveStartKey"] = lek
+    # el directorio al final: si se corta a medias, la próxima compactación lo retoma
+    delete_feed_card(FEED_DIR, bucket)
+    return n
@@ -0,0 +1,376 @@
+from __future__ import annotations
+import gzip, json, os, tempfile, threading, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from . import counters, ddbjson
+from .admission import MemoryBuckets
+from .aws import s3_client
+from .config import settings
+from .dynamo import ddb_client
+
+# Export completo de tablas con Scan paralelo (Segment/TotalSegments).
+#
+# Cada segmento es un generador de páginas -> items -> partes comprimidas; en memoria
+# sólo hay una página (y, en Parquet, una parte). El estado (`_state.json` en el
+# destino) guarda por segmento el LastEvaluatedKey del final de la última parte
+# escrita: relanzar con el mismo destino sigue desde ahí y reescribe, como mucho, la
+# parte que quedó a medias.
+
+def export_tables() -> Dict[str, str]:
+    return {
+        "products": settings.ddb_products,
+        "listings": settings.ddb_listings,
+        "conversations": settings.ddb_conversations,
+        "messages": settings.ddb_messages,
+    }
+
+def have_parquet() -> bool:
+    try:
+        import pyarrow  # noqa: F401  (opcional)
+        return True
+    except ImportError:
+        return False
+
+def resolve_format(fmt: Optional[str]) -> str:
+    fmt = (fmt or settings.export_format).lower()
+    if fmt == "auto":
+        return "parquet" if have_parquet() else "ndjson"
+    if fmt == "parquet" and not have_parquet():
+        raise ValueError("format=parquet requiere pyarrow (pip install pyarrow)")
+    if fmt not in ("ndjson", "parquet"):
+        raise ValueError(f"formato no soportado: {fmt}")
+    return fmt
+
+# ---------- destinos
+
+class LocalSink:
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def url(self, rel: str = "") -> str:
+        return os.path.join(self.root, rel)
+
+    def tmp_path(self, rel: str) -> str:
+        path = self.url(rel) + ".tmp"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def put_file(self, tmp: str, rel: str):
+        os.replace(tmp, self.url(rel))
+
+    def read_json(self, rel: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.url(rel), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def write_json(self, rel: str, obj: Dict[str, Any]):
+        tmp = self.tmp_path(rel)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(obj, f, indent=1)
+        os.replace(tmp, self.url(rel))
+
+class S3Sink:
+    """Las partes se escriben a un temporal y se suben con upload_file (multipart si hace falta)."""
+
+    def __init__(self, bucket: str, prefix: str):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+
+    def _key(self, rel: str) -> str:
+        return f"{self.prefix}/{rel}" if self.prefix else rel
+
+    def url(self, rel: str = "") -> str:
+        return f"s3://{self.bucket}/{self._key(rel)}"
+
+    def tmp_path(self, rel: str) -> str:
+        fd, path = tempfile.mkstemp(prefix="export-", suffix=os.path.basename(rel))
+        os.close(fd)
+        return path
+
+    def put_file(self, tmp: str, rel: str):
+        try:
+            s3_client().upload_file(tmp, self.bucket, self._key(rel))
+        finally:
+            os.unlink(tmp)
+
+    def read_json(self, rel: str) -> Optional[Dict[str, Any]]:
+        try:
+            body = s3_client().get_object(Bucket=self.bucket, Key=self._key(rel))["Body"].read()
+        except s3_client().exceptions.NoSuchKey:
+            return None
+        return json.loads(body)
+
+    def write_json(self, rel: str, obj: Dict[str, Any]):
+        s3_client().put_object(Bucket=self.bucket, Key=self._key(rel), Body=json.dumps(obj, indent=1).encode(),
+                               ContentType="application/json")
+
+def make_sink(dest: str):
+    """`s3://bucket/prefijo` o un directorio local."""
+    if dest.startswith("s3://"):
+        bucket, _, prefix = dest[5:].partition("/")
+        return S3Sink(bucket, prefix)
+    return LocalSink(dest)
+
+def default_dest(run_id: str) -> str:
+    return f"s3://{settings.s3_bucket_assets}/{settings.export_prefix.strip('/')}/{run_id}"
+
+# ---------- partes
+
+class NdjsonPart:
+    ext = ".ndjson.gz"
+
+    def __init__(self, path: str):
+        self._f = gzip.open(path, "wb", compresslevel=6)
+        self.n = 0
+
+    def write(self, item: Dict[str, Any]):
+        self._f.write(ddbjson.dumps_bytes(item) + b"\n")
+        self.n += 1
+
+    def close(self):
+        self._f.close()
+
+class ParquetPart:
+    """Una parte = un archivo Parquet. Atributos anidados (M/L) van como JSON en texto."""
+    ext = ".parquet"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rows: List[Dict[str, Any]] = []
+        self.n = 0
+
+    def write(self, item: Dict[str, Any]):
+        self.rows.append({k: ddbjson.dumps(v) if isinstance(v, (dict, list)) else v for k, v in item.items()})
+        self.n += 1
+
+    def close(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        cols: Dict[str, Any] = {}
+        for k in dict.fromkeys(k for r in self.rows for k in r):
+            vals = [r.get(k) for r in self.rows]
+            try:
+                cols[k] = pa.array(vals)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                # tipos mezclados entre items: la columna queda como texto
+                cols[k] = pa.array([None if v is None else str(v) for v in vals], type=pa.string())
+        pq.write_table(pa.table(cols), self.path, compression="zstd")
+        self.rows = []
+
+_PARTS = {"ndjson": NdjsonPart, "parquet": ParquetPart}
+
+# ---------- scan
+
+def _estimate_rcu(items: List[Dict[str, Any]]) -> float:
+    size = sum(len(ddbjson.dumps_bytes(it)) for it in items)
+    return max(0.5, size / 4096.0 * 0.5)   # lectura eventual: 0.5 RCU por 4 KB
+
+class ExportJob:
+    """
+    Export de varias tablas. `run()` bloquea; `start()` lo lanza en un hilo.
+    Cada (tabla, segmento) es una tarea del pool; el límite de RCU/s es global al job.
+    """
+
+    def __init__(self, dest: str, tables: Optional[List[str]] = None, *, run_id: Optional[str] = None,
+                 segments: Optional[int] = None, workers: Optional[int] = None, max_rcu: Optional[float] = None,
+                 fmt: Optional[str] = None, part_items: Optional[int] = None):
+        known = export_tables()
+        names = tables or list(known)
+        unknown = [t for t in names if t not in known]
+        if unknown:
+            raise ValueError(f"tablas desconocidas: {unknown}; válidas: {list(known)}")
+        self.sink = make_sink(dest)
+        self.dest = self.sink.url()
+        self.tables = {n: known[n] for n in names}
+        self.workers = max(1, int(workers or settings.export_workers))
+        self.max_rcu = float(max_rcu if max_rcu is not None else settings.export_max_rcu)
+        self.part_items = max(1, int(part_items or settings.export_part_items))
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.error: Optional[str] = None
+        self.running = False
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._buckets = MemoryBuckets()
+        self._counters = counters.group("export")
+
+        prev = self.sink.read_json("_state.json")
+        if prev:
+            # reanudar: segmentos y formato los fija el primer intento
+            if segments and int(segments) != prev["segments"]:
+                raise ValueError(f"{self.dest} ya tiene un export con segments={prev['segments']}")
+            self.state = prev
+            self.segments = prev["segments"]
+            self.fmt = prev["format"]
+        else:
+            self.segments = max(1, int(segments or settings.export_segments))
+            self.fmt = resolve_format(fmt)
+            self.state = {"run_id": run_id or uuid.uuid4().hex[:12], "format": self.fmt,
+                          "segments": self.segments, "tables": {}, "started_at": int(time.time())}
+        self.state.pop("finished_at", None)
+        for name, table in self.tables.items():
+            t = self.state["tables"].setdefault(name, {"table": table, "segments": {}})
+            for s in range(self.segments):
+                t["segments"].setdefault(str(s), {"cursor": None, "parts": 0, "items": 0, "done": False})
+        self.run_id = self.state["run_id"]
+
+    # ----- estado
+
+    def _save(self):
+        with self._save_lock:
+            with self._lock:
+                snap = json.loads(json.dumps(self.state))
+            self.sink.write_json("_state.json", snap)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            tables = {}
+            for name in self.tables:
+                segs = self.state["tables"][name]["segments"].values()
+                tables[name] = {
+                    "items": sum(s["items"] for s in segs),
+                    "parts": sum(s["parts"] for s in segs),
+                    "segments_done": sum(1 for s in segs if s["done"]),
+                    "errors": [s["error"] for s in segs if s.get("error")],
+                }
+            done = all(t["segments_done"] == self.segments for t in tables.values())
+            return {
+                "run_id": self.run_id, "dest": self.dest, "format": self.fmt, "segments": self.segments,
+                "status": "running" if self.running else "done" if done else "stopped" if self.stop_event.is_set()
+                          else "failed" if self.error or any(t["errors"] for t in tables.values()) else "pending",
+                "tables": tables, "error": self.error,
+            }
+
+    # ----- rate limit
+
+    def _pace(self, cost: float):
+        """Token bucket de RCU/s compartido por todos los segmentos (coste de la página anterior)."""
+        if self.max_rcu <= 0:
+            return
+        cost = min(cost, self.max_rcu)
+        while not self.stop_event.is_set():
+            ok, wait_s = self._buckets.try_take("export", cost, self.max_rcu, self.max_rcu)
+            if ok:
+                return
+            self._counters.incr("paced")
+            self.stop_event.wait(min(wait_s, 1.0))
+
+    # ----- pipeline por segmento
+
+    def _pages(self, table: str, segment: int, cursor: Optional[Dict[str, Any]]
+               ) -> Iterator[Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+        """(items, LastEvaluatedKey) por página; cursor None al final del segmento."""
+        cost = 1.0
+        while not self.stop_event.is_set():
+            self._pace(cost)
+            kw: Dict[str, Any] = {"TableName": table, "Segment": segment, "TotalSegments": self.segments,
+                                  "Limit": settings.export_page_items, "ReturnConsumedCapacity": "TOTAL"}
+            if cursor:
+                kw["ExclusiveStartKey"] = cursor
+            resp = ddb_client.scan(**kw)
+            items = ddbjson.decode_items(resp.get("Items", []))
+            cost = float((resp.get("ConsumedCapacity") or {}).get("CapacityUnits") or _estimate_rcu(items))
+            cursor = resp.get("LastEvaluatedKey")
+            self._counters.incr("pages")
+            yield items, cursor
+            if not cursor:
+                return
+
+    def _export_segment(self, name: str, segment: int):
+        seg = self.state["tables"][name]["segments"][str(segment)]
+        if seg["done"]:
+            return
+        with self._lock:
+            seg.pop("error", None)
+        table = self.tables[name]
+        part_cls = _PARTS[self.fmt]
+        part = tmp = rel = None
+        try:
+            for items, cursor in self._pages(table, segment, seg["cursor"]):
+                for it in items:
+                    if part is None:
+                        rel = f"{name}/part-{segment:04d}-{seg['parts']:05d}{part_cls.ext}"
+                        tmp = self.sink.tmp_path(rel)
+                        part = part_cls(tmp)
+                    part.write(it)
+                self._counters.incr("items", len(items))
+                # se corta parte sólo en fin de página: el cursor guardado es exacto
+                if part is not None and (part.n >= self.part_items or not cursor):
+                    part.close()
+                    self.sink.put_file(tmp, rel)
+                    self._counters.incr("parts")
+                    with self._lock:
+                        seg["parts"] += 1
+                        seg["items"] += part.n
+                        seg["cursor"] = cursor
+                    part = tmp = None
+                    self._save()
+                if not cursor:
+                    with self._lock:
+                        seg["done"] = True
+                        seg["cursor"] = None
+                    self._save()
+        except Exception as e:
+            with self._lock:
+                seg["error"] = f"{type(e).__name__}: {e}"
+            self._counters.incr("segment_errors")
+            self._save()
+        finally:
+            if part is not None:
+                # parte a medias (stop/error): se descarta; se reescribe al reanudar
+                try:
+                    part.close()
+                except Exception:
+                    pass
+                if tmp and os.path.exists(tmp):
+                    os.unlink(tmp)
+
+    def run(self) -> Dict[str, Any]:
+        self.running = True
+        try:
+            self._save()
+            tasks = [(name, s) for name in self.tables for s in range(self.segments)]
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="export") as pool:
+                for fut in [pool.submit(self._export_segment, n, s) for n, s in tasks]:
+                    fut.result()
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+        finally:
+            self.running = False
+        if self.snapshot()["status"] == "done":
+            with self._lock:
+                self.state["finished_at"] = int(time.time())
+            self._save()
+        return self.snapshot()
+
+    def start(self) -> "ExportJob":
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=f"export-{self.run_id}", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+# ---------- jobs del proceso (endpoint admin)
+
+_jobs: Dict[str, ExportJob] = {}
+_jobs_lock = threading.Lock()
+
+def start_job(run_id: Optional[str] = None, dest: Optional[str] = None, **opts: Any) -> ExportJob:
+    """Lanza (o reanuda, si `run_id` ya tiene estado en el destino) un export en segundo plano."""
+    run_id = run_id or uuid.uuid4().hex[:12]
+    with _jobs_lock:
+        cur = _jobs.get(run_id)
+        if cur is not None and cur.running:
+            return cur
+        job = ExportJob(dest or default_dest(run_id), run_id=run_id, **opts)
+        _jobs[job.run_id] = job
+    return job.start()
+
+def get_job(run_id: str) -> Optional[ExportJob]:
+    with _jobs_lock:
+        return _jobs.get(run_id)
@@ -0,0 +1,153 @@
+from __future__ import annotations
+import contextlib, hashlib, threading, time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, Iterator, Optional
+from .cache import TTLCache
+from .config import settings
+
+# Páginas ya renderizadas (con URLs prefirmadas). Clave y ETag llevan la ventana de
+# `presign_epoch`: ni una página cacheada ni un 304 sobreviven a sus URLs. El TTL debe
+# quedar muy por debajo de PRESIGN_EXPIRY_S / 2.
+page_cache = TTLCache(maxsize=settings.feed_cache_max, ttl=settings.feed_cache_ttl_s)
+
+def presign_epoch(now: Optional[float] = None) -> int:
+    """Ventana de media expiración de las URLs prefirmadas: al cambiar, el cliente recibe URLs nuevas."""
+    span = max(1.0, settings.presign_expiry_s / 2.0)
+    return int((time.time() if now is None else now) // span)
+
+def page_key(owner_id: str, version: int, *, status: Optional[str], cursor: Optional[str], limit: int,
+             view: str = "", epoch: Optional[int] = None) -> tuple:
+    epoch = presign_epoch() if epoch is None else epoch
+    return (view, owner_id, status or "", cursor or "", int(limit), int(version), int(epoch))
+
+def etag_for(owner_id: str, version: int, *, status: Optional[str], cursor: Optional[str], limit: int,
+             view: str = "", epoch: Optional[int] = None) -> str:
+    """
+    ETag débil: la versión del feed del owner + los parámetros de la página + la ventana
+    de `presign_epoch` (un 304 nunca deja al cliente con URLs de más de una expiración).
+    Débil porque las URLs prefirmadas cambian en cada render aunque el contenido no.
+    """
+    epoch = presign_epoch() if epoch is None else epoch
+    h = hashlib.sha1(f"{view}|{owner_id}|{status or ''}|{cursor or ''}|{limit}|{epoch}".encode()).hexdigest()[:12]
+    return f'W/"v{int(version)}-{h}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    want = etag[2:] if etag.startswith("W/") else etag
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == want:
+            return True
+    return False
+
+def header(headers: Optional[Dict[str, Any]], name: str) -> Optional[str]:
+    """Cabecera case-insensitive de un evento API Gateway."""
+    if not headers:
+        return None
+    n = name.lower()
+    for k, v in headers.items():
+        if k.lower() == n:
+            return v
+    return None
+
+# ---------- prefetch de la página siguiente (scroll infinito)
+
+class Prefetcher:
+    """
+    Renderiza en segundo plano la página que sigue a la recién servida y la deja
+    en un cache chico con TTL corto, con la misma clave que tendrá la próxima request
+    (cursor = `next_page_token` devuelto). Se omite con carga alta: demasiadas
+    requests de feed activas, prefetches en curso o colas en la admisión a Bedrock.
+    """
+
+    def __init__(self, workers: int, maxsize: int, ttl: float, max_active: int):
+        self.workers = max(1, int(workers))
+        self.max_active = max(1, int(max_active))
+        self.pages = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._inflight: Dict[Any, Future] = {}
+        self._active = 0
+        self._stats: Dict[str, int] = {"scheduled": 0, "skipped_load": 0, "served": 0, "joined": 0, "failed": 0}
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    @contextlib.contextmanager
+    def serving(self) -> Iterator[None]:
+        """Marca una request de feed en curso (señal de carga)."""
+        with self._lock:
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def _busy(self) -> bool:
+        if self._active > self.max_active or len(self._inflight) >= self.workers:
+            return True
+        from . import admission
+        return any(c.limiter.snapshot()["queued"] for c in (admission.text, admission.image))
+
+    def schedule(self, key: Any, render: Callable[[], Dict[str, Any]]) -> bool:
+        if not settings.feed_prefetch_enabled:
+            return False
+        with self._lock:
+            if key in self._inflight or key in self.pages or key in page_cache:
+                return False
+            if self._busy():
+                self._stats["skipped_load"] += 1
+                return False
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="feed-prefetch")
+            fut = self._pool.submit(self._run, key, render)
+            self._inflight[key] = fut
+            self._stats["scheduled"] += 1
+        return True
+
+    def _run(self, key: Any, render: Callable[[], Dict[str, Any]]):
+        try:
+            self.pages.set(key, render())
+        except Exception:
+            self._count("failed")
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def take(self, key: Any, wait_s: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Página prefetcheada para `key`; si aún se está renderizando, espera hasta `wait_s`."""
+        with self._lock:
+            fut = self._inflight.get(key)
+        if fut is not None:
+            try:
+                fut.result(timeout=settings.feed_prefetch_wait_s if wait_s is None else wait_s)
+                self._count("joined")
+            except FutureTimeout:
+                return None
+            except Exception:
+                return None
+        page = self.pages.get(key)
+        if page is not None:
+            self.pages.pop(key)
+            self._count("served")
+        return page
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._stats)
+            out.update({"active": self._active, "inflight": len(self._inflight), "cached": len(self.pages)})
+        return out
+
+prefetcher = Prefetcher(
+    workers=settings.feed_prefetch_workers,
+    maxsize=settings.feed_prefetch_max,
+    ttl=settings.feed_prefetch_ttl_s,
+    max_active=settings.feed_prefetch_max_active,
+)
@@ -0,0 +1,125 @@
+from __future__ import annotations
+import hashlib, json, threading, time, uuid
+from typing import Any, Callable, Dict, Optional, Tuple
+from . import counters, deadline
+from .config import settings
+from .dynamo import claim_idempotency, complete_idempotency, release_idempotency
+
+# Idempotency-Key: la primera request con una key la ejecuta; los duplicados concurrentes
+# esperan esa ejecución (en el mismo proceso con un Event, entre procesos/Lambdas
+# consultando DynamoDB) y reciben su respuesta; las siguientes, la respuesta guardada
+# hasta que vence IDEMPOTENCY_TTL_S. Si la ejecución falla, la key se libera.
+
+MAX_KEY_LEN = 255
+
+class IdempotencyConflict(Exception):
+    """`in_progress`: sigue en vuelo tras la espera (409); `key_reused`: otra request con la misma key (422)."""
+
+    def __init__(self, reason: str, retry_after: float = 0.0):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+def fingerprint(*parts: Any) -> str:
+    """Huella del payload: la misma key con otro contenido no es un reintento."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def valid_key(key: Optional[str]) -> bool:
+    return key is not None and 0 < len(key) <= MAX_KEY_LEN and key.isprintable()
+
+def _wait_s() -> float:
+    """Cuánto puede esperar un duplicado: IDEMPOTENCY_WAIT_S, sin pasarse del plazo de la request."""
+    left = deadline.timeout()
+    return settings.idempotency_wait_s if left is None else max(0.0, min(settings.idempotency_wait_s, left))
+
+class _Flight:
+    __slots__ = ("fingerprint", "done", "result", "error")
+
+    def __init__(self, fp: str):
+        self.fingerprint = fp
+        self.done = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[BaseException] = None
+
+_flights: Dict[str, _Flight] = {}
+_lock = threading.Lock()
+
+def run(user_id: str, key: Optional[str], fp: str, fn: Callable[[], Dict[str, Any]]) -> Tuple[Dict[str, Any], bool]:
+    """
+    `fn()` una sola vez por (usuario, key). Devuelve (respuesta, repetida). Sin key, llama a `fn`.
+    La respuesta tiene que ser serializable a JSON (se guarda tal cual).
+    """
+    if not key:
+        return fn(), False
+    stats = counters.group("idempotency")
+    ik = f"{user_id}#{key}"
+
+    with _lock:
+        flight = _flights.get(ik)
+        leader = flight is None
+        if leader:
+            flight = _flights[ik] = _Flight(fp)
+    if not leader:
+        if flight.fingerprint != fp:
+            stats.incr("key_reused")
+            raise IdempotencyConflict("key_reused")
+        stats.incr("coalesced")
+        if not flight.done.wait(_wait_s()):
+            raise IdempotencyConflict("in_progress", settings.idempotency_lease_s)
+        if flight.error is not None:
+            raise flight.error
+        return flight.result, True
+
+    try:
+        out, replayed = _claim_and_run(ik, fp, fn, stats)
+        flight.result = out
+        return out, replayed
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        flight.done.set()
+        with _lock:
+            _flights.pop(ik, None)
+
+def _claim_and_run(ik: str, fp: str, fn: Callable[[], Dict[str, Any]],
+                   stats: counters.Counters) -> Tuple[Dict[str, Any], bool]:
+    owner = uuid.uuid4().hex
+    give_up = time.monotonic() + _wait_s()
+    pause = 0.2
+    while True:
+        now = time.time()
+        current = claim_idempotency(ik, fp, owner, now, settings.idempotency_lease_s, settings.idempotency_ttl_s)
+        if current is None:
+            break
+        if current.get("fingerprint") not in (None, fp):
+            stats.incr("key_reused")
+            raise IdempotencyConflict("key_reused")
+        if current.get("status") == "done":
+            stats.incr("replayed")
+            return json.loads(current["response"]), True
+        # en vuelo en otro proceso: esperar su respuesta
+        if time.monotonic() + pause > give_up:
+            stats.incr("in_progress")
+            left = float(current.get("lease_until") or now) - now
+            raise IdempotencyConflict("in_progress", max(1.0, left))
+        stats.incr("waited")
+        time.sleep(pause)
+        pause = min(pause * 1.5, 2.0)
+
+    stats.incr("executed")
+    try:
+        out = fn()
+    except BaseException:
+        try:
+            release_idempotency(ik, owner)
+        except Exception:
+            stats.incr("release_errors")
+        raise
+    try:
+        if not complete_idempotency(ik, owner, json.dumps(out, ensure_ascii=False, default=str),
+                                    time.time() + settings.idempotency_ttl_s):
+            stats.incr("lease_lost")
+    except Exception:
+        stats.incr("store_errors")
+    return out, False
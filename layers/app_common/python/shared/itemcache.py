@@ -0,0 +1,131 @@
+from __future__ import annotations
+import json, threading
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from . import counters, ddbjson
+from .cache import TTLCache
+from .config import settings
+
+# ---------- tier compartido (opcional)
+
+class SharedTier:
+    """Interfaz del segundo nivel (compartido entre procesos/contenedores). Por defecto no hace nada."""
+
+    def get_many(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        return {}
+
+    def set_many(self, items: Dict[str, Dict[str, Any]], ttl: float):
+        pass
+
+    def delete(self, keys: List[str]):
+        pass
+
+class RedisTier(SharedTier):
+    """Redis/ElastiCache (`pip install redis`). Los errores del tier nunca rompen la lectura."""
+
+    def __init__(self, url: str, prefix: str = "kkt:item:"):
+        import redis  # opcional: sólo si ITEM_CACHE_SHARED=redis
+        self.r = redis.Redis.from_url(url, socket_timeout=0.2, socket_connect_timeout=0.2)
+        self.prefix = prefix
+
+    def get_many(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        try:
+            vals = self.r.mget([self.prefix + k for k in keys])
+        except Exception:
+            return {}
+        return {k: json.loads(v) for k, v in zip(keys, vals) if v is not None}
+
+    def set_many(self, items: Dict[str, Dict[str, Any]], ttl: float):
+        try:
+            pipe = self.r.pipeline(transaction=False)
+            for k, v in items.items():
+                pipe.set(self.prefix + k, ddbjson.dumps_bytes(v), ex=max(1, int(ttl)))
+            pipe.execute()
+        except Exception:
+            pass
+
+    def delete(self, keys: List[str]):
+        try:
+            self.r.delete(*[self.prefix + k for k in keys])
+        except Exception:
+            pass
+
+def make_shared_tier() -> SharedTier:
+    if settings.item_cache_shared == "redis" and settings.item_cache_redis_url:
+        try:
+            return RedisTier(settings.item_cache_redis_url)
+        except ImportError:
+            pass
+    return SharedTier()
+
+# ---------- read-through
+
+class ItemCache:
+    """
+    Cache read-through de items por clave: LRU+TTL en proceso, luego el tier
+    compartido y por último `load_many(keys)` (un BatchGetItem). Las escrituras
+    llaman `invalidate`; en otros procesos el nivel local caduca por TTL.
+    Devuelve copias superficiales: el llamador puede modificar el dict.
+    """
+
+    def __init__(self, name: str, load_many: Callable[[List[str]], Dict[str, Dict[str, Any]]],
+                 maxsize: int, ttl: float, shared: Optional[SharedTier] = None):
+        self.name = name
+        self.load_many = load_many
+        self.ttl = ttl
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.shared = shared or SharedTier()
+        self._counters = counters.group("cache")
+        # si hubo una invalidación mientras se cargaba, lo cargado puede ser anterior a la escritura
+        self._gen = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        wanted = list(dict.fromkeys(k for k in keys if k))
+        if not settings.item_cache_enabled:
+            return self.load_many(wanted) if wanted else {}
+        found: Dict[str, Dict[str, Any]] = {}
+        missing: List[str] = []
+        for k in wanted:
+            v = self.local.get(k)
+            if v is None:
+                missing.append(k)
+            else:
+                found[k] = v
+        if found:
+            self._counters.incr(f"{self.name}.hit", len(found))
+        if missing:
+            shared = self.shared.get_many(missing)
+            if shared:
+                self._counters.incr(f"{self.name}.shared_hit", len(shared))
+                for k, v in shared.items():
+                    self.local.set(k, v)
+                found.update(shared)
+                missing = [k for k in missing if k not in shared]
+        if missing:
+            self._counters.incr(f"{self.name}.miss", len(missing))
+            with self._lock:
+                gen = self._gen
+            loaded = self.load_many(missing)
+            with self._lock:
+                fresh = loaded if self._gen == gen else {}
+            for k, v in fresh.items():
+                self.local.set(k, v)
+            if fresh:
+                self.shared.set_many(fresh, self.ttl)
+            found.update(loaded)
+        return {k: dict(v) for k, v in found.items()}
+
+    def invalidate(self, *keys: str):
+        ks = [k for k in keys if k]
+        with self._lock:
+            self._gen += 1
+        for k in ks:
+            self.local.pop(k)
+        if ks:
+            self.shared.delete(ks)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"local": self.local.stats(), "shared": type(self.shared).__name__}
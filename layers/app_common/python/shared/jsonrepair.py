@@ -0,0 +1,160 @@
+from __future__ import annotations
+import json, re
+from typing import Any, Dict, List, Optional, Tuple
+
+# Salida JSON de un LLM: extracción tolerante, reparación local y validación contra
+# un subconjunto de JSON Schema (type, enum, items, required, maxItems). La idea es no
+# gastar otra llamada al modelo por un preámbulo, una cerca ``` o una coma de más.
+
+_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_MAX_STARTS = 4
+
+def _scan(text: str, start: int) -> Tuple[str, bool]:
+    """
+    Copia el objeto que empieza en `start` hasta su `}` de cierre, corrigiendo por el
+    camino comas finales y literales de Python. Si el texto se corta antes, conserva
+    sólo los miembros de primer nivel completos. Devuelve (json, truncado).
+    """
+    out: List[str] = []
+    stack: List[str] = []
+    in_str = esc = False
+    last_top_comma = -1
+    i, n = start, len(text)
+    while i < n:
+        c = text[i]
+        if in_str:
+            out.append(c)
+            if esc:
+                esc = False
+            elif c == "\\":
+                esc = True
+            elif c == '"':
+                in_str = False
+            i += 1
+            continue
+        if c == '"':
+            in_str = True
+        elif c in "{[":
+            stack.append("}" if c == "{" else "]")
+        elif c in "}]":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            if stack:
+                stack.pop()
+            out.append(c)
+            if not stack:
+                return "".join(out), False
+            i += 1
+            continue
+        elif c == "," and len(stack) == 1:
+            last_top_comma = len(out)
+        elif c.isalpha():
+            j = i
+            while j < n and (text[j].isalnum() or text[j] == "_"):
+                j += 1
+            word = text[i:j]
+            out.append(_LITERALS.get(word, word))
+            i = j
+            continue
+        out.append(c)
+        i += 1
+    # cortado: el último miembro puede estar a medias -> se descarta
+    body = "".join(out[:last_top_comma]) if last_top_comma > 0 else "{"
+    return body + "}", True
+
+def extract_object(text: str) -> Tuple[Optional[Dict[str, Any]], str]:
+    """
+    Objeto JSON más externo de `text`. Devuelve (obj, cómo): "ok" si era JSON limpio,
+    "repaired" si hubo que recortar/arreglar, "truncated" si faltaba el final
+    (sólo quedan los campos completos) y (None, "") si no hay objeto.
+    """
+    s = (text or "").strip()
+    try:
+        obj = json.loads(s)
+        if isinstance(obj, dict):
+            return obj, "ok"
+    except ValueError:
+        pass
+    pos = s.find("{")
+    for _ in range(_MAX_STARTS):
+        if pos < 0:
+            break
+        candidate, truncated = _scan(s, pos)
+        try:
+            obj = json.loads(candidate, strict=False)   # strict=False: saltos de línea crudos en strings
+        except ValueError:
+            obj = None
+        if isinstance(obj, dict):
+            return obj, "truncated" if truncated else "repaired"
+        pos = s.find("{", pos + 1)
+    return None, ""
+
+# ---------- schema
+
+_TYPES = {"string": str, "array": list, "object": dict, "boolean": bool, "number": (int, float), "integer": int}
+
+def _fold(s: str) -> str:
+    return re.sub(r"[\s_\-]+", "", s.lower())
+
+def _coerce_value(v: Any, spec: Dict[str, Any]) -> Any:
+    t = spec.get("type")
+    if t == "string":
+        if isinstance(v, (int, float)) and not isinstance(v, bool):
+            v = str(v)
+        elif isinstance(v, list) and all(isinstance(x, str) for x in v):
+            v = ", ".join(v)
+        enum = spec.get("enum")
+        if enum and isinstance(v, str) and v not in enum:
+            v = {_fold(e): e for e in enum if isinstance(e, str)}.get(_fold(v), v)
+    elif t == "array" and isinstance(v, str):
+        v = [x.strip() for x in v.replace(";", ",").split(",") if x.strip()]
+    if t == "array" and isinstance(v, list) and spec.get("items"):
+        v = [_coerce_value(x, spec["items"]) for x in v]
+    return v
+
+def coerce(obj: Dict[str, Any], schema: Dict[str, Any]) -> Dict[str, Any]:
+    """Arreglos sin ambigüedad: número -> string, 'a, b' -> lista, enum con otra caja/guiones."""
+    props = schema.get("properties") or {}
+    return {k: _coerce_value(v, props[k]) if k in props else v for k, v in obj.items()}
+
+def _problem(v: Any, spec: Dict[str, Any]) -> Optional[str]:
+    t = spec.get("type")
+    py = _TYPES.get(t)
+    if py is not None and (not isinstance(v, py) or (t in ("number", "integer") and isinstance(v, bool))):
+        return f"debe ser {t}"
+    if "enum" in spec and v not in spec["enum"]:
+        return f"valor no permitido {v!r}"
+    if t == "array":
+        if "maxItems" in spec and len(v) > spec["maxItems"]:
+            return f"máximo {spec['maxItems']} elementos"
+        if spec.get("items"):
+            for x in v:
+                p = _problem(x, spec["items"])
+                if p:
+                    return f"elementos: {p}"
+    return None
+
+def problems(obj: Dict[str, Any], schema: Dict[str, Any]) -> Dict[str, str]:
+    """{campo: motivo} de los campos de primer nivel que faltan o no cumplen el schema."""
+    props = schema.get("properties") or {}
+    out: Dict[str, str] = {}
+    for k in schema.get("required") or []:
+        if k not in obj:
+            out[k] = "falta"
+    for k, spec in props.items():
+        if k in obj and k not in out:
+            p = _problem(obj[k], spec)
+            if p:
+                out[k] = p
+    return out
+
+def followup_prompt(bad: Dict[str, str], schema: Dict[str, Any]) -> str:
+    """Repregunta corta: sólo los campos con problemas y su parte del schema."""
+    props = schema.get("properties") or {}
+    sub = {k: props.get(k, {}) for k in bad}
+    reasons = "; ".join(f"{k}: {why}" for k, why in bad.items())
+    return ("En tu respuesta anterior estos campos faltan o no son válidos: " + reasons +
+            ".\nDevuelve ÚNICAMENTE un JSON con esas claves, sin texto adicional. Schema: " +
+            json.dumps(sub, ensure_ascii=False))
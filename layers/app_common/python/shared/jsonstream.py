@@ -0,0 +1,100 @@
+from __future__ import annotations
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+class ObjectFields:
+    """
+    Parser incremental de un objeto JSON que llega en trozos (streaming del LLM).
+    `feed(chunk)` devuelve los campos de primer nivel que quedaron completos con ese
+    trozo, en orden, como pares (clave, valor). Un campo se considera completo al ver
+    la coma o la llave de cierre que lo sigue. Ignora texto antes de la primera `{`
+    (p.ej. cercas ```json) y no re-emite campos repetidos.
+    """
+
+    __slots__ = ("_buf", "_pos", "_depth", "_in_str", "_esc", "_seg_start", "_started", "_done", "fields")
+
+    def __init__(self):
+        self._buf: List[str] = []
+        self._pos = 0
+        self._depth = 0
+        self._in_str = False
+        self._esc = False
+        self._seg_start = -1
+        self._started = False
+        self._done = False
+        self.fields: Dict[str, Any] = {}
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    def _segment(self, end: int) -> Optional[Tuple[str, Any]]:
+        seg = "".join(self._buf[self._seg_start:end]).strip()
+        if not seg:
+            return None
+        try:
+            obj = json.loads("{" + seg + "}")
+        except ValueError:
+            return None
+        if len(obj) != 1:
+            return None
+        (k, v), = obj.items()
+        if k in self.fields:
+            return None
+        self.fields[k] = v
+        return k, v
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        out: List[Tuple[str, Any]] = []
+        if self._done or not chunk:
+            return out
+        self._buf.extend(chunk)
+        buf = self._buf
+        i = self._pos
+        n = len(buf)
+        while i < n:
+            c = buf[i]
+            if not self._started:
+                if c == "{":
+                    self._started = True
+                    self._depth = 1
+                    self._seg_start = i + 1
+                i += 1
+                continue
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif c == "\\":
+                    self._esc = True
+                elif c == '"':
+                    self._in_str = False
+            elif c == '"':
+                self._in_str = True
+            elif c in "{[":
+                self._depth += 1
+            elif c in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    kv = self._segment(i)
+                    if kv:
+                        out.append(kv)
+                    self._done = True
+                    i += 1
+                    break
+            elif c == "," and self._depth == 1:
+                kv = self._segment(i)
+                if kv:
+                    out.append(kv)
+                self._seg_start = i + 1
+            i += 1
+        self._pos = i
+        return out
+
+def field_callback(on_field: Callable[[str, Any], None]) -> Callable[[str], None]:
+    """Adaptador: recibe texto en streaming y llama `on_field(clave, valor)` por cada campo completo."""
+    parser = ObjectFields()
+
+    def on_text(chunk: str):
+        for k, v in parser.feed(chunk):
+            on_field(k, v)
+    return on_text
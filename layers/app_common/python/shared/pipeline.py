@@ -0,0 +1,132 @@
+from __future__ import annotations
+import threading, time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from .tracing import bind, span
+
+class StepFailed(Exception):
+    """Falló un paso del grafo; `step` indica cuál y `error` es la excepción original."""
+
+    def __init__(self, step: str, error: BaseException):
+        super().__init__(f"{step}: {type(error).__name__}: {error}")
+        self.step = step
+        self.error = error
+
+@dataclass
+class _Step:
+    name: str
+    fn: Callable[[Dict[str, Any]], Any]
+    deps: Tuple[str, ...] = ()
+    undo: Optional[Callable[[Any], None]] = None
+    when: Optional[Callable[[Dict[str, Any]], bool]] = None
+
+@dataclass
+class _Run:
+    name: str
+    deps: Tuple[str, ...]
+    start: float = 0.0
+    end: float = 0.0
+    ok: bool = False
+    skipped: bool = False
+    thread: str = ""
+
+class Graph:
+    """
+    Grafo de pasos con dependencias. Cada paso recibe el dict de resultados de los
+    pasos ya terminados y corre en cuanto sus dependencias están listas, en paralelo
+    con los demás pasos independientes. Si uno falla, no se lanzan más pasos, se
+    esperan los que están corriendo y se ejecutan los `undo` de los terminados
+    (orden inverso) antes de propagar `StepFailed`. Un paso con `when` que evalúa
+    a falso se marca como omitido y su resultado es None.
+    """
+
+    def __init__(self, name: str, max_workers: int = 4):
+        self.name = name
+        self.max_workers = max(1, int(max_workers))
+        self._steps: Dict[str, _Step] = {}
+        self._runs: Dict[str, _Run] = {}
+        self._t0 = 0.0
+
+    def step(self, name: str, fn: Callable[[Dict[str, Any]], Any], deps: Tuple[str, ...] = (),
+             undo: Optional[Callable[[Any], None]] = None,
+             when: Optional[Callable[[Dict[str, Any]], bool]] = None) -> "Graph":
+        if name in self._steps:
+            raise ValueError(f"paso duplicado: {name}")
+        for d in deps:
+            if d not in self._steps:
+                raise ValueError(f"{name}: dependencia desconocida {d} (declárala antes)")
+        self._steps[name] = _Step(name, fn, tuple(deps), undo, when)
+        return self
+
+    def _call(self, st: _Step, results: Dict[str, Any]) -> Any:
+        run = self._runs[st.name]
+        run.thread = threading.current_thread().name
+        run.start = time.perf_counter()
+        if st.when is not None and not st.when(results):
+            run.end = run.start
+            run.ok = run.skipped = True
+            return None
+        try:
+            with span(f"step.{st.name}"):
+                out = st.fn(results)
+            run.ok = True
+            return out
+        finally:
+            run.end = time.perf_counter()
+
+    def run(self) -> Dict[str, Any]:
+        self._t0 = time.perf_counter()
+        results: Dict[str, Any] = {}
+        pending = dict(self._steps)
+        running: Dict[Future, str] = {}
+        done_order: List[str] = []
+        failure: Optional[StepFailed] = None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"{self.name}") as pool:
+            while pending or running:
+                if failure is None:
+                    for name, st in list(pending.items()):
+                        if all(d in results for d in st.deps):
+                            del pending[name]
+                            self._runs[name] = _Run(name, st.deps)
+                            # snapshot: cada paso ve sólo resultados ya terminados
+                            fut = pool.submit(bind(self._call), st, dict(results))
+                            running[fut] = name
+                if not running:
+                    break
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    name = running.pop(fut)
+                    try:
+                        results[name] = fut.result()
+                        done_order.append(name)
+                    except BaseException as e:  # noqa: BLE001 - se re-lanza envuelta
+                        if failure is None:
+                            failure = StepFailed(name, e)
+
+        if failure is not None:
+            for name in reversed(done_order):
+                st = self._steps[name]
+                if st.undo is not None and not self._runs[name].skipped:
+                    try:
+                        with span(f"undo.{name}"):
+                            st.undo(results[name])
+                    except Exception:
+                        pass
+            raise failure
+        return results
+
+    def timeline(self) -> List[Dict[str, Any]]:
+        """Inicio/duración (ms relativos al arranque del grafo) y dependencias de cada paso ejecutado."""
+        out = []
+        for r in sorted(self._runs.values(), key=lambda r: r.start):
+            out.append({
+                "step": r.name,
+                "deps": list(r.deps),
+                "start_ms": round((r.start - self._t0) * 1000.0, 1),
+                "ms": round((r.end - r.start) * 1000.0, 1),
+                "ok": r.ok,
+                **({"skipped": True} if r.skipped else {}),
+            })
+        return out
@@ -0,0 +1,306 @@
+from __future__ import annotations
+import contextvars, cProfile, functools, hmac, json, marshal, os, pstats, random, re, sys, threading, time, uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from .config import settings
+
+# Perfilado opt-in de una request (API) o invocación (Lambda): cabecera `X-Profile: 1` con
+# X-Admin-Token = ADMIN_TOKEN (sin ADMIN_TOKEN no se puede forzar), o PROFILE_SAMPLE_RATE.
+# Mientras dura la sesión:
+#   - CPU: un cProfile (timer = thread_time) por cada hilo que trabaja para la request,
+#     mezclados en `cpu.pstats` (determinista, tiempo de CPU por función).
+#   - Tiempo real: un hilo muestrea cada PROFILE_INTERVAL_MS las pilas de esos hilos
+#     (`wall.speedscope.json`, incluye esperas a Bedrock/DynamoDB/S3).
+# Los hilos se suman a la sesión por `tracing.bind` (pools, grafo, plazos), por el hilo
+# del endpoint en la API y por el handler en Lambda. Todo se sube al bucket de assets bajo
+# PROFILE_PREFIX/<día>/<ruta>/<id>/ junto con `summary.json` (lo más caro de agents/ y shared/).
+# Apagado cuesta leer un contextvar en cada `bind`. Este módulo no importa tracing ni
+# counters al cargar: tracing lo importa a él.
+
+_current: contextvars.ContextVar[Optional["Session"]] = contextvars.ContextVar("kkt_profile", default=None)
+_OURS = tuple(f"{os.sep}{d}{os.sep}" for d in ("agents", "shared"))
+_WRAPPERS = tuple(f"{os.sep}shared{os.sep}{f}" for f in ("profiling.py", "tracing.py"))   # fuera del resumen
+_TOP = 25
+
+def _count(key: str, n: int = 1):
+    from . import counters
+    counters.group("profiling").incr(key, n)
+
+def admin_ok(token: Optional[str]) -> bool:
+    """Mismo criterio que `/admin/*`: sólo con ADMIN_TOKEN configurado y la cabecera igual (nunca por AUTH_BYPASS)."""
+    return bool(settings.admin_token) and bool(token) and hmac.compare_digest(token, settings.admin_token)
+
+def wanted(flag: Optional[str], admin_token: Optional[str]) -> bool:
+    if flag and flag.strip().lower() in ("1", "true", "yes"):
+        if admin_ok(admin_token):
+            return True
+        _count("denied")
+    rate = settings.profile_sample_rate
+    return rate > 0 and random.random() < rate
+
+class Session:
+    """Perfil de una request. `run(fn)` perfila el hilo actual durante la llamada (anidable)."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.id = uuid.uuid4().hex[:12]
+        self.started_at = time.time()
+        self.duration_ms = 0.0
+        day = time.strftime("%Y-%m-%d", time.gmtime(self.started_at))
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", name).strip("_") or "root"
+        self.prefix = f"{settings.profile_prefix.strip('/')}/{day}/{slug}/{self.id}/"
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self._depth: Dict[int, int] = {}
+        self._names: Dict[int, str] = {}
+        self._profilers: Dict[int, cProfile.Profile] = {}
+        self._cpu: List[cProfile.Profile] = []
+        self._closed = False
+        # sólo los toca el hilo de muestreo (y `save`, después del join)
+        self._frames: Dict[Tuple[str, int, str], int] = {}
+        self._samples: Dict[int, Dict[Tuple[int, ...], float]] = {}
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._token: Optional[contextvars.Token] = None
+
+    def run(self, fn: Callable, *args: Any, **kwargs: Any) -> Any:
+        self._enter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._exit()
+
+    def _enter(self):
+        ident = threading.get_ident()
+        with self._lock:
+            depth = self._depth.get(ident, 0)
+            self._depth[ident] = depth + 1
+            if depth or self._closed:
+                return
+            self._names[ident] = threading.current_thread().name
+        prof = cProfile.Profile(time.thread_time)
+        try:
+            prof.enable()
+        except ValueError:   # ya hay otro profiler en el hilo
+            return
+        with self._lock:
+            self._profilers[ident] = prof
+
+    def _exit(self):
+        ident = threading.get_ident()
+        with self._lock:
+            depth = self._depth.get(ident, 1) - 1
+            if depth > 0:
+                self._depth[ident] = depth
+                return
+            self._depth.pop(ident, None)
+            prof = self._profilers.pop(ident, None)
+        if prof is None:
+            return
+        prof.disable()
+        with self._lock:
+            if not self._closed:
+                self._cpu.append(prof)
+
+    # ---------- muestreo de pilas (tiempo real)
+
+    def _frame_id(self, code) -> int:
+        key = (code.co_filename, code.co_firstlineno, code.co_name)
+        idx = self._frames.get(key)
+        if idx is None:
+            idx = self._frames[key] = len(self._frames)
+        return idx
+
+    def _sample_loop(self):
+        interval = max(0.001, settings.profile_interval_ms / 1000.0)
+        until = time.monotonic() + settings.profile_max_s
+        last = time.perf_counter()
+        while not self._stop.wait(interval):
+            now = time.perf_counter()
+            weight, last = (now - last) * 1000.0, now
+            with self._lock:
+                idents = list(self._depth)
+            frames = sys._current_frames() if idents else {}
+            for ident in idents:
+                f = frames.get(ident)
+                stack: List[int] = []
+                while f is not None:
+                    stack.append(self._frame_id(f.f_code))
+                    f = f.f_back
+                if stack:
+                    per = self._samples.setdefault(ident, {})
+                    key = tuple(reversed(stack))
+                    per[key] = per.get(key, 0.0) + weight
+            if time.monotonic() > until:
+                break
+
+    def begin(self):
+        self._token = _current.set(self)
+        self._sampler = threading.Thread(target=self._sample_loop, name="profile-sampler", daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        """Cierra la sesión (en el mismo contexto que `begin`). Los hilos que sigan corriendo no suman."""
+        with self._lock:
+            self._closed = True
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join(timeout=2.0)
+        if self._token is not None:
+            _current.reset(self._token)
+            self._token = None
+        self.duration_ms = (time.perf_counter() - self._t0) * 1000.0
+
+    # ---------- artefactos
+
+    def cpu_stats(self) -> Optional[pstats.Stats]:
+        stats: Optional[pstats.Stats] = None
+        for prof in self._cpu:
+            if stats is None:
+                stats = pstats.Stats(prof)
+            else:
+                stats.add(prof)
+        return stats
+
+    def speedscope(self) -> Dict[str, Any]:
+        frames = [None] * len(self._frames)
+        for (file, line, fn), idx in self._frames.items():
+            frames[idx] = {"name": fn, "file": file, "line": line}
+        profiles = []
+        for ident, per in self._samples.items():
+            total = sum(per.values())
+            profiles.append({
+                "type": "sampled",
+                "name": self._names.get(ident, str(ident)),
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(total, 3),
+                "samples": [list(stack) for stack in per],
+                "weights": [round(w, 3) for w in per.values()],
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"{self.name} {self.id}",
+            "exporter": "kaikashi-profiling",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+    def summary(self, stats: Optional[pstats.Stats]) -> Dict[str, Any]:
+        """Lo más caro de agents/ y shared/: tiempo real (muestras) y CPU (cProfile)."""
+        names = {idx: key for key, idx in self._frames.items()}
+        wall_total: Dict[int, float] = {}
+        wall_self: Dict[int, float] = {}
+        for per in self._samples.values():
+            for stack, w in per.items():
+                for idx in set(stack):
+                    wall_total[idx] = wall_total.get(idx, 0.0) + w
+                wall_self[stack[-1]] = wall_self.get(stack[-1], 0.0) + w
+
+        def ours(file: str) -> bool:
+            return any(d in file for d in _OURS) and not file.endswith(_WRAPPERS)
+
+        def label(file: str, line: int, fn: str) -> str:
+            for d in _OURS:
+                if d in file:
+                    return f"{d.strip(os.sep)}/{file.split(d, 1)[1]}:{line}({fn})"
+            return f"{file}:{line}({fn})"
+
+        wall = sorted(
+            ({"function": label(*names[i]), "total_ms": round(t, 1), "self_ms": round(wall_self.get(i, 0.0), 1)}
+             for i, t in wall_total.items() if ours(names[i][0])),
+            key=lambda r: -r["total_ms"],
+        )[:_TOP]
+        cpu: List[Dict[str, Any]] = []
+        if stats is not None:
+            for (file, line, fn), (_cc, nc, tt, ct, _callers) in stats.stats.items():
+                if ours(file):
+                    cpu.append({"function": label(file, line, fn), "calls": nc,
+                                "cum_ms": round(ct * 1000.0, 1), "self_ms": round(tt * 1000.0, 1)})
+            cpu = sorted(cpu, key=lambda r: -r["cum_ms"])[:_TOP]
+        return {
+            "name": self.name,
+            "id": self.id,
+            "started_at": int(self.started_at * 1000),
+            "duration_ms": round(self.duration_ms, 1),
+            "threads": sorted(set(self._names.values())),
+            "interval_ms": settings.profile_interval_ms,
+            "wall": wall,
+            "cpu": cpu,
+        }
+
+    def save(self) -> Optional[str]:
+        """Sube los artefactos al bucket de assets. Devuelve el prefijo (o None si falló)."""
+        from .s3 import put_object
+        prefix = self.prefix
+        try:
+            stats = self.cpu_stats()
+            if stats is not None:
+                put_object(settings.s3_bucket_assets, prefix + "cpu.pstats", marshal.dumps(stats.stats),
+                           "application/octet-stream")
+            put_object(settings.s3_bucket_assets, prefix + "wall.speedscope.json",
+                       json.dumps(self.speedscope(), separators=(",", ":")).encode("utf-8"), "application/json")
+            put_object(settings.s3_bucket_assets, prefix + "summary.json",
+                       json.dumps(self.summary(stats), ensure_ascii=False, indent=1).encode("utf-8"),
+                       "application/json")
+        except Exception:
+            _count("save_errors")
+            return None
+        _count("saved")
+        return prefix
+
+def current() -> Optional[Session]:
+    return _current.get()
+
+def start(name: str, *, flag: Optional[str] = None, admin_token: Optional[str] = None) -> Optional[Session]:
+    """Abre una sesión en el contexto actual si la request la pide (o cae en el muestreo)."""
+    if not flag and settings.profile_sample_rate <= 0:
+        return None
+    if not wanted(flag, admin_token):
+        return None
+    session = Session(name)
+    session.begin()
+    _count("started")
+    return session
+
+def bound(fn: Callable) -> Callable:
+    """Para `tracing.bind`: si hay sesión activa, `fn` perfila el hilo en el que corra."""
+    session = _current.get()
+    return fn if session is None else functools.partial(session.run, fn)
+
+def attach(fn: Callable) -> Callable:
+    """Como `bound`, pero decide al llamar (p.ej. el endpoint síncrono que FastAPI corre en su pool)."""
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        session = _current.get()
+        return fn(*args, **kwargs) if session is None else session.run(fn, *args, **kwargs)
+    return run
+
+def _header(headers: Any, name: str) -> Optional[str]:
+    if not isinstance(headers, dict):
+        return None
+    n = name.lower()
+    for k, v in headers.items():
+        if k.lower() == n:
+            return v
+    return None
+
+def lambda_handler(function: str, handler: Callable) -> Callable:
+    """Handler Lambda perfilable: la invocación entera y los hilos que lance; añade `X-Profile-Key`."""
+    @functools.wraps(handler)
+    def run(event, ctx):
+        headers = event.get("headers") if isinstance(event, dict) else None
+        session = start(function, flag=_header(headers, "X-Profile"), admin_token=_header(headers, "X-Admin-Token"))
+        if session is None:
+            return handler(event, ctx)
+        try:
+            out = session.run(handler, event, ctx)
+        except BaseException:
+            session.stop()
+            session.save()   # el perfil de una invocación que falla también sirve
+            raise
+        session.stop()
+        prefix = session.save()
+        if prefix and isinstance(out, dict) and "statusCode" in out:
+            out["headers"] = {**(out.get("headers") or {}), "X-Profile-Key": prefix}
+        return out
+    return run
@@ -2,12 +2,16 @@ from __future__ import annotations
 import mimetypes
 from typing import Optional
 from .aws import s3_client
+from .config import settings
+from .tracing import traced
 
+@traced("s3.put_object")
 def put_object(bucket: str, key: str, data: bytes, content_type: Optional[str] = None):
     ct = content_type or (mimetypes.guess_type(key)[0] or "application/octet-stream")
     s3_client().put_object(Bucket=bucket, Key=key, Body=data, ContentType=ct)
 
-def presign_get(bucket: str, key: str, expires: int = 300, inline: bool = True) -> str:
+@traced("s3.presign")
+def presign_get(bucket: str, key: str, expires: Optional[int] = None, inline: bool = True) -> str:
     params = {"Bucket": bucket, "Key": key}
     if inline:
         params["ResponseContentDisposition"] = "inline"
@@ -17,10 +21,11 @@ def presign_get(bucket: str, key: str, expires: int = 300, inline: bool = True)
     return s3_client().generate_presigned_url(
         "get_object",
         Params=params,
-        ExpiresIn=expires,
+        ExpiresIn=expires or settings.presign_expiry_s,
         HttpMethod="GET",
     )
 
+@traced("s3.copy_object")
 def copy_object(src_bucket: str, src_key: str, dst_bucket: str, dst_key: str):
     s3_client().copy_object(
         Bucket=dst_bucket,
@@ -0,0 +1,178 @@
+from __future__ import annotations
+import re, time, unicodedata
+from array import array
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from . import counters
+from .cache import TTLCache
+from .config import settings
+from .dynamo import add_token_counts, delete_postings, get_postings, get_token_counts, put_postings, query_posting
+from .tracing import traced
+
+# Tokens del índice:
+#   w:<palabra>  palabras de título, tags y estilo (peso por campo, sumado)
+#   g:<tag>      tag completo normalizado (filtro `tags=`)
+#   y:<tipo>     product_type (filtro `type=`)
+FIELD_WEIGHTS = {"title": 3, "tags": 2, "style": 1}
+
+_WORD = re.compile(r"[a-z0-9]+")
+_STOP = frozenset(
+    "de del la las el los un una unos unas y o en con por para al a e su sus "
+    "the an of and or with for on in to by".split()
+)
+
+def fold(text: str) -> str:
+    t = unicodedata.normalize("NFKD", (text or "").lower())
+    return "".join(c for c in t if not unicodedata.combining(c))
+
+def words(text: str) -> List[str]:
+    return [w for w in _WORD.findall(fold(text)) if len(w) > 1 and w not in _STOP]
+
+def tag_token(tag: str) -> str:
+    return "g:" + "-".join(_WORD.findall(fold(tag)))
+
+def type_token(product_type: str) -> str:
+    return "y:" + fold(product_type).strip()
+
+def product_tokens(product: Dict[str, Any]) -> Dict[str, int]:
+    """Token -> peso para un product (título, tags, estilo, tipo)."""
+    out: Dict[str, int] = {}
+    tags = [t for t in (product.get("tags") or []) if str(t).strip()]
+    fields = {"title": product.get("title") or "", "tags": " ".join(map(str, tags)), "style": product.get("style") or ""}
+    for field, text in fields.items():
+        for w in set(words(text)):
+            out["w:" + w] = out.get("w:" + w, 0) + FIELD_WEIGHTS[field]
+    for t in tags:
+        tok = tag_token(str(t))
+        if tok != "g:":
+            out[tok] = FIELD_WEIGHTS["tags"]
+    if (product.get("product_type") or "").strip():
+        out[type_token(product["product_type"])] = 1
+    return out
+
+# ---------- escritura
+
+@traced("search.index")
+def index_product(product: Dict[str, Any]) -> int:
+    """Escribe los postings del product y suma 1 al contador de cada token. Devuelve cuántos tokens."""
+    toks = product_tokens(product)
+    if not toks:
+        return 0
+    ts = int(time.time() * 1000)
+    pid = product["product_id"]
+    put_postings([{"token": t, "product_id": pid, "w": w, "ts": ts} for t, w in toks.items()])
+    add_token_counts({t: 1 for t in toks})
+    for t in toks:
+        postings.pop(t)
+    return len(toks)
+
+def is_indexed(product: Dict[str, Any]) -> bool:
+    """¿Ya tiene postings? Mira uno solo de sus tokens (se escriben juntos al indexar)."""
+    toks = product_tokens(product)
+    if not toks:
+        return True
+    return bool(get_postings(next(iter(toks)), [product["product_id"]]))
+
+@traced("search.unindex")
+def unindex_product(product: Dict[str, Any]):
+    toks = product_tokens(product)
+    if not toks:
+        return
+    pid = product["product_id"]
+    delete_postings([(t, pid) for t in toks])
+    add_token_counts({t: -1 for t in toks})
+    for t in toks:
+        postings.pop(t)
+
+# ---------- posting lists en memoria (compactas)
+
+class Posting:
+    """Posting list ordenado por product_id: ids + pesos + ts en arrays paralelos."""
+    __slots__ = ("ids", "w", "ts")
+
+    def __init__(self, rows: Iterable[Dict[str, Any]]):
+        rows = sorted(rows, key=lambda r: r["product_id"])
+        self.ids: Tuple[str, ...] = tuple(r["product_id"] for r in rows)
+        self.w = array("H", (int(r.get("w") or 1) for r in rows))
+        self.ts = array("q", (int(r.get("ts") or 0) for r in rows))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def find(self, pid: str) -> int:
+        i = bisect_left(self.ids, pid)
+        return i if i < len(self.ids) and self.ids[i] == pid else -1
+
+postings = TTLCache(maxsize=settings.search_posting_max, ttl=settings.search_posting_ttl_s)
+
+def _load(token: str) -> Posting:
+    p = postings.get(token)
+    if p is None:
+        p = Posting(query_posting(token))
+        postings.set(token, p)
+    return p
+
+# ---------- consulta
+
+def query_tokens(q: str = "", tags: Optional[List[str]] = None, product_type: str = "") -> List[str]:
+    toks = ["w:" + w for w in dict.fromkeys(words(q))]
+    toks += [tag_token(t) for t in (tags or []) if tag_token(t) != "g:"]
+    if (product_type or "").strip():
+        toks.append(type_token(product_type))
+    return list(dict.fromkeys(toks))
+
+@traced("search.query")
+def search(q: str = "", tags: Optional[List[str]] = None, product_type: str = "",
+           limit: int = 20) -> List[Dict[str, Any]]:
+    """
+    AND de todos los tokens. Se parte del posting list más corto (según los
+    contadores) y el resto sólo se usa para comprobar esos candidatos: en memoria
+    si está cacheado o es corto, y si no con lecturas por clave (token, pid).
+    El coste depende del tamaño del resultado, no del catálogo.
+    Orden: suma de pesos desc, luego más reciente. Devuelve [{product_id, score, ts}].
+    """
+    stats = counters.group("search")
+    toks = query_tokens(q, tags, product_type)
+    if not toks:
+        return []
+    stats.incr("queries")
+    cached = {t: postings.get(t) for t in toks}
+    need = [t for t, p in cached.items() if p is None]
+    sizes = {t: len(p) for t, p in cached.items() if p is not None}
+    if need:
+        sizes.update(get_token_counts(need))
+    if any(sizes[t] <= 0 for t in toks):
+        return []
+
+    order = sorted(toks, key=lambda t: sizes[t])
+    base = cached.get(order[0])
+    if base is None:
+        base = _load(order[0])
+    scores: Dict[str, int] = {pid: base.w[i] for i, pid in enumerate(base.ids)}
+    newest: Dict[str, int] = {pid: base.ts[i] for i, pid in enumerate(base.ids)}
+    for t in order[1:]:
+        if not scores:
+            break
+        p = cached.get(t)
+        if p is None and sizes[t] <= settings.search_full_load_max:
+            p = _load(t)
+        if p is not None:
+            stats.incr("intersect_memory")
+            for pid in list(scores):
+                i = p.find(pid)
+                if i < 0:
+                    del scores[pid]
+                else:
+                    scores[pid] += p.w[i]
+        else:
+            stats.incr("intersect_probe")
+            hits = get_postings(t, list(scores))
+            for pid in list(scores):
+                h = hits.get(pid)
+                if h is None:
+                    del scores[pid]
+                else:
+                    scores[pid] += int(h.get("w") or 1)
+
+    ranked = sorted(scores.items(), key=lambda kv: (-kv[1], -newest.get(kv[0], 0)))[:max(1, limit)]
+    return [{"product_id": pid, "score": s, "ts": newest.get(pid, 0)} for pid, s in ranked]
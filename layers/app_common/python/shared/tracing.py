@@ -0,0 +1,200 @@
+from __future__ import annotations
+import contextvars, functools, json, threading, time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from .config import settings
+from .profiling import bound as _profiled, lambda_handler as _profiled_handler
+
+class Trace:
+    """
+    Spans (nombre, inicio, duración ms) de una request/invocación, medidos con reloj monotónico.
+    Las etapas que se repiten (p.ej. 'ddb.put_message') se agregan en `summary()`.
+    `counts` acumula contadores de la request (se emiten como métricas Count en EMF); como
+    `bind` lleva la traza a otros hilos, se suman con `incr` bajo `_lock`.
+    """
+    __slots__ = ("name", "t0", "spans", "counts", "_lock")
+
+    def __init__(self, name: str = "request"):
+        self.name = name
+        self.t0 = time.perf_counter()
+        self.spans: List[Tuple[str, float, float]] = []
+        self.counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, start: float, dur_ms: float):
+        self.spans.append((name, start, dur_ms))
+
+    def incr(self, name: str, n: int = 1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def counts_snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counts)
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.t0) * 1000.0
+
+    def summary(self) -> Dict[str, Any]:
+        stages: Dict[str, Dict[str, Any]] = {}
+        for name, _start, dur in list(self.spans):
+            st = stages.setdefault(name, {"count": 0, "ms": 0.0})
+            st["count"] += 1
+            st["ms"] += dur
+        for st in stages.values():
+            st["ms"] = round(st["ms"], 1)
+        out: Dict[str, Any] = {"total_ms": round(self.total_ms(), 1), "stages": stages}
+        counts = self.counts_snapshot()
+        if counts:
+            out["counts"] = counts
+        return out
+
+    def timeline(self) -> List[Dict[str, Any]]:
+        return [
+            {"name": n, "start_ms": round((s - self.t0) * 1000.0, 1), "ms": round(d, 1)}
+            for n, s, d in sorted(self.spans, key=lambda x: x[1])
+        ]
+
+_current: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("kkt_trace", default=None)
+
+class _Span:
+    __slots__ = ("trace", "name", "start")
+
+    def __init__(self, trace: Trace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_exc):
+        self.trace.add(self.name, self.start, (time.perf_counter() - self.start) * 1000.0)
+        return False
+
+class _NoopSpan:
+    __slots__ = ()
+    def __enter__(self): return self
+    def __exit__(self, *_exc): return False
+
+_NOOP = _NoopSpan()
+
+def enabled() -> bool:
+    return settings.tracing_enabled
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+def start(name: str = "request") -> Optional[contextvars.Token]:
+    """Abre una traza en el contexto actual. Devuelve None si el tracing está desactivado."""
+    if not settings.tracing_enabled:
+        return None
+    return _current.set(Trace(name))
+
+def finish(token: Optional[contextvars.Token]) -> Optional[Trace]:
+    if token is None:
+        return None
+    tr = _current.get()
+    _current.reset(token)
+    return tr
+
+def span(name: str):
+    """`with span("ddb.put_message"): ...` — no-op (sin asignaciones) si no hay traza activa."""
+    tr = _current.get()
+    if tr is None:
+        return _NOOP
+    return _Span(tr, name)
+
+def count(name: str, n: int = 1):
+    """Suma `n` al contador `name` de la traza activa (no-op sin traza)."""
+    tr = _current.get()
+    if tr is not None:
+        tr.incr(name, n)
+
+def traced(name: str) -> Callable:
+    """Decorador equivalente a envolver la función en `span(name)`."""
+    def deco(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            tr = _current.get()
+            if tr is None:
+                return fn(*args, **kwargs)
+            t = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                tr.add(name, t, (time.perf_counter() - t) * 1000.0)
+        return wrapper
+    return deco
+
+def bind(fn: Callable) -> Callable:
+    """
+    Propaga la traza (y demás contextvars) a otro hilo: `pool.submit(bind(fn), ...)`.
+    Con un perfilado activo (`shared/profiling.py`), el hilo se perfila mientras corre `fn`.
+    """
+    ctx = contextvars.copy_context()
+    return functools.partial(ctx.run, _profiled(fn))
+
+def server_timing(trace: Optional[Trace]) -> Optional[str]:
+    """Cabecera `Server-Timing` (RFC 8673 / W3C) con una entrada por etapa + total."""
+    if trace is None:
+        return None
+    s = trace.summary()
+    parts = []
+    for name, st in s["stages"].items():
+        entry = f"{name};dur={st['ms']}"
+        if st["count"] > 1:
+            entry += f';desc="x{st["count"]}"'
+        parts.append(entry)
+    parts.append(f"total;dur={s['total_ms']}")
+    return ", ".join(parts)
+
+def emf(trace: Optional[Trace], function: str, extra: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """
+    Línea CloudWatch Embedded Metric Format (se imprime a stdout en Lambda).
+    Una métrica (Milliseconds) por etapa, dimensión `Function`.
+    """
+    if trace is None:
+        return None
+    s = trace.summary()
+    metrics = [{"Name": "total", "Unit": "Milliseconds"}]
+    doc: Dict[str, Any] = {"Function": function, "total": s["total_ms"]}
+    for name, st in s["stages"].items():
+        metrics.append({"Name": name, "Unit": "Milliseconds"})
+        doc[name] = st["ms"]
+    for name, n in s.get("counts", {}).items():
+        metrics.append({"Name": name, "Unit": "Count"})
+        doc[name] = n
+    doc["_aws"] = {
+        "Timestamp": int(time.time() * 1000),
+        "CloudWatchMetrics": [{
+            "Namespace": settings.metrics_namespace,
+            "Dimensions": [["Function"]],
+            "Metrics": metrics,
+        }],
+    }
+    if extra:
+        for k, v in extra.items():
+            doc.setdefault(k, v)
+    return json.dumps(doc, ensure_ascii=False)
+
+def lambda_traced(function: str) -> Callable:
+    """
+    Decorador para handlers Lambda: abre la traza, emite la línea EMF al terminar.
+    Dentro del handler, `current()` da acceso al resumen (p.ej. para guardarlo en la conversación).
+    La invocación se perfila si trae `X-Profile` (admin) o cae en PROFILE_SAMPLE_RATE.
+    """
+    def deco(handler: Callable) -> Callable:
+        handler = _profiled_handler(function, handler)
+        @functools.wraps(handler)
+        def wrapper(event, ctx):
+            token = start(function)
+            if token is None:
+                return handler(event, ctx)
+            try:
+                return handler(event, ctx)
+            finally:
+                line = emf(finish(token), function)
+                if line:
+                    print(line)
+        return wrapper
+    return deco
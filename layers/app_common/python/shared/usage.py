@@ -0,0 +1,230 @@
+from __future__ import annotations
+import atexit, contextlib, contextvars, datetime, json, threading, time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from .config import settings
+
+# USD por 1M tokens (texto) o por imagen. Se empareja por substring del model id;
+# MODEL_PRICING_JSON permite sobreescribir/añadir entradas con el mismo formato.
+_DEFAULT_PRICING: Dict[str, Dict[str, float]] = {
+    "claude-sonnet-4":          {"in": 3.0,  "out": 15.0, "cache_read": 0.30, "cache_write": 3.75},
+    "claude-3-7-sonnet":        {"in": 3.0,  "out": 15.0, "cache_read": 0.30, "cache_write": 3.75},
+    "claude-3-5-sonnet":        {"in": 3.0,  "out": 15.0, "cache_read": 0.30, "cache_write": 3.75},
+    "claude-3-5-haiku":         {"in": 0.8,  "out": 4.0,  "cache_read": 0.08, "cache_write": 1.0},
+    "claude-3-haiku":           {"in": 0.25, "out": 1.25, "cache_read": 0.03, "cache_write": 0.30},
+    "titan-image-generator":    {"image": 0.01},
+    "stable-diffusion-xl":      {"image": 0.04},
+}
+
+def _pricing() -> Dict[str, Dict[str, float]]:
+    table = dict(_DEFAULT_PRICING)
+    if settings.model_pricing_json:
+        try:
+            table.update(json.loads(settings.model_pricing_json))
+        except Exception:
+            pass
+    return table
+
+_PRICING = _pricing()
+
+def price_for(model_id: str) -> Dict[str, float]:
+    mid = (model_id or "").lower()
+    for k in sorted(_PRICING, key=len, reverse=True):
+        if k in mid:
+            return _PRICING[k]
+    return {}
+
+@dataclass
+class CallUsage:
+    model_id: str
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_tokens: int = 0
+    cache_write_tokens: int = 0
+    latency_ms: int = 0
+    images: int = 0
+    cost_usd_micros: int = 0
+
+    def __post_init__(self):
+        if not self.cost_usd_micros:
+            p = price_for(self.model_id)
+            usd = (
+                self.input_tokens * p.get("in", 0.0)
+                + self.output_tokens * p.get("out", 0.0)
+                + self.cache_read_tokens * p.get("cache_read", 0.0)
+                + self.cache_write_tokens * p.get("cache_write", 0.0)
+            ) / 1e6 + self.images * p.get("image", 0.0)
+            self.cost_usd_micros = int(round(usd * 1e6))
+
+    def counters(self) -> Dict[str, int]:
+        c = {
+            "calls": 1,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cache_read_tokens": self.cache_read_tokens,
+            "cache_write_tokens": self.cache_write_tokens,
+            "latency_ms": self.latency_ms,
+            "images": self.images,
+            "cost_usd_micros": self.cost_usd_micros,
+        }
+        c[f"calls#{self.model_id}"] = 1
+        c[f"tokens#{self.model_id}"] = self.input_tokens + self.output_tokens
+        c[f"cost#{self.model_id}"] = self.cost_usd_micros
+        return c
+
+def from_agent_metrics(model_id: str, usage: Dict[str, Any], latency_ms: int) -> CallUsage:
+    """`usage` con el formato de strands/Bedrock (inputTokens, outputTokens, cacheRead/WriteInputTokens)."""
+    return CallUsage(
+        model_id=model_id,
+        input_tokens=int(usage.get("inputTokens", 0) or 0),
+        output_tokens=int(usage.get("outputTokens", 0) or 0),
+        cache_read_tokens=int(usage.get("cacheReadInputTokens", 0) or 0),
+        cache_write_tokens=int(usage.get("cacheWriteInputTokens", 0) or 0),
+        latency_ms=int(latency_ms or 0),
+    )
+
+# ---------- atribución por request
+
+@dataclass
+class Scope:
+    user_id: Optional[str] = None
+    conversation_id: Optional[str] = None
+    calls: List[CallUsage] = field(default_factory=list)
+
+    def totals(self) -> Dict[str, Any]:
+        t: Dict[str, Any] = {"calls": 0, "input_tokens": 0, "output_tokens": 0, "cache_read_tokens": 0,
+                             "cache_write_tokens": 0, "latency_ms": 0, "images": 0, "cost_usd_micros": 0}
+        for c in self.calls:
+            for k in t:
+                t[k] += 1 if k == "calls" else getattr(c, k)
+        t["cost_usd"] = round(t["cost_usd_micros"] / 1e6, 6)
+        t["models"] = sorted({c.model_id for c in self.calls})
+        return t
+
+_scope: contextvars.ContextVar[Optional[Scope]] = contextvars.ContextVar("kkt_usage_scope", default=None)
+
+@contextlib.contextmanager
+def scope(user_id: Optional[str] = None, conversation_id: Optional[str] = None) -> Iterator[Scope]:
+    """Atribuye al usuario/conversación todo lo que se registre dentro del bloque."""
+    sc = Scope(user_id=user_id, conversation_id=conversation_id)
+    token = _scope.set(sc)
+    try:
+        yield sc
+    finally:
+        _scope.reset(token)
+
+def current() -> Optional[Scope]:
+    return _scope.get()
+
+# ---------- agregación por lotes (contadores atómicos ADD en DynamoDB)
+
+def _keys_for(sc: Optional[Scope], day: str) -> List[Tuple[str, str]]:
+    keys: List[Tuple[str, str]] = []
+    uid = sc.user_id if sc and sc.user_id else "anonymous"
+    keys.append((f"user#{uid}", "all"))
+    keys.append((f"user#{uid}", f"day#{day}"))
+    if sc and sc.conversation_id:
+        keys.append((f"conv#{sc.conversation_id}", "all"))
+    return keys
+
+class _Batcher:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self._calls = 0
+        self._last_flush = time.monotonic()
+
+    def add(self, keys: List[Tuple[str, str]], counters: Dict[str, int]):
+        with self._lock:
+            for key in keys:
+                acc = self._pending.setdefault(key, {})
+                for k, v in counters.items():
+                    if v:
+                        acc[k] = acc.get(k, 0) + v
+            self._calls += 1
+            due = (self._calls >= settings.usage_flush_calls
+                   or time.monotonic() - self._last_flush >= settings.usage_flush_secs)
+        if due:
+            self.flush()
+
+    def _take(self) -> Dict[Tuple[str, str], Dict[str, int]]:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._calls = 0
+            self._last_flush = time.monotonic()
+        return pending
+
+    def _restore(self, key: Tuple[str, str], counters: Dict[str, int]):
+        with self._lock:
+            acc = self._pending.setdefault(key, {})
+            for k, v in counters.items():
+                acc[k] = acc.get(k, 0) + v
+
+    def flush(self) -> int:
+        pending = self._take()
+        if not pending:
+            return 0
+        from .dynamo import add_usage_counters
+        written = 0
+        for (scope_id, period), counters in pending.items():
+            try:
+                add_usage_counters(scope_id, period, counters)
+                written += 1
+            except Exception:
+                # se reintenta en el próximo flush
+                self._restore((scope_id, period), counters)
+        return written
+
+    def pending(self) -> Dict[Tuple[str, str], Dict[str, int]]:
+        with self._lock:
+            return {k: dict(v) for k, v in self._pending.items()}
+
+_batcher = _Batcher()
+atexit.register(lambda: _batcher.flush())
+
+def record(u: CallUsage):
+    """Registra una llamada: la suma a la request actual y al lote pendiente."""
+    sc = _scope.get()
+    if sc is not None:
+        sc.calls.append(u)
+    if not settings.usage_enabled:
+        return
+    day = datetime.datetime.utcnow().strftime("%Y-%m-%d")
+    _batcher.add(_keys_for(sc, day), u.counters())
+
+def flush() -> int:
+    """Escribe los contadores pendientes (1 update por clave, no por llamada)."""
+    if not settings.usage_enabled:
+        return 0
+    return _batcher.flush()
+
+def pending() -> Dict[Tuple[str, str], Dict[str, int]]:
+    return _batcher.pending()
+
+def summarize(items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Convierte los items del scope (periodos 'all' y 'day#...') en un resumen JSON."""
+    def one(it: Dict[str, Any]) -> Dict[str, Any]:
+        out: Dict[str, Any] = {}
+        models: Dict[str, Dict[str, int]] = {}
+        for k, v in it.items():
+            if k in ("scope_id", "period"):
+                continue
+            if "#" in k:
+                metric, _, mid = k.partition("#")
+                models.setdefault(mid, {})[metric] = int(v)
+            else:
+                out[k] = int(v)
+        out["cost_usd"] = round(out.get("cost_usd_micros", 0) / 1e6, 6)
+        if models:
+            out["by_model"] = models
+        return out
+
+    total: Dict[str, Any] = {}
+    days: Dict[str, Any] = {}
+    for it in items:
+        period = it.get("period", "")
+        if period == "all":
+            total = one(it)
+        elif period.startswith("day#"):
+            days[period[4:]] = one(it)
+    return {"total": total, "days": dict(sorted(days.items()))}
@@ -0,0 +1,295 @@
+"""
+Backfill offline del catálogo: lee ideas de un CSV o JSONL y por cada fila ejecuta
+interpret -> generate_assets -> product + listing (lo mismo que /create, sin conversación).
+
+Uso:
+    python scripts/catalog_backfill.py ideas.csv --user-id user_catalog --workers 8 --procs 4
+    python scripts/catalog_backfill.py ideas.jsonl --checkpoint ideas.ckpt.jsonl     # reanuda donde quedó
+    python scripts/catalog_backfill.py ideas.csv --local --limit 50                  # contra bench/stubs.py
+
+Entrada: campo/columna `q` (o `idea`); opcionales `id`, `user_id`, `price_cents`.
+
+- Bedrock, S3 y DynamoDB corren en `--workers` hilos; los renders de CPU (DOCX, GIF)
+  en `--procs` procesos (0 = en el mismo hilo).
+- Cada fila terminada (ok, clarify o error) se añade al checkpoint (JSONL, una línea
+  por fila). Al relanzar se saltan las filas ya ok/clarify y se reintentan las que
+  fallaron. El id de fila es `id` si viene, o `línea:hash(q)`.
+- product_id/listing_id se derivan de `user_id#id de fila`: una fila que llegó a publicarse
+  pero no al checkpoint (corte, fallo al indexar) no se duplica al reanudar; sólo se
+  completan índice y feed.
+- Corre en modo batch (sin cuota por usuario; sí cola justa y bucket global) y
+  reintenta rechazos/throttling. Tras `--max-consecutive-errors` fallos seguidos deja
+  de lanzar filas, espera las que corren y sale con código 2 para reanudar más tarde.
+"""
+from __future__ import annotations
+import argparse, contextlib, csv, hashlib, io, json, multiprocessing, os, sys, threading, time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAYER = os.path.join(ROOT, "layers", "app_common", "python")
+for p in (ROOT, LAYER):
+    if p not in sys.path:
+        sys.path.insert(0, p)
+
+DONE_STATUSES = ("ok", "clarify")
+
+# ---------- entrada
+
+def row_id(n: int, q: str, explicit: Any = None) -> str:
+    if explicit not in (None, ""):
+        return str(explicit)
+    return f"{n}:{hashlib.sha1(q.encode('utf-8')).hexdigest()[:10]}"
+
+def _row(n: int, rec: Dict[str, Any], default_user: str, default_price: int) -> Optional[Dict[str, Any]]:
+    q = str(rec.get("q") or rec.get("idea") or "").strip()
+    if not q:
+        return None
+    return {
+        "id": row_id(n, q, rec.get("id")),
+        "q": q,
+        "user_id": str(rec.get("user_id") or default_user),
+        "price_cents": int(rec.get("price_cents") or default_price),
+    }
+
+def read_rows(path: str, default_user: str, default_price: int) -> Iterator[Dict[str, Any]]:
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.lower().endswith((".jsonl", ".ndjson")):
+            for n, line in enumerate(f, 1):
+                line = line.strip()
+                if line:
+                    row = _row(n, json.loads(line), default_user, default_price)
+                    if row:
+                        yield row
+        else:
+            for n, rec in enumerate(csv.DictReader(f), 2):
+                row = _row(n, rec, default_user, default_price)
+                if row:
+                    yield row
+
+# ---------- checkpoint
+
+class Checkpoint:
+    """Append-only JSONL; la última línea de cada id manda. Thread-safe."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done: Set[str] = set()
+        if os.path.exists(path):
+            last: Dict[str, str] = {}
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        e = json.loads(line)
+                    except ValueError:
+                        continue  # línea a medio escribir tras un corte
+                    last[str(e.get("id"))] = e.get("status")
+            self.done = {k for k, st in last.items() if st in DONE_STATUSES}
+        self._f = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def record(self, entry: Dict[str, Any]):
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._f.write(line)
+            self._f.flush()
+            if entry.get("status") in DONE_STATUSES:
+                self.done.add(entry["id"])
+
+    def close(self):
+        with self._lock:
+            self._f.flush()
+            os.fsync(self._f.fileno())
+            self._f.close()
+
+# ---------- progreso
+
+def _fmt_s(s: float) -> str:
+    s = int(max(0, s))
+    h, rem = divmod(s, 3600)
+    m, sec = divmod(rem, 60)
+    return f"{h}h{m:02d}m" if h else f"{m}m{sec:02d}s"
+
+class Progress:
+    def __init__(self, total: int, skipped: int):
+        self.total = total
+        self.skipped = skipped
+        self.t0 = time.perf_counter()
+        self.counts: Dict[str, int] = {"ok": 0, "clarify": 0, "error": 0}
+        self.ms: List[float] = []
+        self.stopped = False
+        self._lock = threading.Lock()
+
+    def add(self, status: str, ms: float):
+        with self._lock:
+            self.counts[status] = self.counts.get(status, 0) + 1
+            self.ms.append(ms)
+
+    def processed(self) -> int:
+        return sum(self.counts.values())
+
+    def rate(self) -> float:
+        el = time.perf_counter() - self.t0
+        return self.processed() / el if el > 0 else 0.0
+
+    def line(self) -> str:
+        n = self.processed()
+        todo = self.total - self.skipped
+        rate = self.rate()
+        eta = (todo - n) / rate if rate > 0 else float("inf")
+        c = self.counts
+        return (f"{self.skipped + n}/{self.total} ({(self.skipped + n) / max(1, self.total) * 100:.1f}%)  "
+                f"ok={c['ok']} clarify={c['clarify']} error={c['error']}  "
+                f"{rate * 60:.1f}/min  ETA {_fmt_s(eta) if eta != float('inf') else '?'}")
+
+    def summary(self) -> Dict[str, Any]:
+        xs = sorted(self.ms)
+        pct = lambda p: round(xs[min(len(xs) - 1, int(p / 100.0 * len(xs)))], 1) if xs else 0.0  # noqa: E731
+        el = time.perf_counter() - self.t0
+        return {
+            "total_rows": self.total,
+            "skipped_from_checkpoint": self.skipped,
+            "processed": self.processed(),
+            "remaining": self.total - self.skipped - self.counts["ok"] - self.counts["clarify"],
+            "statuses": dict(self.counts),
+            "elapsed_s": round(el, 1),
+            "throughput_per_min": round(self.rate() * 60, 2),
+            "p50_ms": pct(50), "p95_ms": pct(95),
+        }
+
+# ---------- ejecución
+
+def _process_renderer(pool: ProcessPoolExecutor) -> Callable[..., bytes]:
+    def render(fn: Callable[..., bytes], *args: Any) -> bytes:
+        return pool.submit(fn, *args).result()
+    return render
+
+def run(rows: List[Dict[str, Any]], ckpt: Checkpoint, *, workers: int, procs: int,
+        max_consecutive_errors: int, progress_every: float) -> Progress:
+    from agents.batch import catalog_item
+    from shared import admission
+
+    todo = [r for r in rows if r["id"] not in ckpt.done]
+    prog = Progress(len(rows), len(rows) - len(todo))
+    print(f"{len(rows)} filas, {prog.skipped} ya hechas según {ckpt.path}; quedan {len(todo)}", file=sys.stderr)
+    if not todo:
+        return prog
+
+    proc_pool = ProcessPoolExecutor(max_workers=procs, mp_context=multiprocessing.get_context("spawn")) \
+        if procs > 0 else None
+    render = _process_renderer(proc_pool) if proc_pool else None
+    streak = 0
+    stop = threading.Event()
+
+    def one(row: Dict[str, Any]) -> Dict[str, Any]:
+        t = time.perf_counter()
+        try:
+            with admission.batch_mode():
+                res = catalog_item(row["q"], row["user_id"], row["price_cents"], render=render, key=row["id"])
+            entry = {"id": row["id"], "status": "clarify" if res.pop("clarify") else "ok", **res}
+        except Exception as e:
+            entry = {"id": row["id"], "status": "error", "error": f"{type(e).__name__}: {e}"}
+        entry["ms"] = round((time.perf_counter() - t) * 1000.0, 1)
+        return entry
+
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backfill")
+    it = iter(todo)
+    running: Dict[Future, Dict[str, Any]] = {}
+    last_print = time.perf_counter()
+    try:
+        while True:
+            # ventana acotada: no se materializan decenas de miles de futures
+            while not stop.is_set() and len(running) < workers * 2:
+                row = next(it, None)
+                if row is None:
+                    break
+                running[pool.submit(one, row)] = row
+            if not running:
+                break
+            done, _ = wait(list(running), timeout=progress_every, return_when=FIRST_COMPLETED)
+            for fut in done:
+                running.pop(fut)
+                entry = fut.result()
+                ckpt.record(entry)
+                prog.add(entry["status"], entry["ms"])
+                streak = streak + 1 if entry["status"] == "error" else 0
+                if max_consecutive_errors and streak >= max_consecutive_errors and not stop.is_set():
+                    print(f"{streak} errores seguidos (último: {entry.get('error')}); deteniendo", file=sys.stderr)
+                    stop.set()
+            if time.perf_counter() - last_print >= progress_every:
+                print(prog.line(), file=sys.stderr)
+                last_print = time.perf_counter()
+    except KeyboardInterrupt:
+        stop.set()
+        print("interrumpido; esperando filas en curso…", file=sys.stderr)
+        for fut in list(running):
+            if fut.cancel():
+                running.pop(fut)
+        for fut in list(running):
+            entry = fut.result()
+            ckpt.record(entry)
+            prog.add(entry["status"], entry["ms"])
+        raise
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        if proc_pool is not None:
+            proc_pool.shutdown(wait=True, cancel_futures=True)
+    prog.stopped = stop.is_set()
+    print(prog.line(), file=sys.stderr)
+    return prog
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Backfill offline del catálogo (ideas -> product + listing)")
+    ap.add_argument("input", help="CSV (columna q/idea) o JSONL")
+    ap.add_argument("--checkpoint", help="Archivo de progreso (por defecto <input>.ckpt.jsonl)")
+    ap.add_argument("--user-id", default="user_catalog", help="Dueño si la fila no trae user_id")
+    ap.add_argument("--price-cents", type=int, default=1500)
+    ap.add_argument("--workers", type=int, default=8, help="Hilos para Bedrock/S3/DynamoDB")
+    ap.add_argument("--procs", type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                    help="Procesos para renders DOCX/GIF (0 = en línea)")
+    ap.add_argument("--limit", type=int, default=None, help="Procesa como mucho N filas pendientes")
+    ap.add_argument("--max-consecutive-errors", type=int, default=25)
+    ap.add_argument("--progress-every", type=float, default=10.0, help="Segundos entre líneas de progreso")
+    ap.add_argument("--local", action="store_true", help="Usa moto + Bedrock falso (bench/stubs.py)")
+    ap.add_argument("--json", help="Escribe el resumen en este archivo")
+    args = ap.parse_args(argv)
+
+    local = None
+    if args.local:
+        sys.path.insert(0, os.path.join(ROOT, "bench"))
+        from stubs import install_local_aws
+        local = install_local_aws()
+
+    ckpt = Checkpoint(args.checkpoint or args.input + ".ckpt.jsonl")
+    try:
+        rows = list(read_rows(args.input, args.user_id, args.price_cents))
+        if args.limit is not None:
+            pending = [r for r in rows if r["id"] not in ckpt.done][:args.limit]
+            keep = {r["id"] for r in pending}
+            rows = [r for r in rows if r["id"] in keep or r["id"] in ckpt.done]
+        # El callback por defecto de strands imprime el stream del modelo en stdout.
+        with contextlib.redirect_stdout(io.StringIO()):
+            prog = run(rows, ckpt, workers=max(1, args.workers), procs=max(0, args.procs),
+                       max_consecutive_errors=args.max_consecutive_errors, progress_every=args.progress_every)
+    except KeyboardInterrupt:
+        print(f"checkpoint en {ckpt.path}; relanza el mismo comando para reanudar", file=sys.stderr)
+        return 130
+    finally:
+        ckpt.close()
+        from shared import usage
+        usage.flush()
+        if local is not None:
+            local.stop()
+
+    summary = prog.summary()
+    print(json.dumps(summary, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    if prog.stopped:
+        print(f"detenido por errores; checkpoint en {ckpt.path}", file=sys.stderr)
+        return 2
+    return 1 if summary["statuses"]["error"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
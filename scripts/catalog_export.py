@@ -0,0 +1,82 @@
+"""
+Export completo de products, listings, conversations y messages con Scan paralelo.
+
+Uso:
+    python scripts/catalog_export.py ./export_2024_06                      # directorio local
+    python scripts/catalog_export.py s3://kkt-assets-dev/exports/2024-06 --segments 16 --max-rcu 400
+    python scripts/catalog_export.py ./exp --tables products,listings --format parquet
+    python scripts/catalog_export.py ./exp --local                          # contra bench/stubs.py
+
+- Cada tabla se lee en `--segments` segmentos paralelos (`--workers` hilos para todas
+  las tablas) y se escribe en partes `<tabla>/part-<segmento>-<n>.ndjson.gz` (o
+  `.parquet` con pyarrow) de hasta ~`--part-items` items.
+- `--max-rcu` limita la lectura total (RCU/s) para no quitarle capacidad al tráfico vivo.
+- El progreso por segmento queda en `<destino>/_state.json`. Relanzar el mismo comando
+  continúa desde la última parte escrita; con Ctrl+C se cierra limpio (código 130).
+"""
+from __future__ import annotations
+import argparse, json, os, sys, time
+from typing import List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAYER = os.path.join(ROOT, "layers", "app_common", "python")
+for p in (ROOT, LAYER):
+    if p not in sys.path:
+        sys.path.insert(0, p)
+
+def _line(snap) -> str:
+    parts = [f"{n}: {t['items']} items, {t['segments_done']}/{snap['segments']} seg" for n, t in snap["tables"].items()]
+    return f"[{snap['status']}] " + " | ".join(parts)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Export de tablas DynamoDB a NDJSON.gz/Parquet (local o S3)")
+    ap.add_argument("dest", help="Directorio local o s3://bucket/prefijo")
+    ap.add_argument("--tables", help="Lista separada por comas (por defecto todas)")
+    ap.add_argument("--segments", type=int, default=None, help="TotalSegments del Scan (fijo al reanudar)")
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--max-rcu", type=float, default=None, help="RCU/s para todo el export (0 = sin límite)")
+    ap.add_argument("--format", choices=("ndjson", "parquet", "auto"), default=None)
+    ap.add_argument("--part-items", type=int, default=None)
+    ap.add_argument("--progress-every", type=float, default=10.0, help="Segundos entre líneas de progreso")
+    ap.add_argument("--local", action="store_true", help="Usa moto (bench/stubs.py)")
+    args = ap.parse_args(argv)
+
+    local = None
+    if args.local:
+        sys.path.insert(0, os.path.join(ROOT, "bench"))
+        from stubs import install_local_aws
+        local = install_local_aws()
+
+    from shared.export import ExportJob
+    try:
+        job = ExportJob(args.dest, [t.strip() for t in args.tables.split(",") if t.strip()] if args.tables else None,
+                        segments=args.segments, workers=args.workers, max_rcu=args.max_rcu,
+                        fmt=args.format, part_items=args.part_items)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 2
+
+    t0 = time.perf_counter()
+    print(f"export {job.run_id} -> {job.dest} ({job.fmt}, {job.segments} segmentos)", file=sys.stderr)
+    try:
+        job.start()
+        while job.thread.is_alive():
+            job.thread.join(args.progress_every)
+            print(_line(job.snapshot()), file=sys.stderr)
+    except KeyboardInterrupt:
+        job.stop()
+        print("interrumpido; cerrando segmentos…", file=sys.stderr)
+        job.thread.join()
+        print(f"estado en {job.sink.url('_state.json')}; relanza el mismo comando para reanudar", file=sys.stderr)
+        return 130
+    finally:
+        if local is not None:
+            local.stop()
+
+    snap = job.snapshot()
+    snap["elapsed_s"] = round(time.perf_counter() - t0, 1)
+    print(json.dumps(snap, indent=2))
+    return 0 if snap["status"] == "done" else 1
+
+if __name__ == "__main__":
+    sys.exit(main())